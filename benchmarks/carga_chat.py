@@ -0,0 +1,598 @@
+"""
+carga_chat.py — Generador de carga de extremo a extremo para el servidor de chat
+
+Levanta un servidor (ServidorChat o ServidorChatAsync) en un puerto efímero
+con datos en un directorio temporal y lo carga con miles de usuarios
+simulados, sin la interfaz Tk: cada usuario es un socket no bloqueante que
+usa `ProtocoloCliente` y `DecodificadorTramas` del cliente real. Los usuarios
+se reparten entre las salas (uniforme o con sesgo tipo Zipf), envían HELLO y
+JOIN_SALA, y luego mensajes MSG a la tasa total indicada. Con --protocolo
+binario ofrecen la capacidad "bin" en el HELLO y, una vez aceptada, envían y
+reciben tramas binarias.
+
+Cada MSG lleva la hora programada de envío; la latencia de una entrega es el
+tiempo desde esa hora hasta que un miembro de la sala la recibe. Se mide
+desde la hora programada (no la real) para que un generador atrasado no
+oculte la espera.
+
+Informa latencia de entrega (p50 / p90 / p99 / p99.9 / máx), mensajes y
+entregas por segundo, entregas perdidas y memoria residente (RSS) del
+servidor. Cada ejecución se agrega como una línea JSON a --salida; con
+--comparar se compara con la ejecución anterior de los mismos parámetros.
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/carga_chat.py
+    python benchmarks/carga_chat.py --usuarios 2000 --salas 20 --tasa 500 --duracion 20
+    python benchmarks/carga_chat.py --modo asyncio --backend sqlite --procesos 2
+    python benchmarks/carga_chat.py --trabajadores 4 --procesos 2
+    python benchmarks/carga_chat.py --sesgo 1.0 --comparar
+    python benchmarks/carga_chat.py --protocolo binario --comparar
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import selectors
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SALIDA_POR_DEFECTO = os.path.join(RAIZ, "benchmarks", "resultados", "carga_chat.jsonl")
+
+# Parámetros que deben coincidir para comparar dos ejecuciones
+PARAMETROS_COMPARABLES = ("modo", "trabajadores", "protocolo", "backend", "usuarios", "salas", "sesgo",
+                          "tasa", "tamaño", "duracion")
+
+# Valor de los parámetros agregados después, para comparar con resultados antiguos
+PARAMETROS_POR_DEFECTO = {"trabajadores": 1, "protocolo": "texto"}
+
+
+def _ampliar_limite_descriptores():
+    """Sube el límite blando de descriptores al máximo: cada usuario es un socket."""
+    try:
+        import resource
+        blando, duro = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if duro == resource.RLIM_INFINITY or duro > blando:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (duro, duro))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+# ------------------ SERVIDOR ------------------
+
+def _servir(puerto, carpeta, modo, backend, trabajadores):
+    """
+    Ejecuta el servidor en este proceso (modo interno --servidor).
+
+    Se lanza como un intérprete aparte porque el cliente y el servidor tienen
+    cada uno su propio módulo `config`. Con más de un trabajador se usa el
+    servidor multiproceso (siempre con hilos).
+    """
+    sys.path.insert(0, os.path.join(RAIZ, "servidor"))
+    import config
+    config.SERVIDOR_HOST = "127.0.0.1"
+    config.SERVIDOR_PUERTO = puerto
+    config.MODO_SERVIDOR = modo
+    config.PROCESOS_SERVIDOR = trabajadores
+    config.BACKEND_HISTORIAL = backend
+    config.ARCHIVO_HISTORIAL = os.path.join(carpeta, "historial.json")
+    config.ARCHIVO_HISTORIAL_JSONL = os.path.join(carpeta, "historial.jsonl")
+    config.ARCHIVO_HISTORIAL_SQLITE = os.path.join(carpeta, "historial.db")
+    config.NIVEL_REGISTRO = "error"
+    config.METRICAS_PUERTO = 0
+    _ampliar_limite_descriptores()
+    if trabajadores > 1:
+        from multiproceso import Coordinador
+        Coordinador(trabajadores).iniciar()
+    elif modo == "asyncio":
+        from nucleo_servidor_async import ServidorChatAsync
+        ServidorChatAsync().iniciar()
+    else:
+        from nucleo_servidor import ServidorChat
+        ServidorChat().iniciar()
+
+
+def _puerto_libre():
+    """Pide al sistema un puerto efímero libre."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def iniciar_servidor(modo, backend, trabajadores=1):
+    """
+    Lanza el servidor en un proceso aparte y espera a que acepte conexiones.
+
+    Returns:
+        tuple: (subprocess.Popen, puerto, carpeta de datos).
+    """
+    puerto = _puerto_libre()
+    carpeta = tempfile.mkdtemp(prefix="carga_chat_")
+    proceso = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--servidor", str(puerto), carpeta, modo, backend,
+         str(trabajadores)],
+        stdout=subprocess.DEVNULL,
+    )
+    limite = time.monotonic() + 15
+    while time.monotonic() < limite:
+        try:
+            socket.create_connection(("127.0.0.1", puerto), timeout=1).close()
+            return proceso, puerto, carpeta
+        except OSError:
+            if proceso.poll() is not None:
+                break
+            time.sleep(0.1)
+    proceso.kill()
+    shutil.rmtree(carpeta, ignore_errors=True)
+    raise RuntimeError("El servidor no arrancó")
+
+
+def detener_servidor(proceso, carpeta):
+    """Cierra el servidor con Ctrl+C (vacía el historial) y borra sus datos."""
+    if hasattr(signal, "SIGINT"):
+        proceso.send_signal(signal.SIGINT)
+    else:
+        proceso.terminate()
+    try:
+        proceso.wait(15)
+    except subprocess.TimeoutExpired:
+        proceso.kill()
+        proceso.wait()
+    shutil.rmtree(carpeta, ignore_errors=True)
+
+
+def rss_mb(pid):
+    """
+    Memoria residente del proceso y sus descendientes (trabajadores del
+    servidor multiproceso) en MiB (None si no se puede leer; solo Linux).
+    """
+    total = None
+    pendientes = [pid]
+    while pendientes:
+        actual = pendientes.pop()
+        try:
+            with open(f"/proc/{actual}/status", encoding="ascii") as f:
+                for linea in f:
+                    if linea.startswith("VmRSS:"):
+                        total = (total or 0) + int(linea.split()[1]) / 1024
+            for tarea in os.listdir(f"/proc/{actual}/task"):
+                with open(f"/proc/{actual}/task/{tarea}/children", encoding="ascii") as f:
+                    pendientes.extend(int(hijo) for hijo in f.read().split())
+        except OSError:
+            pass
+    return total
+
+
+class MuestreoRSS:
+    """Hilo que muestrea el RSS del servidor y guarda el máximo."""
+
+    def __init__(self, pid, intervalo=0.25):
+        self.pid = pid
+        self.intervalo = intervalo
+        self.pico = None
+        self._fin = threading.Event()
+        self._hilo = threading.Thread(target=self._muestrear, daemon=True)
+
+    def iniciar(self):
+        self._hilo.start()
+
+    def detener(self):
+        self._fin.set()
+        self._hilo.join()
+        return self.pico
+
+    def _muestrear(self):
+        while not self._fin.wait(self.intervalo):
+            valor = rss_mb(self.pid)
+            if valor is not None:
+                self.pico = max(self.pico or 0, valor)
+
+
+# ------------------ USUARIOS SIMULADOS ------------------
+
+def repartir(usuarios, salas, sesgo):
+    """
+    Asigna una sala a cada usuario.
+
+    Args:
+        sesgo (float): 0 reparte por igual; s > 0 da a la sala k un peso
+            1 / (k + 1)^s (pocas salas muy pobladas y muchas pequeñas).
+
+    Returns:
+        list: Nombre de sala de cada usuario.
+    """
+    nombres = [f"carga_{k}" for k in range(salas)]
+    if sesgo <= 0:
+        return [nombres[i % salas] for i in range(usuarios)]
+    pesos = [1 / (k + 1) ** sesgo for k in range(salas)]
+    total = sum(pesos)
+    cuotas = [int(usuarios * p / total) for p in pesos]
+    for k in range(usuarios - sum(cuotas)):
+        cuotas[k % salas] += 1
+    return [nombres[k] for k in range(salas) for _ in range(cuotas[k])]
+
+
+class _Usuario:
+    """Estado de un usuario simulado (un socket)."""
+
+    __slots__ = ("sock", "sala", "decodificador", "salida", "unido")
+
+    def __init__(self, sock, sala, decodificador):
+        self.sock = sock
+        self.sala = sala
+        self.decodificador = decodificador
+        self.salida = bytearray()
+        self.unido = False
+
+
+def _trabajador(puerto, asignados, tasa, tamaño, calentamiento, duracion, espera,
+                binario, barrera, inicio_comun, resultados):
+    """
+    Proceso de carga: conecta sus usuarios, espera a los demás procesos y
+    envía y recibe durante calentamiento + duracion segundos.
+
+    Args:
+        asignados (list): Pares (nombre, sala) de los usuarios de este proceso.
+        tasa (float): Mensajes por segundo que envía este proceso.
+        binario (bool): Negociar el protocolo binario en el HELLO.
+        barrera (Barrier): Se cruza dos veces: al tener todos los usuarios
+            unidos y cuando el proceso principal fijó `inicio_comun`.
+        inicio_comun (Value): Hora de inicio común a todos los procesos, para
+            que todos usen la misma ventana de medición.
+
+    Pone en `resultados` un dict con latencias (segundos), mensajes enviados
+    por sala en la ventana de medición y entregas recibidas de esa ventana.
+    """
+    sys.path.insert(0, os.path.join(RAIZ, "cliente"))
+    from protocolo_cliente import ProtocoloCliente, DecodificadorTramas, CAPACIDAD_BINARIA
+    _ampliar_limite_descriptores()
+
+    selector = selectors.DefaultSelector()
+    usuarios = []
+    salas_ids = {}
+    hello = f"|+{CAPACIDAD_BINARIA}" if binario else ""
+    for nombre, sala in asignados:
+        sock = socket.create_connection(("127.0.0.1", puerto))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # JOIN_SALA va en texto: el servidor acepta los dos formatos en cualquier momento
+        sock.sendall(ProtocoloCliente.codificar_trama(f"HELLO#{nombre}{hello}")
+                     + ProtocoloCliente.codificar_trama(f"JOIN_SALA#{sala}"))
+        sock.setblocking(False)
+        usuario = _Usuario(sock, sala, DecodificadorTramas(tamaño_recepcion=65536, binario=binario))
+        selector.register(sock, selectors.EVENT_READ, usuario)
+        usuarios.append(usuario)
+
+    latencias = []
+    medir = {"desde": float("inf")}
+    recibidas = [0]
+
+    def leer(usuario):
+        try:
+            tramas = usuario.decodificador.recibir(usuario.sock)
+        except (BlockingIOError, InterruptedError):
+            return
+        if tramas is None:
+            raise ConnectionError("El servidor cerró una conexión de carga")
+        ahora = time.time()
+        for trama in tramas:
+            comando, datos, _ = ProtocoloCliente.decodificar_trama(trama, salas_ids)
+            if comando == "CHAT":
+                texto = ProtocoloCliente.procesar_chat(datos)[2]
+                marca = texto.find(": carga ")
+                if marca < 0:
+                    continue
+                enviado = float(texto[marca + 8:texto.index(" ", marca + 8)])
+                if enviado >= medir["desde"]:
+                    latencias.append(ahora - enviado)
+                    recibidas[0] += 1
+            elif comando == "OK" and datos.startswith("Te has unido"):
+                usuario.unido = True
+
+    def escribir(usuario):
+        try:
+            enviados = usuario.sock.send(usuario.salida)
+        except (BlockingIOError, InterruptedError):
+            return
+        del usuario.salida[:enviados]
+        if not usuario.salida:
+            selector.modify(usuario.sock, selectors.EVENT_READ, usuario)
+
+    def enviar(usuario, trama):
+        if not usuario.salida:
+            try:
+                enviados = usuario.sock.send(trama)
+            except (BlockingIOError, InterruptedError):
+                enviados = 0
+            if enviados == len(trama):
+                return
+            trama = trama[enviados:]
+            selector.modify(usuario.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, usuario)
+        usuario.salida += trama
+
+    def atender(timeout):
+        eventos = selector.select(timeout)
+        for clave, mascara in eventos:
+            if mascara & selectors.EVENT_WRITE:
+                escribir(clave.data)
+            if mascara & selectors.EVENT_READ:
+                leer(clave.data)
+        return len(eventos)
+
+    # Esperar la confirmación de todas las uniones
+    limite = time.monotonic() + 120
+    while not all(u.unido for u in usuarios) and time.monotonic() < limite:
+        atender(0.1)
+    barrera.wait()
+    barrera.wait()
+
+    inicio = inicio_comun.value
+    medir["desde"] = inicio + calentamiento
+    fin_envio = medir["desde"] + duracion
+    intervalo = 1 / tasa if tasa > 0 else None
+    relleno = "x" * tamaño
+    enviados_por_sala = {}
+    proximo = inicio
+    turno = 0
+    ultima_lectura = time.monotonic()
+
+    while True:
+        ahora = time.time()
+        if intervalo is not None:
+            # Enviar todo lo que ya debía salir (si hay atraso, en ráfaga)
+            while proximo <= ahora and proximo < fin_envio:
+                usuario = usuarios[turno % len(usuarios)]
+                turno += 1
+                enviar(usuario, ProtocoloCliente.codificar("MSG", f"carga {proximo:.6f} {relleno}", binario))
+                if proximo >= medir["desde"]:
+                    enviados_por_sala[usuario.sala] = enviados_por_sala.get(usuario.sala, 0) + 1
+                proximo += intervalo
+        if ahora >= fin_envio:
+            inactivo = time.monotonic() - ultima_lectura
+            if ahora >= fin_envio + espera or inactivo > 0.5:
+                break
+        siguiente = proximo if intervalo is not None and proximo < fin_envio else ahora + 0.05
+        if atender(max(0.0, min(siguiente - ahora, 0.05))):
+            ultima_lectura = time.monotonic()
+
+    for usuario in usuarios:
+        usuario.sock.close()
+    resultados.put({
+        "latencias": latencias,
+        "enviados_por_sala": enviados_por_sala,
+        "recibidas": recibidas[0],
+        "unidos": sum(u.unido for u in usuarios),
+    })
+
+
+# ------------------ MEDICIÓN ------------------
+
+def percentil(valores, p):
+    """Percentil p (0-100) de una lista ya ordenada."""
+    if not valores:
+        return 0.0
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+
+def ejecutar(args):
+    """
+    Ejecuta una medición completa con los parámetros de la línea de comandos.
+
+    Returns:
+        dict: Parámetros y resultados (ver el formato de --salida).
+    """
+    _ampliar_limite_descriptores()
+    proceso, puerto, carpeta = iniciar_servidor(args.modo, args.backend, args.trabajadores)
+    rss_inicial = rss_mb(proceso.pid)
+    muestreo = MuestreoRSS(proceso.pid)
+    muestreo.iniciar()
+    try:
+        salas_usuarios = repartir(args.usuarios, args.salas, args.sesgo)
+        miembros = {}
+        for sala in salas_usuarios:
+            miembros[sala] = miembros.get(sala, 0) + 1
+        usuarios = [(f"u{i}", sala) for i, sala in enumerate(salas_usuarios)]
+
+        procesos = max(1, min(args.procesos, args.usuarios))
+        barrera = multiprocessing.Barrier(procesos + 1)
+        inicio_comun = multiprocessing.Value("d", 0.0)
+        resultados = multiprocessing.Queue()
+        trabajadores = []
+        for p in range(procesos):
+            asignados = usuarios[p::procesos]
+            tasa = args.tasa * len(asignados) / args.usuarios
+            trabajadores.append(multiprocessing.Process(target=_trabajador, args=(
+                puerto, asignados, tasa, args.tamaño, args.calentamiento,
+                args.duracion, args.espera, args.protocolo == "binario", barrera, inicio_comun, resultados,
+            )))
+        conexion = time.perf_counter()
+        for t in trabajadores:
+            t.start()
+        barrera.wait()
+        conexion = time.perf_counter() - conexion
+        inicio_comun.value = time.time() + 0.1
+        barrera.wait()
+        rss_conectados = rss_mb(proceso.pid)
+        datos = [resultados.get() for _ in trabajadores]
+        for t in trabajadores:
+            t.join()
+        rss_final = rss_mb(proceso.pid)
+    finally:
+        pico = muestreo.detener()
+        detener_servidor(proceso, carpeta)
+
+    latencias = sorted(l for d in datos for l in d["latencias"])
+    enviados_por_sala = {}
+    for d in datos:
+        for sala, n in d["enviados_por_sala"].items():
+            enviados_por_sala[sala] = enviados_por_sala.get(sala, 0) + n
+    enviados = sum(enviados_por_sala.values())
+    esperadas = sum(n * miembros[sala] for sala, n in enviados_por_sala.items())
+    recibidas = sum(d["recibidas"] for d in datos)
+
+    def ms(valor):
+        return round(valor * 1000, 3)
+
+    return {
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "nucleos": os.cpu_count(),
+        "modo": args.modo,
+        "trabajadores": args.trabajadores,
+        "protocolo": args.protocolo,
+        "backend": args.backend,
+        "usuarios": args.usuarios,
+        "salas": args.salas,
+        "sesgo": args.sesgo,
+        "tasa": args.tasa,
+        "tamaño": args.tamaño,
+        "duracion": args.duracion,
+        "procesos": procesos,
+        "unidos": sum(d["unidos"] for d in datos),
+        "conexion_s": round(conexion, 3),
+        "enviados": enviados,
+        "mensajes_s": round(enviados / args.duracion, 1),
+        "entregas_esperadas": esperadas,
+        "entregas": recibidas,
+        "entregas_s": round(recibidas / args.duracion, 1),
+        "perdidas": esperadas - recibidas,
+        "latencia_ms": {
+            "p50": ms(percentil(latencias, 50)),
+            "p90": ms(percentil(latencias, 90)),
+            "p99": ms(percentil(latencias, 99)),
+            "p999": ms(percentil(latencias, 99.9)),
+            "max": ms(latencias[-1]) if latencias else 0.0,
+            "media": ms(sum(latencias) / len(latencias)) if latencias else 0.0,
+        },
+        "rss_mb": {
+            "inicial": _redondear(rss_inicial),
+            "conectados": _redondear(rss_conectados),
+            "final": _redondear(rss_final),
+            "pico": _redondear(pico),
+        },
+    }
+
+
+def _redondear(valor):
+    return None if valor is None else round(valor, 1)
+
+
+def _commit():
+    """Commit actual del repositorio (None si no hay git)."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ,
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# ------------------ RESULTADOS ------------------
+
+def imprimir(r):
+    """Muestra un resultado en forma legible."""
+    lat = r["latencia_ms"]
+    rss = r["rss_mb"]
+    modo = r["modo"] if r["trabajadores"] == 1 else f"{r['trabajadores']} trabajadores"
+    print(f"servidor {modo} / {r['backend']} / {r.get('protocolo', 'texto')} | {r['usuarios']} usuarios "
+          f"({r['unidos']} unidos en {r['conexion_s']} s) en {r['salas']} salas "
+          f"(sesgo {r['sesgo']}) | {r['procesos']} procesos de carga")
+    print(f"mensajes/s {r['mensajes_s']:>10}   entregas/s {r['entregas_s']:>10}   "
+          f"perdidas {r['perdidas']} de {r['entregas_esperadas']}")
+    print(f"latencia ms  p50 {lat['p50']}  p90 {lat['p90']}  p99 {lat['p99']}  "
+          f"p99.9 {lat['p999']}  máx {lat['max']}")
+    print(f"RSS servidor MiB  inicial {rss['inicial']}  conectados {rss['conectados']}  "
+          f"pico {rss['pico']}  final {rss['final']}")
+
+
+def anterior(ruta, resultado):
+    """Último resultado guardado en `ruta` con los mismos parámetros (o None)."""
+    if not os.path.exists(ruta):
+        return None
+    previo = None
+    with open(ruta, encoding="utf-8") as f:
+        for linea in f:
+            try:
+                r = json.loads(linea)
+            except ValueError:
+                continue
+            if all(r.get(k, PARAMETROS_POR_DEFECTO.get(k)) == resultado[k] for k in PARAMETROS_COMPARABLES):
+                previo = r
+    return previo
+
+
+def comparar(previo, actual):
+    """Imprime la variación de las métricas principales respecto de `previo`."""
+    print(f"comparado con {previo['fecha']} (commit {previo.get('commit')}):")
+    filas = [
+        ("entregas/s", previo["entregas_s"], actual["entregas_s"]),
+        ("latencia p50 ms", previo["latencia_ms"]["p50"], actual["latencia_ms"]["p50"]),
+        ("latencia p99 ms", previo["latencia_ms"]["p99"], actual["latencia_ms"]["p99"]),
+        ("RSS pico MiB", previo["rss_mb"]["pico"], actual["rss_mb"]["pico"]),
+    ]
+    for nombre, antes, ahora in filas:
+        if antes and ahora is not None:
+            print(f"  {nombre:<16} {antes:>10} → {ahora:>10}  ({(ahora - antes) / antes * 100:+.1f}%)")
+
+
+def guardar(ruta, resultado):
+    """Agrega el resultado como una línea JSON."""
+    carpeta = os.path.dirname(ruta)
+    if carpeta:
+        os.makedirs(carpeta, exist_ok=True)
+    with open(ruta, "a", encoding="utf-8") as f:
+        f.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+
+
+def main():
+    if len(sys.argv) == 7 and sys.argv[1] == "--servidor":
+        _servir(int(sys.argv[2]), sys.argv[3], sys.argv[4], sys.argv[5], int(sys.argv[6]))
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--usuarios", type=int, default=1000)
+    parser.add_argument("--salas", type=int, default=10)
+    parser.add_argument("--sesgo", type=float, default=0.0,
+                        help="exponente Zipf del reparto de usuarios entre salas (0 = uniforme)")
+    parser.add_argument("--tasa", type=float, default=200, help="mensajes por segundo en total")
+    parser.add_argument("--tamaño", type=int, default=64, help="bytes de relleno por mensaje")
+    parser.add_argument("--duracion", type=float, default=10, help="segundos de medición")
+    parser.add_argument("--calentamiento", type=float, default=2, help="segundos previos sin medir")
+    parser.add_argument("--espera", type=float, default=5,
+                        help="segundos máximos para recibir lo enviado al final")
+    parser.add_argument("--procesos", type=int, default=1, help="procesos generadores de carga")
+    parser.add_argument("--modo", choices=["hilos", "asyncio"], default="hilos")
+    parser.add_argument("--trabajadores", type=int, default=1,
+                        help="procesos del servidor con SO_REUSEPORT (más de 1 = multiproceso con hilos)")
+    parser.add_argument("--protocolo", choices=["texto", "binario"], default="texto",
+                        help="protocolo que negocian los usuarios simulados")
+    parser.add_argument("--backend", choices=["json", "jsonl", "sqlite"], default="jsonl")
+    parser.add_argument("--salida", default=SALIDA_POR_DEFECTO,
+                        help="archivo JSON Lines donde se agregan los resultados ('' = no guardar)")
+    parser.add_argument("--comparar", action="store_true",
+                        help="comparar con la ejecución anterior de los mismos parámetros")
+    args = parser.parse_args()
+
+    resultado = ejecutar(args)
+    imprimir(resultado)
+    if args.salida:
+        if args.comparar:
+            previo = anterior(args.salida, resultado)
+            if previo:
+                comparar(previo, resultado)
+            else:
+                print("(sin ejecuciones anteriores con estos parámetros)")
+        guardar(args.salida, resultado)
+
+
+if __name__ == "__main__":
+    main()
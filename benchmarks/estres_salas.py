@@ -0,0 +1,218 @@
+"""
+estres_salas.py — Prueba de estrés de salas independientes en ServidorChat
+
+Levanta un ServidorChat (servidor con hilos) en un proceso aparte y, para
+1, 2, 4, ... salas, lanza un proceso de clientes por sala: un emisor que
+envía mensajes tan rápido como puede y varios receptores que los cuentan.
+Cada sala tiene su propio lock, y los contadores que se actualizan en cada
+mensaje (métricas, difusión) se reparten en franjas por hilo, así que las
+salas solo comparten un lock si sus hilos emisores caen en la misma franja
+(más de metricas.FRANJAS emisores) o, con --con-historial, el almacenamiento.
+Sin eso, el rendimiento total (mensajes entregados por segundo) debería
+crecer casi linealmente con el número de salas mientras haya núcleos libres.
+
+Si un receptor no recibe todos los mensajes en --espera segundos (o el
+servidor lo desconecta, por ejemplo por cliente lento), la ronda falla.
+
+En CPython con GIL los hilos del servidor no corren en paralelo, así que el
+escalado solo se observa con una compilación sin GIL (free-threaded, 3.13t+).
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/estres_salas.py
+    python benchmarks/estres_salas.py --salas 1 2 4 8 --receptores 8 --mensajes 5000
+    python benchmarks/estres_salas.py --con-historial   # incluye el almacenamiento
+"""
+
+import argparse
+import multiprocessing
+import os
+import queue
+import selectors
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(RAIZ, "servidor"))
+
+from protocolo import ProtocoloServidor, DecodificadorTramas  # noqa: E402
+
+
+class _HistorialNulo:
+    """Sustituye al historial para medir solo la retransmisión."""
+
+    def guardar(self, sala, usuario, texto, ts=None):
+        return None
+
+    def obtener_historial_sala(self, sala, ultimos=None, despues_de=None, antes_de=None):
+        return []
+
+    def cerrar(self):
+        pass
+
+
+def _servidor(puerto, con_historial, listo):
+    """Proceso servidor: ServidorChat con datos en un directorio temporal."""
+    import config
+    carpeta = tempfile.mkdtemp(prefix="estres_chat_")
+    config.SERVIDOR_HOST = "127.0.0.1"
+    config.SERVIDOR_PUERTO = puerto
+    config.ARCHIVO_HISTORIAL = os.path.join(carpeta, "historial.json")
+    config.ARCHIVO_HISTORIAL_JSONL = os.path.join(carpeta, "historial.jsonl")
+    config.LIMITE_COLA_SALIDA = 64 * 1024 * 1024
+    config.NIVEL_REGISTRO = "error"  # Sin los registros por conexión
+    config.METRICAS_PUERTO = 0
+
+    from nucleo_servidor import ServidorChat
+    servidor = ServidorChat()
+    if not con_historial:
+        servidor.historial.cerrar()
+        servidor.historial = _HistorialNulo()
+    listo.set()
+    servidor.iniciar()
+
+
+def _conectar(puerto, nombre, sala):
+    """Abre una conexión, se registra y entra en la sala."""
+    sock = socket.create_connection(("127.0.0.1", puerto))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.sendall(ProtocoloServidor.trama("HELLO", nombre) + ProtocoloServidor.trama("JOIN_SALA", sala))
+    return sock
+
+
+def _sala(puerto, indice, receptores, mensajes, espera, barrera, resultados):
+    """
+    Proceso de una sala: un emisor y `receptores` receptores.
+    Guarda en `resultados` (mensajes entregados, segundos), o (None, motivo)
+    si algún receptor no recibió todos los mensajes en `espera` segundos.
+    """
+    sala = f"estres_{indice}"
+    emisor = _conectar(puerto, f"e{indice}", sala)
+    lectores = [_conectar(puerto, f"r{indice}_{i}", sala) for i in range(receptores)]
+    time.sleep(0.5)  # Dejar que lleguen OK / NOTIFY de las uniones
+
+    # CHAT#<seq>|<ts>|e<indice>: xxx...
+    sufijo = f"|e{indice}: {'x' * 64}".encode()
+    selector = selectors.DefaultSelector()
+    for sock in lectores:
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ, [DecodificadorTramas(65536, 1 << 20), 0])
+
+    trama = ProtocoloServidor.trama("MSG", "x" * 64)
+    barrera.wait()
+    inicio = time.perf_counter()
+
+    def enviar():
+        lote = trama * 100
+        for _ in range(mensajes // 100):
+            emisor.sendall(lote)
+        emisor.sendall(trama * (mensajes % 100))
+
+    hilo = threading.Thread(target=enviar, daemon=True)
+    hilo.start()
+
+    pendientes = len(lectores)
+    limite = time.monotonic() + espera
+    error = None
+    while pendientes and error is None:
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            recibidos = sorted(clave.data[1] for clave in selector.get_map().values())
+            error = (f"sala {sala}: {pendientes} receptores sin terminar tras {espera} s "
+                     f"(recibidos: {recibidos} de {mensajes})")
+            break
+        for clave, _ in selector.select(timeout=restante):
+            estado = clave.data
+            try:
+                datos = clave.fileobj.recv(65536)
+            except BlockingIOError:
+                continue
+            if not datos:
+                error = f"sala {sala}: el servidor cerró un receptor tras {estado[1]} de {mensajes} mensajes"
+                break
+            for recibida in estado[0].alimentar(datos):
+                if recibida.startswith(b"CHAT#") and recibida.endswith(sufijo):
+                    estado[1] += 1
+            if estado[1] >= mensajes:
+                selector.unregister(clave.fileobj)
+                pendientes -= 1
+
+    duracion = time.perf_counter() - inicio
+    resultados.put((None, error) if error else (mensajes * receptores, duracion))
+    for sock in lectores + [emisor]:
+        sock.close()
+
+
+def medir(puerto, salas, receptores, mensajes, espera):
+    """
+    Ejecuta una ronda con `salas` salas en paralelo y devuelve entregas/s.
+
+    Raises:
+        RuntimeError: Si alguna sala no entregó todos los mensajes a tiempo.
+    """
+    barrera = multiprocessing.Barrier(salas)
+    resultados = multiprocessing.Queue()
+    procesos = [
+        multiprocessing.Process(target=_sala, args=(puerto, i, receptores, mensajes, espera, barrera, resultados))
+        for i in range(salas)
+    ]
+    for p in procesos:
+        p.start()
+    try:
+        # Margen para conectar y esperar la barrera; un proceso que muere sin
+        # responder no deja la ronda colgada
+        datos = [resultados.get(timeout=espera + 30) for _ in procesos]
+    except queue.Empty:
+        raise RuntimeError(f"una sala no respondió en {espera + 30} s") from None
+    finally:
+        for p in procesos:
+            p.join(1)
+            if p.is_alive():
+                p.terminate()
+    errores = [motivo for entregas, motivo in datos if entregas is None]
+    if errores:
+        raise RuntimeError("; ".join(errores))
+    entregas = sum(d[0] for d in datos)
+    segundos = max(d[1] for d in datos)
+    return entregas / segundos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--salas", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--receptores", type=int, default=8, help="receptores por sala")
+    parser.add_argument("--mensajes", type=int, default=5000, help="mensajes por sala")
+    parser.add_argument("--puerto", type=int, default=5055)
+    parser.add_argument("--espera", type=float, default=60,
+                        help="segundos máximos para que cada receptor reciba todos los mensajes")
+    parser.add_argument("--con-historial", action="store_true",
+                        help="guardar los mensajes (el almacenamiento es compartido)")
+    args = parser.parse_args()
+
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(f"Python {sys.version.split()[0]} | GIL {'activo' if gil else 'desactivado'} | "
+          f"núcleos: {os.cpu_count()}")
+
+    listo = multiprocessing.Event()
+    servidor = multiprocessing.Process(
+        target=_servidor, args=(args.puerto, args.con_historial, listo), daemon=True
+    )
+    servidor.start()
+    listo.wait(10)
+    time.sleep(0.2)
+
+    base = None
+    print(f"{'salas':>6} {'entregas/s':>12} {'escalado':>9}")
+    try:
+        for n in args.salas:
+            tasa = medir(args.puerto, n, args.receptores, args.mensajes, args.espera)
+            base = base or tasa / n
+            print(f"{n:>6} {tasa:>12.0f} {tasa / base:>8.2f}x")
+    finally:
+        servidor.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+historial_backends.py — Compara los backends de historial (json, jsonl, sqlite)
+
+Para cada backend, varios hilos escriben mensajes en distintas salas mientras
+otros hilos leen los últimos mensajes de salas al azar (como al unirse a una
+sala), directamente contra el backend, sin la caché. Cada sala empieza con
+un historial previo (importado desde un JSON legado) para que las lecturas
+siempre devuelvan mensajes. Informa escrituras por segundo, lecturas por
+segundo y latencia de lectura (p50 / p99).
+
+El backend "json" reescribe el archivo completo en cada mensaje; se mide con
+menos mensajes para que termine en un tiempo razonable. Con --diferida cada
+backend se envuelve en la cola de escritura diferida (PersistenciaDiferida)
+con la durabilidad indicada.
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/historial_backends.py
+    python benchmarks/historial_backends.py --mensajes 20000 --escritores 4 --lectores 4
+    python benchmarks/historial_backends.py --backends jsonl sqlite
+    python benchmarks/historial_backends.py --diferida mensaje
+"""
+
+import argparse
+import builtins
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(RAIZ, "servidor"))
+
+from almacenamiento import Almacenamiento  # noqa: E402
+from almacenamiento_jsonl import AlmacenamientoJSONL  # noqa: E402
+from almacenamiento_sqlite import AlmacenamientoSQLite  # noqa: E402
+from persistencia_diferida import PersistenciaDiferida  # noqa: E402
+
+# Tope de mensajes para el backend json (costo cuadrático)
+MAX_MENSAJES_JSON = 2000
+
+
+def crear(backend, carpeta, nombres, previos):
+    """
+    Crea un backend dentro de `carpeta` con `previos` mensajes por sala,
+    escritos como historial legado e importados por el propio backend.
+    """
+    legado = os.path.join(carpeta, "historial.json")
+    with open(legado, "w", encoding="utf-8") as f:
+        json.dump([
+            {"sala": sala, "usuario": "previo", "texto": f"mensaje previo {i}"}
+            for i in range(previos) for sala in nombres
+        ], f)
+    if backend == "json":
+        return Almacenamiento(legado)
+    if backend == "jsonl":
+        return AlmacenamientoJSONL(os.path.join(carpeta, "historial.jsonl"), ruta_legado=legado)
+    return AlmacenamientoSQLite(os.path.join(carpeta, "historial.db"), ruta_legado=legado)
+
+
+def percentil(valores, p):
+    """Percentil p (0-100) de una lista ya ordenada."""
+    if not valores:
+        return 0.0
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+
+def medir(backend, mensajes, escritores, lectores, salas, ventana, diferida=None):
+    """
+    Ejecuta la carga mixta sobre un backend nuevo.
+
+    Returns:
+        dict: escrituras/s, lecturas/s y latencias de lectura en milisegundos.
+    """
+    carpeta = tempfile.mkdtemp(prefix=f"bench_{backend}_")
+    nombres = [f"sala_{i}" for i in range(salas)]
+    almacenamiento = crear(backend, carpeta, nombres, ventana)
+    if diferida:
+        almacenamiento = PersistenciaDiferida(almacenamiento, durabilidad=diferida)
+    por_escritor = mensajes // escritores
+    terminado = threading.Event()
+    latencias = []
+    lock_latencias = threading.Lock()
+
+    def escribir(indice):
+        azar = random.Random(indice)
+        for i in range(por_escritor):
+            almacenamiento.guardar(azar.choice(nombres), f"usuario{indice}", f"mensaje {i} " + "x" * 40)
+
+    def leer(indice):
+        azar = random.Random(1000 + indice)
+        propias = []
+        while not terminado.is_set():
+            inicio = time.perf_counter()
+            almacenamiento.obtener_historial_sala(azar.choice(nombres), ultimos=ventana)
+            propias.append(time.perf_counter() - inicio)
+        with lock_latencias:
+            latencias.extend(propias)
+
+    hilos_lectura = [threading.Thread(target=leer, args=(i,)) for i in range(lectores)]
+    hilos_escritura = [threading.Thread(target=escribir, args=(i,)) for i in range(escritores)]
+    inicio = time.perf_counter()
+    for h in hilos_lectura + hilos_escritura:
+        h.start()
+    for h in hilos_escritura:
+        h.join()
+    duracion = time.perf_counter() - inicio
+    terminado.set()
+    for h in hilos_lectura:
+        h.join()
+    almacenamiento.cerrar()
+    shutil.rmtree(carpeta, ignore_errors=True)
+
+    latencias.sort()
+    return {
+        "mensajes": por_escritor * escritores,
+        "escrituras_s": por_escritor * escritores / duracion,
+        "lecturas_s": len(latencias) / duracion,
+        "p50_ms": percentil(latencias, 50) * 1000,
+        "p99_ms": percentil(latencias, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--backends", nargs="+", default=["json", "jsonl", "sqlite"],
+                        choices=["json", "jsonl", "sqlite"])
+    parser.add_argument("--mensajes", type=int, default=10000)
+    parser.add_argument("--escritores", type=int, default=4)
+    parser.add_argument("--lectores", type=int, default=4)
+    parser.add_argument("--salas", type=int, default=50)
+    parser.add_argument("--ventana", type=int, default=50, help="mensajes por lectura")
+    parser.add_argument("--diferida", choices=["mensaje", "intervalo", "cierre"],
+                        help="usar escritura diferida con esta durabilidad")
+    args = parser.parse_args()
+
+    imprimir = builtins.print
+    builtins.print = lambda *a, **k: None  # Silenciar los avisos de importación
+
+    imprimir(f"{'backend':>8} {'mensajes':>9} {'escr/s':>10} {'lect/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    try:
+        for backend in args.backends:
+            mensajes = min(args.mensajes, MAX_MENSAJES_JSON) if backend == "json" else args.mensajes
+            r = medir(backend, mensajes, args.escritores, args.lectores, args.salas, args.ventana,
+                      args.diferida)
+            imprimir(f"{backend:>8} {r['mensajes']:>9} {r['escrituras_s']:>10.0f} "
+                     f"{r['lecturas_s']:>10.0f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+    finally:
+        builtins.print = imprimir
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+"""
+micro_protocolo_historial.py — Micro-benchmarks del protocolo y del historial
+
+Mide, llamada por llamada, las funciones del camino caliente:
+
+- Protocolo del servidor: `ProtocoloServidor.procesar_mensaje`,
+  `construir_respuesta` y `construir_historial`, y `decodificar_trama`,
+  `trama_chat` y `trama_historial` en texto y en binario, y
+  `Compresion.comprimir` de una trama de historial.
+- Protocolo del cliente: `ProtocoloCliente.procesar_respuesta`,
+  `procesar_historial`, y la recepción de CHAT e HISTORY en texto y en
+  binario (`decodificar_trama` más `procesar_chat` / `procesar_historial`)
+  (en otro intérprete: cliente y servidor tienen cada uno su módulo `config`).
+- Historial: `guardar` y `obtener_historial_sala` (últimos K, delta después
+  de una secuencia y página anterior a una secuencia) de cada backend, sobre
+  historiales sintéticos de 1k / 100k / 1M mensajes repartidos entre varias
+  salas, para ver cómo escala el costo con el tamaño del historial.
+
+Cada caso se calibra (se repite la llamada hasta que una medición dure al
+menos --minimo segundos) y luego se mide --repeticiones veces, con el
+recolector de basura desactivado como en timeit. Informa media, desviación
+y mínimo por llamada en microsegundos.
+
+El backend "json" relee y reescribe el archivo completo en cada operación;
+solo se mide hasta MAX_HISTORIAL_JSON mensajes.
+
+Cada ejecución se agrega como una línea JSON a --salida; con --comparar se
+compara cada caso con su última medición guardada y se marca como regresión
+si el mínimo empeora más de --umbral por ciento (el script termina con
+código 1 si hay alguna).
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/micro_protocolo_historial.py
+    python benchmarks/micro_protocolo_historial.py --grupos protocolo --comparar
+    python benchmarks/micro_protocolo_historial.py --backends sqlite --tamaños 1000 1000000
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SALIDA_POR_DEFECTO = os.path.join(RAIZ, "benchmarks", "resultados", "micro_protocolo_historial.jsonl")
+
+# Tope de mensajes para el backend json (cada operación reescribe el archivo)
+MAX_HISTORIAL_JSON = 100_000
+
+# Mensajes por llamada a guardar_lote al poblar un historial sintético
+LOTE_POBLAR = 10_000
+
+# Mensajes por lectura de historial y por trama HISTORY (como REPLAY_MAX_MENSAJES)
+VENTANA = 50
+
+TEXTO = "mensaje de prueba " + "x" * 46
+
+
+def medir(funcion, repeticiones=5, minimo=0.2):
+    """
+    Mide el tiempo por llamada de `funcion` (sin argumentos).
+
+    Args:
+        funcion (callable): Operación a medir.
+        repeticiones (int): Mediciones después de calibrar.
+        minimo (float): Segundos mínimos de cada medición.
+
+    Returns:
+        dict: media, desviación y mínimo por llamada en microsegundos y
+        número de llamadas por medición.
+    """
+    def cronometrar(bucles):
+        gc_activo = gc.isenabled()
+        gc.disable()
+        try:
+            inicio = time.perf_counter()
+            for _ in range(bucles):
+                funcion()
+            return time.perf_counter() - inicio
+        finally:
+            if gc_activo:
+                gc.enable()
+
+    # Calibración (sirve también de calentamiento)
+    bucles = 1
+    while True:
+        duracion = cronometrar(bucles)
+        if duracion >= minimo:
+            break
+        bucles = max(bucles * 2, int(bucles * minimo / duracion * 1.1) if duracion > 0 else bucles * 10)
+
+    tiempos = [cronometrar(bucles) / bucles * 1e6 for _ in range(max(1, repeticiones))]
+    return {
+        "media_us": statistics.fmean(tiempos),
+        "desv_us": statistics.stdev(tiempos) if len(tiempos) > 1 else 0.0,
+        "min_us": min(tiempos),
+        "bucles": bucles,
+    }
+
+
+def _caso(grupo, caso, historial, medicion):
+    return {"grupo": grupo, "caso": caso, "historial": historial, **medicion}
+
+
+# ------------------ PROTOCOLO ------------------
+
+def _lineas_historial(cantidad, primero=1):
+    """Líneas '<seq>|<ts>|usuario: texto' de una trama HISTORY."""
+    return [f"{seq}|{1700000000000 + seq}|usuario{seq % 7}: {TEXTO}"
+            for seq in range(primero, primero + cantidad)]
+
+
+def medir_protocolo_servidor(repeticiones, minimo):
+    """Casos de ProtocoloServidor (en este proceso)."""
+    sys.path.insert(0, os.path.join(RAIZ, "servidor"))
+    from protocolo import ProtocoloServidor, OPCODES
+    from compresion import Compresion
+    from mensaje import Mensaje
+
+    msg = f"MSG#{TEXTO}"
+    trama_msg = msg.encode("utf-8")
+    trama_msg_binaria = bytes((OPCODES["MSG"],)) + TEXTO.encode("utf-8")
+    union = "JOIN_SALA#general|1234"
+    largo = "MSG#" + "y" * 4000
+    datos_chat = ProtocoloServidor.construir_chat(1234, 1700000000000, "usuario1", TEXTO)
+    mensajes = [Mensaje(seq, 1700000000000 + seq, f"usuario{seq % 7}", TEXTO) for seq in range(1, VENTANA + 1)]
+    # Compresión en un flujo que ya lleva tramas anteriores, como en una conexión abierta
+    compresion = Compresion(umbral=0)
+    compresor = compresion.compresor()
+    historial_texto = ProtocoloServidor.trama_historial(mensajes, True)
+    casos = [
+        ("procesar_mensaje MSG", lambda: ProtocoloServidor.procesar_mensaje(msg)),
+        ("procesar_mensaje JOIN_SALA", lambda: ProtocoloServidor.procesar_mensaje(union)),
+        ("procesar_mensaje MSG 4KB", lambda: ProtocoloServidor.procesar_mensaje(largo)),
+        ("construir_respuesta CHAT", lambda: ProtocoloServidor.construir_respuesta("CHAT", datos_chat)),
+        (f"construir_historial {VENTANA}", lambda: ProtocoloServidor.construir_historial(mensajes, True)),
+        ("decodificar_trama MSG texto", lambda: ProtocoloServidor.decodificar_trama(trama_msg)),
+        ("decodificar_trama MSG binario", lambda: ProtocoloServidor.decodificar_trama(trama_msg_binaria)),
+        ("trama_chat texto", lambda: ProtocoloServidor.trama_chat(1234, 1700000000000, "usuario1", TEXTO)),
+        ("trama_chat binario", lambda: ProtocoloServidor.trama_chat(
+            1234, 1700000000000, "usuario1", TEXTO, binario=True, sala_id=3)),
+        (f"trama_historial {VENTANA} texto", lambda: ProtocoloServidor.trama_historial(mensajes, True)),
+        (f"trama_historial {VENTANA} binario", lambda: ProtocoloServidor.trama_historial(
+            mensajes, True, binario=True, sala_id=3)),
+        (f"comprimir trama_historial {VENTANA} texto", lambda: compresion.comprimir(compresor, historial_texto)),
+    ]
+    return [_caso("protocolo", f"servidor.{nombre}", None, medir(funcion, repeticiones, minimo))
+            for nombre, funcion in casos]
+
+
+def medir_protocolo_cliente(repeticiones, minimo):
+    """Casos de ProtocoloCliente (debe ejecutarse en un intérprete sin el `config` del servidor)."""
+    sys.path.insert(0, os.path.join(RAIZ, "cliente"))
+    from protocolo_cliente import (
+        ProtocoloCliente, OPCODES, CHAT_BINARIO, HISTORIAL_BINARIO, MENSAJE_BINARIO,
+    )
+
+    chat = f"CHAT#1234|1700000000000|usuario1: {TEXTO}"
+    aviso = "NOTIFY#usuario1 se unió a la sala"
+    historial = "HISTORY#1|1\n" + "\n".join(_lineas_historial(VENTANA))
+    _, datos_historial = ProtocoloCliente.procesar_respuesta(historial)
+    # Mismos mensajes en tramas binarias (como las codifica el servidor, sala 3)
+    salas = {3: "general"}
+    chat_binario = bytes((OPCODES["CHAT"],)) + b"".join((
+        CHAT_BINARIO.pack(3, 1234, 1700000000000, 8), b"usuario1", TEXTO.encode("utf-8"),
+    ))
+    historial_binario = bytes((OPCODES["HISTORY"],)) + b"".join(
+        [HISTORIAL_BINARIO.pack(3, 1, 1, VENTANA)]
+        + [MENSAJE_BINARIO.pack(seq, 1700000000000 + seq, len(f"usuario{seq % 7}"), len(TEXTO))
+           + f"usuario{seq % 7}".encode("utf-8") + TEXTO.encode("utf-8")
+           for seq in range(1, VENTANA + 1)]
+    )
+
+    # Lo que hace la GUI con cada trama: decodificarla y separar sus mensajes
+    def chat_recibido(trama):
+        return ProtocoloCliente.procesar_chat(ProtocoloCliente.decodificar_trama(trama, salas)[1])
+
+    def historial_recibido(trama):
+        return ProtocoloCliente.procesar_historial(ProtocoloCliente.decodificar_trama(trama, salas)[1])
+    chat_texto = chat.encode("utf-8")
+    historial_texto = historial.encode("utf-8")
+    casos = [
+        ("procesar_respuesta CHAT", lambda: ProtocoloCliente.procesar_respuesta(chat)),
+        ("procesar_respuesta NOTIFY", lambda: ProtocoloCliente.procesar_respuesta(aviso)),
+        (f"procesar_respuesta HISTORY {VENTANA}", lambda: ProtocoloCliente.procesar_respuesta(historial)),
+        (f"procesar_historial {VENTANA}", lambda: ProtocoloCliente.procesar_historial(datos_historial)),
+        ("recibir CHAT texto", lambda: chat_recibido(chat_texto)),
+        ("recibir CHAT binario", lambda: chat_recibido(chat_binario)),
+        (f"recibir HISTORY {VENTANA} texto", lambda: historial_recibido(historial_texto)),
+        (f"recibir HISTORY {VENTANA} binario", lambda: historial_recibido(historial_binario)),
+    ]
+    return [_caso("protocolo", f"cliente.{nombre}", None, medir(funcion, repeticiones, minimo))
+            for nombre, funcion in casos]
+
+
+def _en_subproceso(grupo, repeticiones, minimo):
+    """Ejecuta un grupo interno en otro intérprete y devuelve sus resultados."""
+    salida = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--interno", grupo, str(repeticiones), str(minimo)],
+        check=True, capture_output=True, text=True,
+    )
+    return json.loads(salida.stdout)
+
+
+# ------------------ HISTORIAL ------------------
+
+def crear(backend, carpeta):
+    """Crea un backend vacío dentro de `carpeta`."""
+    sys.path.insert(0, os.path.join(RAIZ, "servidor"))
+    from almacenamiento import Almacenamiento
+    from almacenamiento_jsonl import AlmacenamientoJSONL
+    from almacenamiento_sqlite import AlmacenamientoSQLite
+
+    if backend == "json":
+        return Almacenamiento(os.path.join(carpeta, "historial.json"))
+    if backend == "jsonl":
+        return AlmacenamientoJSONL(os.path.join(carpeta, "historial.jsonl"))
+    return AlmacenamientoSQLite(os.path.join(carpeta, "historial.db"))
+
+
+def poblar(almacenamiento, backend, tamaño, salas):
+    """Escribe `tamaño` mensajes repartidos en orden circular entre `salas` salas."""
+    lote = tamaño if backend == "json" else LOTE_POBLAR
+    for inicio in range(0, tamaño, lote):
+        almacenamiento.guardar_lote([
+            (f"sala_{i % salas}", f"usuario{i % 97}", f"{i} {TEXTO}", 1700000000000 + i)
+            for i in range(inicio, min(tamaño, inicio + lote))
+        ])
+    almacenamiento.sincronizar()
+
+
+def medir_historial(backend, tamaño, salas, repeticiones, minimo):
+    """
+    Mide lecturas y escrituras de un backend sobre un historial sintético.
+
+    Las lecturas se hacen sobre `sala_0` antes de las escrituras, para que
+    todas vean el mismo historial.
+    """
+    carpeta = tempfile.mkdtemp(prefix=f"micro_{backend}_")
+    try:
+        almacenamiento = crear(backend, carpeta)
+        inicio = time.perf_counter()
+        poblar(almacenamiento, backend, tamaño, salas)
+        poblado = time.perf_counter() - inicio
+        sala = "sala_0"
+        ultimo = almacenamiento.ultimo_seq(sala)
+        casos = [
+            (f"obtener_historial_sala ultimos={VENTANA}",
+             lambda: almacenamiento.obtener_historial_sala(sala, ultimos=VENTANA)),
+            (f"obtener_historial_sala despues_de (delta {VENTANA})",
+             lambda: almacenamiento.obtener_historial_sala(sala, despues_de=ultimo - VENTANA)),
+            (f"obtener_historial_sala antes_de (página {VENTANA})",
+             lambda: almacenamiento.obtener_historial_sala(sala, ultimos=VENTANA, antes_de=ultimo // 2)),
+            ("guardar", lambda: almacenamiento.guardar(sala, "bench", TEXTO)),
+        ]
+        resultados = [_caso("historial", f"{backend}.{nombre}", tamaño, medir(funcion, repeticiones, minimo))
+                      for nombre, funcion in casos]
+        almacenamiento.cerrar()
+        resultados.append(_caso("historial", f"{backend}.poblar", tamaño, {
+            "media_us": poblado / tamaño * 1e6, "desv_us": 0.0,
+            "min_us": poblado / tamaño * 1e6, "bucles": tamaño,
+        }))
+        return resultados
+    finally:
+        shutil.rmtree(carpeta, ignore_errors=True)
+
+
+# ------------------ RESULTADOS ------------------
+
+def _clave(r):
+    return r["grupo"], r["caso"], r["historial"]
+
+
+def _commit():
+    """Commit actual del repositorio (o None fuera de git)."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ,
+                              capture_output=True, text=True, check=True).stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def imprimir(r, previo=None, umbral=None):
+    """Imprime una fila; con `previo`, agrega la variación del mínimo."""
+    historial = "" if r["historial"] is None else f"{r['historial']:,}"
+    fila = (f"{r['caso']:<58} {historial:>10} {r['media_us']:>12.2f} "
+            f"{r['desv_us']:>9.2f} {r['min_us']:>12.2f}")
+    if previo:
+        cambio = (r["min_us"] - previo["min_us"]) / previo["min_us"] * 100
+        fila += f"  {cambio:+6.1f}%"
+        if umbral is not None and cambio > umbral:
+            fila += "  REGRESIÓN"
+    print(fila, flush=True)
+
+
+def anteriores(ruta):
+    """Última medición guardada en `ruta` de cada caso, por (grupo, caso, historial)."""
+    previos = {}
+    if not os.path.exists(ruta):
+        return previos
+    with open(ruta, encoding="utf-8") as f:
+        for linea in f:
+            try:
+                ejecucion = json.loads(linea)
+            except ValueError:
+                continue
+            for r in ejecucion.get("resultados", []):
+                previos[_clave(r)] = r
+    return previos
+
+
+def guardar(ruta, resultado):
+    """Agrega el resultado como una línea JSON."""
+    carpeta = os.path.dirname(ruta)
+    if carpeta:
+        os.makedirs(carpeta, exist_ok=True)
+    with open(ruta, "a", encoding="utf-8") as f:
+        f.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == "--interno":
+        grupos = {"cliente": medir_protocolo_cliente}
+        print(json.dumps(grupos[sys.argv[2]](int(sys.argv[3]), float(sys.argv[4]))))
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--grupos", nargs="+", default=["protocolo", "historial"],
+                        choices=["protocolo", "historial"])
+    parser.add_argument("--backends", nargs="+", default=["json", "jsonl", "sqlite"],
+                        choices=["json", "jsonl", "sqlite"])
+    parser.add_argument("--tamaños", nargs="+", type=int, default=[1_000, 100_000, 1_000_000],
+                        help="mensajes del historial sintético")
+    parser.add_argument("--salas", type=int, default=10, help="salas entre las que se reparte el historial")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--minimo", type=float, default=0.2, help="segundos mínimos por medición")
+    parser.add_argument("--salida", default=SALIDA_POR_DEFECTO,
+                        help="archivo JSON Lines donde se agregan los resultados ('' = no guardar)")
+    parser.add_argument("--comparar", action="store_true",
+                        help="comparar cada caso con su medición anterior")
+    parser.add_argument("--umbral", type=float, default=10.0,
+                        help="empeoramiento del mínimo (%%) que cuenta como regresión")
+    args = parser.parse_args()
+
+    previos = anteriores(args.salida) if args.salida and args.comparar else {}
+    resultados = []
+    regresiones = 0
+
+    def informar(filas):
+        nonlocal regresiones
+        for r in filas:
+            previo = previos.get(_clave(r))
+            imprimir(r, previo, args.umbral if args.comparar else None)
+            if previo and (r["min_us"] - previo["min_us"]) / previo["min_us"] * 100 > args.umbral:
+                regresiones += 1
+            resultados.append(r)
+
+    print(f"{'caso':<58} {'historial':>10} {'media µs':>12} {'±':>9} {'mín µs':>12}")
+    if "protocolo" in args.grupos:
+        informar(_en_subproceso("cliente", args.repeticiones, args.minimo))
+        informar(medir_protocolo_servidor(args.repeticiones, args.minimo))
+    if "historial" in args.grupos:
+        for backend in args.backends:
+            for tamaño in args.tamaños:
+                if backend == "json" and tamaño > MAX_HISTORIAL_JSON:
+                    print(f"{backend + ' (omitido: más de ' + str(MAX_HISTORIAL_JSON) + ' mensajes)':<58} "
+                          f"{tamaño:>10,}")
+                    continue
+                informar(medir_historial(backend, tamaño, args.salas, args.repeticiones, args.minimo))
+
+    if args.salida:
+        guardar(args.salida, {
+            "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _commit(),
+            "python": platform.python_version(),
+            "repeticiones": args.repeticiones,
+            "minimo": args.minimo,
+            "resultados": [{k: (round(v, 3) if isinstance(v, float) else v) for k, v in r.items()}
+                           for r in resultados],
+        })
+    if regresiones:
+        print(f"{regresiones} caso(s) con regresión mayor al {args.umbral}%")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,8 +9,15 @@ mensajes iniciales de bienvenida al usuario.
 Constantes definidas:
 - HOST: Dirección IP del servidor al que se conectará el cliente.
 - PORT: Puerto TCP del servidor.
-- BUFFER: Tamaño en bytes del buffer de recepción de mensajes.
+- BUFFER / BUFFER_MAX: Tamaño inicial y máximo en bytes del buffer de
+  recepción de mensajes.
 - CODIFICACION: Codificación de texto utilizada para enviar y recibir datos.
+- PROTOCOLO_BINARIO: Ofrecer al servidor el protocolo binario en el HELLO.
+- COMPRESION: Ofrecer la compresión zlib de las tramas grandes en el HELLO.
+- RECONEXION_*: Reintentos de reconexión automática si se pierde la conexión.
+- REDIRECCIONES_MAX: Redirecciones seguidas a otro servidor al unirse a una sala.
+- SCROLLBACK_MAX_LINEAS / SCROLLBACK_LOTE_RECORTE: Líneas que conserva el
+  área de chat y tamaño del lote en que se recortan las más antiguas.
 - MENSAJE_BIENVENIDA: Mensaje informativo mostrado al usuario al conectarse,
   indicando los comandos principales que puede usar.
 """
@@ -21,12 +28,48 @@ HOST = "10.253.21.234"
 # Puerto TCP del servidor
 PORT = 5000
 
-# Tamaño del buffer de recepción en bytes
+# Tamaño inicial del buffer de recepción en bytes
 BUFFER = 1024
 
+# Tamaño máximo del buffer de recepción: crece hasta este valor durante las
+# ráfagas (por ejemplo, al recibir el historial) y vuelve a reducirse después
+BUFFER_MAX = 256 * 1024
+
 # Codificación utilizada para enviar y recibir mensajes (UTF-8)
 CODIFICACION = "utf-8"
 
+# Ofrecer el protocolo binario en el HELLO (tramas más cortas y rápidas de
+# procesar). Si el servidor no lo acepta se usa el protocolo de texto.
+PROTOCOLO_BINARIO = True
+
+# Ofrecer la compresión zlib en el HELLO: el historial y los listados grandes
+# llegan comprimidos (útil en enlaces lentos). Si el servidor no la acepta se
+# reciben sin comprimir.
+COMPRESION = True
+
+# Reintentos de reconexión automática tras perder la conexión (0 = no
+# reconectar). Antes del intento n se espera un tiempo al azar entre 0 y
+# min(RECONEXION_MAX, RECONEXION_BASE * 2^(n-1)) segundos, para que un
+# reinicio del servidor no reciba a todos los clientes a la vez.
+RECONEXION_INTENTOS = 10
+RECONEXION_BASE = 0.5
+RECONEXION_MAX = 30.0
+
+# Segundos máximos para conectar y completar el HELLO al reconectar
+RECONEXION_TIMEOUT = 5.0
+
+# Redirecciones seguidas (REDIRECT) que se siguen al unirse a una sala
+# repartida en otro servidor antes de desistir
+REDIRECCIONES_MAX = 3
+
+# Líneas que conserva el área de chat (0 = sin límite). Las más antiguas se
+# borran y se vuelven a pedir al servidor al desplazarse hacia arriba.
+SCROLLBACK_MAX_LINEAS = 2000
+
+# Líneas que se recortan de una vez al superar el límite (evita borrar en
+# cada mensaje)
+SCROLLBACK_LOTE_RECORTE = 200
+
 # Mensaje de bienvenida que se muestra al usuario al iniciar sesión
 # Describe los comandos principales disponibles en la sesión de chat
 MENSAJE_BIENVENIDA = (
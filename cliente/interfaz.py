@@ -20,9 +20,13 @@ Constantes de color:
 - WHITE: Color blanco (para texto en botones).
 """
 
+import queue
 import tkinter as tk
 from tkinter import messagebox, simpledialog
+from collections import deque
+import config
 from nucleo_cliente import BackendCliente
+from protocolo_cliente import ProtocoloCliente
 
 # -------------------- COLORES --------------------
 BG = "#EAF2FB"       # Fondo principal
@@ -30,6 +34,9 @@ FG = "#052744"       # Texto principal
 ACCENT = "#1479E0"   # Botones de acción
 WHITE = "#FFFFFF"    # Texto blanco para botones
 
+# Evento virtual con el que el hilo receptor despierta al bucle de Tk
+EVENTO_BACKEND = "<<EventoBackend>>"
+
 # ==================== CLASE PRINCIPAL ====================
 class ChatApp(tk.Tk):
     """
@@ -59,58 +66,92 @@ class ChatApp(tk.Tk):
         # Mostrar login al iniciar
         self.login_frame.pack(fill="both", expand=True)
 
-        # Llamada periódica para procesar mensajes del backend
-        self.after(200, self.poll_backend)
+        # El backend avisa con un evento virtual cuando hay mensajes pendientes.
+        # Con un Tcl sin soporte de hilos no se puede generar el evento desde
+        # otro hilo y se revisa la cola periódicamente.
+        self.bind(EVENTO_BACKEND, self.procesar_backend)
+        if self.tk.call("info", "exists", "tcl_platform(threaded)"):
+            self.backend.avisar = self.avisar_backend
+        else:
+            self.after(200, self.poll_backend)
 
     # -------------------- MÉTODOS DE BACKEND --------------------
+    def avisar_backend(self):
+        """Llamado desde el hilo receptor: encola el evento virtual en el bucle de Tk."""
+        try:
+            self.event_generate(EVENTO_BACKEND, when="tail")
+        except (tk.TclError, RuntimeError):
+            pass  # Ventana cerrada
+
     def poll_backend(self):
+        """Revisión periódica de la cola (solo con Tcl sin hilos)."""
+        self.procesar_backend()
+        self.after(200, self.poll_backend)
+
+    def procesar_backend(self, event=None):
         """
-        Procesa los mensajes recibidos desde el backend.
-        Se ejecuta periódicamente con 'after'.
+        Procesa todos los eventos pendientes del backend.
+
+        Cada elemento de la cola es un lote de eventos (los de una lectura del
+        socket). Los CHAT / NOTIFY / INFO consecutivos se acumulan y se muestran
+        con una sola inserción en el chat; el resto de eventos se atiende en orden.
         """
+        self.backend.aviso_atendido()
         q = self.backend.queue
+        lineas = []  # (seq, ts, texto) pendientes de mostrar
         try:
             while True:
-                comando, datos = q.get_nowait()
-
-                if comando == "OK":
-                    messagebox.showinfo("Servidor", datos)
-                    # Si se unió a una sala, mostrar chat
-                    if "Te has unido a la sala" in datos and self.backend.sala_actual:
-                        self.chat_frame.set_room(self.backend.sala_actual)
-                        self.show_frame(self.chat_frame)
-
-                elif comando == "ERROR":
-                    messagebox.showerror("Error", datos)
-
-                elif comando == "INFO":
-                    self.chat_frame.append_message(datos)
-
-                elif comando == "ROOM_LIST":
-                    self.rooms_frame.update_rooms(datos)
-
-                elif comando == "USER_LIST_ALL":
-                    self.users_frame.update_users(datos)
-
-                elif comando in ("CHAT", "NOTIFY"):
-                    if datos.startswith("CHAT#") or datos.startswith("NOTIFY#"):
-                        datos = datos.split("#", 1)[1]
-                    self.chat_frame.append_message(datos)
-
-                elif comando == "DISCONNECTED":
-                    messagebox.showwarning("Desconectado", datos)
-                    self.backend.disconnect()
-                    self.show_frame(self.login_frame)
-
-                else:
-                    # Mensajes no reconocidos se muestran en el chat
-                    self.chat_frame.append_message(f"[{comando}] {datos}")
-
-        except:
+                for comando, datos in q.get_nowait():
+                    if comando == "CHAT":
+                        lineas.append(ProtocoloCliente.procesar_chat(datos))
+                        continue
+                    if comando in ("NOTIFY", "INFO", "RECONNECTING", "RECONNECTED"):
+                        if datos.startswith("NOTIFY#"):
+                            datos = datos.split("#", 1)[1]
+                        lineas.append((0, 0, datos))
+                        continue
+                    if lineas:
+                        self.chat_frame.append_chats(lineas)
+                        lineas = []
+
+                    if comando == "OK":
+                        messagebox.showinfo("Servidor", datos)
+                        # Si se unió a una sala, mostrar chat
+                        if "Te has unido a la sala" in datos and self.backend.sala_actual:
+                            self.chat_frame.set_room(self.backend.sala_actual)
+                            self.show_frame(self.chat_frame)
+
+                    elif comando == "ERROR":
+                        messagebox.showerror("Error", datos)
+
+                    elif comando == "HISTORY":
+                        primer_seq, hay_mas, mensajes = ProtocoloCliente.procesar_historial(datos)
+                        self.chat_frame.show_history(mensajes, primer_seq, hay_mas)
+
+                    elif comando == "ROOM_LIST":
+                        self.rooms_frame.update_rooms(datos)
+
+                    elif comando == "USER_LIST_ALL":
+                        self.users_frame.update_users(datos)
+
+                    elif comando == "DISCONNECTED":
+                        # Solo llega si no hubo reconexión posible
+                        messagebox.showwarning("Desconectado", datos)
+                        self.backend.disconnect()
+                        self.show_frame(self.login_frame)
+
+                    else:
+                        # Mensajes no reconocidos se muestran en el chat
+                        self.chat_frame.append_message(f"[{comando}] {datos}")
+
+        except queue.Empty:
             pass
         finally:
-            # Re-ejecutar periódicamente
-            self.after(200, self.poll_backend)
+            if lineas:
+                self.chat_frame.append_chats(lineas)
+            if not q.empty():
+                # Un evento falló a mitad: seguir con el resto sin esperar otro aviso
+                self.after_idle(self.procesar_backend)
 
     def show_frame(self, frame):
         """
@@ -266,12 +307,24 @@ class RoomsFrame(tk.Frame):
 
 
 class ChatFrame(tk.Frame):
-    """Frame de chat de una sala, mostrando mensajes y permitiendo enviar."""
+    """
+    Frame de chat de una sala, mostrando mensajes y permitiendo enviar.
+
+    El área de texto conserva como máximo `config.SCROLLBACK_MAX_LINEAS`
+    líneas: las más antiguas se recortan en lotes y se vuelven a pedir al
+    servidor cuando el usuario se desplaza hasta arriba.
+    """
     def __init__(self, root, backend, leave_cb):
         super().__init__(root, bg=BG, padx=12, pady=12)
         self.backend = backend
         self.leave_cb = leave_cb
         self.sala = None
+        self.primer_seq = None  # Secuencia del mensaje más antiguo mostrado
+        self.ultimo_seq = 0     # Secuencia del mensaje más reciente mostrado
+        self.seq_historial = 0  # Último mensaje incluido en un bloque de historial
+        self.hay_mas = False    # Hay mensajes anteriores a primer_seq en el servidor
+        self.pidiendo = False   # Página anterior pedida y aún no recibida
+        self.seqs = deque()     # Secuencia de cada línea mostrada (0 = aviso)
 
         # Cabecera con nombre de sala y botón de salir
         header = tk.Frame(self, bg=BG)
@@ -279,10 +332,19 @@ class ChatFrame(tk.Frame):
         self.lbl_room = tk.Label(header, text="Sala: —", font=("Helvetica",14,"bold"), bg=BG, fg=FG)
         self.lbl_room.pack(side="left")
         tk.Button(header, text="Salir de sala", command=self.leave_cb, bg="lightgray").pack(side="right")
-
-        # Área de texto del chat (solo lectura)
-        self.txt_chat = tk.Text(self, wrap="word", state="disabled", height=20)
-        self.txt_chat.pack(fill="both", expand=True, padx=6, pady=10)
+        # Botón para pedir la página anterior del historial (solo visible si hay más)
+        self.btn_anteriores = tk.Button(header, text="Mensajes anteriores",
+                                        command=self.cargar_anteriores, bg="lightgray")
+
+        # Área de texto del chat (solo lectura) con barra de desplazamiento
+        cuerpo = tk.Frame(self, bg=BG)
+        cuerpo.pack(fill="both", expand=True, padx=6, pady=10)
+        self.scroll = tk.Scrollbar(cuerpo, orient="vertical")
+        self.scroll.pack(side="right", fill="y")
+        self.txt_chat = tk.Text(cuerpo, wrap="word", state="disabled", height=20,
+                                yscrollcommand=self.al_desplazar)
+        self.txt_chat.pack(side="left", fill="both", expand=True)
+        self.scroll.config(command=self.txt_chat.yview)
 
         # Entrada de mensaje y botón enviar
         frame = tk.Frame(self, bg=BG)
@@ -293,21 +355,164 @@ class ChatFrame(tk.Frame):
         tk.Button(frame, text="Enviar", command=self.enviar_msg, bg=ACCENT, fg=WHITE).pack(side="right", padx=6)
 
     def set_room(self, sala):
-        """Configura el chat para la sala seleccionada y limpia el contenido previo."""
+        """
+        Configura el chat para la sala seleccionada. Si es la misma sala que ya
+        se mostraba, conserva el contenido: el servidor enviará solo lo nuevo.
+        """
+        if sala == self.sala:
+            return
         self.sala = sala
         self.lbl_room.config(text=f"Sala: {sala}")
+        self.limpiar()
+
+    def limpiar(self):
+        """Borra los mensajes mostrados."""
+        self.primer_seq = None
+        self.ultimo_seq = 0
+        self.seq_historial = 0
+        self.pidiendo = False
+        self.seqs.clear()
+        self.set_hay_mas(False)
         self.txt_chat.config(state="normal")
         self.txt_chat.delete("1.0",tk.END)
         self.txt_chat.config(state="disabled")
 
+    def set_hay_mas(self, hay_mas):
+        """Indica si existen mensajes anteriores y muestra u oculta el botón."""
+        self.hay_mas = hay_mas
+        if hay_mas:
+            self.btn_anteriores.pack(side="right", padx=6)
+        else:
+            self.btn_anteriores.pack_forget()
+
+    def show_history(self, mensajes, primer_seq, hay_mas):
+        """
+        Muestra un bloque de historial recibido en una trama HISTORY.
+
+        Si el bloque es anterior a lo que ya se muestra, se inserta al inicio.
+        Si no, son los mensajes nuevos al (re)unirse: se omiten los ya mostrados
+        y, si queda un hueco con lo mostrado (faltan mensajes intermedios), se
+        reemplaza el contenido.
+        """
+        if not mensajes and not primer_seq:
+            # Página anterior vacía: no quedan mensajes más antiguos
+            self.pidiendo = False
+            self.set_hay_mas(False)
+            return
+        anterior = self.primer_seq is not None and 0 < primer_seq < self.primer_seq
+        if anterior:
+            self.pidiendo = False
+        else:
+            if self.ultimo_seq and primer_seq > self.ultimo_seq + 1:
+                self.limpiar()
+            mensajes = [m for m in mensajes if not m[0] or m[0] > self.ultimo_seq]
+        primera_pagina = self.primer_seq is None
+        if primer_seq and (primera_pagina or primer_seq < self.primer_seq):
+            self.primer_seq = primer_seq
+        if mensajes:
+            lineas = [ProtocoloCliente.formatear_chat(ts, texto.strip()) for _, ts, texto in mensajes]
+            seqs = [seq for seq, _, _ in mensajes]
+            self.ultimo_seq = max(self.ultimo_seq, seqs[-1])
+            if anterior:
+                self.anteponer_lineas(lineas, seqs)
+            else:
+                self.seq_historial = self.ultimo_seq
+                self.agregar_lineas(lineas, seqs)
+        # El botón depende del bloque más antiguo mostrado, no de un bloque de mensajes nuevos
+        if anterior or primera_pagina:
+            self.set_hay_mas(hay_mas)
+
+    def cargar_anteriores(self):
+        """Pide al backend la página de historial anterior a la más antigua mostrada."""
+        if self.primer_seq and not self.pidiendo:
+            self.pidiendo = True
+            self.backend.request_history(self.primer_seq)
+
+    def al_desplazar(self, primero, ultimo):
+        """
+        yscrollcommand del área de texto: actualiza la barra y, al llegar
+        arriba del todo, pide la página anterior del historial.
+        """
+        self.scroll.set(primero, ultimo)
+        if float(primero) <= 0.0 and float(ultimo) < 1.0 and self.hay_mas:
+            self.cargar_anteriores()
+
+    def append_chats(self, mensajes):
+        """
+        Agrega varios mensajes de chat o avisos con una sola inserción.
+
+        Los mensajes que ya llegaron en el bloque de historial se omiten (uno
+        guardado justo antes de unirse puede llegar por ambas vías).
+
+        Args:
+            mensajes (list): Tuplas (seq, ts, texto); seq 0 para avisos.
+        """
+        lineas = []
+        seqs = []
+        for seq, ts, texto in mensajes:
+            if seq:
+                if seq <= self.seq_historial:
+                    continue
+                self.ultimo_seq = max(self.ultimo_seq, seq)
+            lineas.append(ProtocoloCliente.formatear_chat(ts, texto.strip()))
+            seqs.append(seq)
+        if lineas:
+            self.agregar_lineas(lineas, seqs)
+
     def append_message(self, texto):
         """Agrega un mensaje al área de chat."""
         if texto.startswith("CHAT#") or texto.startswith("NOTIFY#"):
             texto = texto.split("#",1)[1]
+        self.append_chats([(0, 0, texto)])
+
+    def agregar_lineas(self, lineas, seqs):
+        """
+        Agrega líneas al final en una sola inserción. Solo desplaza la vista al
+        final si el usuario ya estaba viendo el final, y recorta el exceso.
+
+        Args:
+            lineas (list): Textos a mostrar, uno por línea.
+            seqs (list): Secuencia de cada línea (0 si no es un mensaje del historial).
+        """
+        siguiendo = self.txt_chat.yview()[1] >= 1.0
+        self.txt_chat.config(state="normal")
+        self.txt_chat.insert(tk.END, "".join(linea + "\n" for linea in lineas))
+        self.seqs.extend(seqs)
+        self.recortar(siguiendo)
+        if siguiendo:
+            self.txt_chat.see(tk.END)
+        self.txt_chat.config(state="disabled")
+
+    def anteponer_lineas(self, lineas, seqs):
+        """Inserta líneas al inicio conservando en pantalla lo que el usuario estaba viendo."""
+        arriba = int(self.txt_chat.index("@0,0").split(".")[0])
         self.txt_chat.config(state="normal")
-        self.txt_chat.insert(tk.END, texto.strip()+"\n")
-        self.txt_chat.see(tk.END)
+        self.txt_chat.insert("1.0", "".join(linea + "\n" for linea in lineas))
         self.txt_chat.config(state="disabled")
+        self.seqs.extendleft(reversed(seqs))
+        self.txt_chat.yview(f"{arriba + len(lineas)}.0")
+
+    def recortar(self, siguiendo):
+        """
+        Borra las líneas más antiguas que exceden el límite, en lotes de
+        SCROLLBACK_LOTE_RECORTE. Si el usuario está leyendo más arriba, se
+        espera a que vuelva al final (salvo que se supere el doble del límite).
+        Los mensajes recortados se pueden volver a pedir desplazándose arriba.
+        """
+        limite = config.SCROLLBACK_MAX_LINEAS
+        if limite <= 0:
+            return
+        exceso = len(self.seqs) - limite
+        if exceso < config.SCROLLBACK_LOTE_RECORTE or (not siguiendo and exceso < limite):
+            return
+        ultimo_recortado = 0
+        for _ in range(exceso):
+            ultimo_recortado = max(ultimo_recortado, self.seqs.popleft())
+        self.txt_chat.delete("1.0", f"{exceso + 1}.0")
+        if ultimo_recortado:
+            # La próxima página anterior empieza justo después de lo recortado
+            self.primer_seq = ultimo_recortado + 1
+            self.set_hay_mas(True)
 
     def enviar_msg(self):
         """Envía el mensaje ingresado al backend y limpia la entrada."""
@@ -8,15 +8,32 @@ Proporciona:
 
 - Conexión y desconexión del servidor.
 - Envío de mensajes y comandos (join/leave room, lista de salas/usuarios).
+- Registro de la última secuencia recibida de la sala, para que al volver a
+  unirse el servidor envíe solo los mensajes nuevos.
+- Reconexión automática si se pierde la conexión: reintentos con espera
+  exponencial aleatoria (para que un reinicio del servidor no reciba a todos
+  los clientes a la vez), HELLO con el mismo nombre y regreso a la sala
+  pidiendo solo los mensajes posteriores al último recibido.
+- Salas repartidas entre varios servidores: si el servidor responde
+  REDIRECT#host:puerto|sala a un JOIN_SALA, el cliente se conecta a ese
+  servidor, repite el HELLO y se une allí.
+- Protocolo binario opcional: el HELLO lo ofrece (PROTOCOLO_BINARIO) y, si
+  el servidor responde CAPACIDADES#bin, los comandos siguientes se envían en
+  binario. Con un servidor que no lo acepta se sigue usando texto.
+- Compresión opcional (COMPRESION): si el servidor acepta "zlib", las tramas
+  grandes (historial, listados) llegan comprimidas en un flujo por conexión.
 - Recepción de mensajes en hilo separado y notificación a la GUI mediante una cola
-  thread-safe (self.queue) para actualizar la interfaz sin bloquearla.
+  thread-safe (self.queue) para actualizar la interfaz sin bloquearla. La GUI
+  registra un aviso (`avisar`) que se llama solo cuando la cola pasa a tener
+  trabajo pendiente, en lugar de revisarla periódicamente.
 """
 
+import random
 import socket
 import threading
 import queue
 import config
-from protocolo_cliente import ProtocoloCliente
+from protocolo_cliente import ProtocoloCliente, DecodificadorTramas, CAPACIDAD_BINARIA, CAPACIDAD_COMPRESION
 
 class BackendCliente:
     """
@@ -28,11 +45,20 @@ class BackendCliente:
         buffer (int): Tamaño del buffer para recibir datos.
         codificacion (str): Codificación de los mensajes.
         socket_cliente (socket): Socket TCP usado para comunicarse con el servidor.
-        activo (bool): Estado de la conexión.
+        activo (bool): La sesión está abierta (falso tras desconectar o rendirse).
+        conectado (bool): Hay un socket listo para enviar (falso mientras se reconecta).
+        sesion_iniciada (bool): El servidor aceptó el HELLO; solo entonces se reconecta.
         receptor_thread (Thread): Hilo que escucha mensajes del servidor.
-        queue (Queue): Cola thread-safe para enviar eventos a la GUI.
+        queue (Queue): Cola thread-safe para enviar eventos a la GUI. Cada
+            elemento es un lote: lista de tuplas (comando, datos) en orden.
+        avisar (callable | None): Función que despierta a la GUI cuando hay
+            eventos nuevos; se llama una vez hasta que la GUI llama a `aviso_atendido`.
         nombre (str): Nombre del usuario conectado.
         sala_actual (str | None): Sala en la que se encuentra el usuario actualmente.
+        sala_seq (str | None): Sala a la que corresponde `ultimo_seq`.
+        host/port cambian al servidor indicado por un REDIRECT.
+        ultimo_seq (int): Secuencia más alta recibida de `sala_seq` (0 = ninguna).
+        binario (bool): El servidor aceptó el protocolo binario en esta conexión.
     """
 
     def __init__(self):
@@ -43,14 +69,33 @@ class BackendCliente:
 
         self.socket_cliente = None
         self.activo = False
+        self.conectado = False
+        self.sesion_iniciada = False
         self.receptor_thread = None
+        self._detener = threading.Event()  # Interrumpe la espera entre reintentos
+        self.binario = False
+        self._salas_ids = {}  # {id: sala} anunciados por el servidor (protocolo binario)
+        self._descompresor = None  # Flujo zlib de la conexión (compresión negociada)
 
         self.queue = queue.Queue()  # Cola thread-safe para comunicar eventos a la GUI
+        self.avisar = None
+        self._avisado = False
 
         # nombre del usuario y sala actual
         self.nombre = None
         self.sala_actual = None
 
+        # Última secuencia vista de la sala, para pedir solo lo nuevo al volver
+        self.sala_seq = None
+        self.ultimo_seq = 0
+        # True desde que se pide unirse hasta recibir la confirmación: los CHAT
+        # que llegan antes son de la sala anterior
+        self._uniendo = False
+        self._sala_previa = None  # Sala a la que volver si se rechaza el JOIN_SALA
+        self._seq_previa = (None, 0)  # (sala_seq, ultimo_seq) a restaurar en ese caso
+        # Redirecciones seguidas del JOIN_SALA en curso (evita ciclos entre servidores)
+        self._redirecciones = 0
+
     def conectar(self, nombre):
         """
         Conecta el cliente al servidor y envía el comando HELLO con el nombre del usuario.
@@ -65,6 +110,10 @@ class BackendCliente:
             self.socket_cliente = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket_cliente.connect((self.host, self.port))
             self.activo = True
+            self.conectado = True
+            self.sesion_iniciada = False
+            self._detener = threading.Event()
+            self._conexion_nueva()
         except Exception as e:
             return False, f"No se pudo conectar: {e}"
 
@@ -73,33 +122,48 @@ class BackendCliente:
         self.receptor_thread.start()
 
         self.nombre = nombre
-        self._enviar_raw(f"HELLO#{nombre}")
+        self._enviar("HELLO", self._datos_hello())
         return True, "Conectado (esperando confirmación del servidor)"
 
-    def _enviar_raw(self, texto):
+    def _enviar(self, comando, datos=""):
         """
-        Envía texto crudo al servidor codificado según la configuración.
+        Envía un comando al servidor, en texto o en binario según lo negociado.
 
         Args:
-            texto (str): Mensaje o comando a enviar.
+            comando (str): Comando a enviar (p.ej. 'MSG').
+            datos (str): Datos del comando con el formato del protocolo de texto.
         """
+        if self.activo and not self.conectado:
+            self._publicar("ERROR", "Sin conexión con el servidor; reintentando...")
+            return
         try:
             if self.activo and self.socket_cliente:
-                self.socket_cliente.sendall(texto.encode(self.codificacion))
+                self.socket_cliente.sendall(ProtocoloCliente.codificar(comando, datos, self.binario))
         except Exception as e:
-            # Notificar error a la GUI
-            self.queue.put(("ERROR", f"Error al enviar: {e}"))
-            self.activo = False
+            # Notificar error a la GUI y cerrar el socket: el hilo receptor
+            # lo detecta y se encarga de reconectar
+            self._publicar("ERROR", f"Error al enviar: {e}")
+            self._cerrar_socket()
 
     def join_room(self, nombre_sala):
         """
         Solicita unirse o crear una sala en el servidor.
 
+        Si es la misma sala cuyos mensajes ya se recibieron, envía la última
+        secuencia vista y el servidor responde solo con los mensajes posteriores.
+
         Args:
             nombre_sala (str): Nombre de la sala.
         """
+        self._sala_previa = self.sala_actual
+        self._seq_previa = (self.sala_seq, self.ultimo_seq)
+        if nombre_sala != self.sala_seq:
+            self.sala_seq = nombre_sala
+            self.ultimo_seq = 0
         self.sala_actual = nombre_sala
-        self._enviar_raw(f"JOIN_SALA#{nombre_sala}")
+        self._uniendo = True
+        self._redirecciones = 0
+        self._enviar("JOIN_SALA", f"{nombre_sala}|{self.ultimo_seq}")
 
     def leave_room(self):
         """
@@ -111,9 +175,9 @@ class BackendCliente:
         """
         if self.sala_actual:
             nombre_sala = self.sala_actual
-            self._enviar_raw(f"LEAVE_SALA#{nombre_sala}")  # notifica al servidor
+            self._enviar("LEAVE_SALA", nombre_sala)  # notifica al servidor
             self.sala_actual = None
-            self.queue.put(("INFO", f"Has salido de la sala {nombre_sala}"))
+            self._publicar("INFO", f"Has salido de la sala {nombre_sala}")
 
     def send_message(self, texto):
         """
@@ -123,66 +187,381 @@ class BackendCliente:
             texto (str): Mensaje a enviar.
         """
         if not self.sala_actual:
-            self.queue.put(("ERROR", "No estás en ninguna sala."))
+            self._publicar("ERROR", "No estás en ninguna sala.")
             return
-        self._enviar_raw(f"MSG#{texto}")
+        self._enviar("MSG", texto)
+
+    def request_history(self, antes_de):
+        """
+        Solicita la página de historial anterior a una secuencia de la sala actual.
+
+        Args:
+            antes_de (int): Secuencia del mensaje más antiguo que ya se tiene.
+        """
+        if self.sala_actual:
+            self._enviar("HISTORY", str(antes_de))
 
     def request_rooms(self):
         """
         Solicita al servidor la lista de salas disponibles.
         """
-        self._enviar_raw("ROOM_LIST#")
+        self._enviar("ROOM_LIST")
 
     def request_users(self):
         """
         Solicita al servidor la lista de todos los usuarios conectados,
         sin importar la sala en la que esté el cliente.
         """
-        self._enviar_raw("USER_LIST_ALL#")
+        self._enviar("USER_LIST_ALL")
 
     def disconnect(self):
         """
         Desconecta el cliente del servidor.
 
         - Envía comando SALIR.
+        - Detiene los reintentos de reconexión.
         - Cierra socket.
         - Actualiza estado de conexión.
         """
+        # Primero detener: el cierre que provoca SALIR no debe reconectar
+        self._detener.set()
         try:
-            if self.activo:
-                self._enviar_raw("SALIR#")
-            if self.socket_cliente:
-                self.socket_cliente.close()
+            if self.activo and self.conectado:
+                self._enviar("SALIR")
         except:
             pass
         self.activo = False
+        self.conectado = False
+        self._cerrar_socket()
 
     def _escuchar(self):
         """
         Hilo que escucha continuamente mensajes del servidor.
 
+        - Separa las tramas recibidas (una lectura puede traer varias o una parcial);
+          el buffer de recepción crece durante las ráfagas.
         - Decodifica los mensajes según el protocolo.
-        - Coloca eventos en la cola para que la GUI los procese.
+        - Coloca en la cola un solo lote con los eventos de cada lectura.
+        - Si el servidor redirige la sala a otro servidor, se cambia a ese (ver _redirigir).
+        - Si la conexión se pierde, intenta reconectar (ver _reconectar).
         """
+        # Evento propio de esta conexión: tras disconnect() este hilo termina
+        # aunque se abra una sesión nueva con conectar()
+        detener = self._detener
+        decodificador = self._nuevo_decodificador()
         try:
-            while self.activo:
+            while self.activo and not detener.is_set():
                 try:
-                    data = self.socket_cliente.recv(self.buffer)
-                    if not data:
-                        self.queue.put(("DISCONNECTED", "Conexión cerrada por el servidor."))
-                        self.activo = False
-                        break
-
-                    mensaje = data.decode(self.codificacion)
-                    comando, datos = ProtocoloCliente.procesar_respuesta(mensaje)
-                    self.queue.put((comando, datos))
-                except ConnectionResetError:
-                    self.queue.put(("DISCONNECTED", "Conexión perdida."))
-                    self.activo = False
-                    break
+                    tramas = decodificador.recibir(self.socket_cliente)
+                    if tramas is None:
+                        motivo = "Conexión cerrada por el servidor."
+                    else:
+                        eventos = self._eventos(tramas)
+                        redireccion = next((d for c, d in eventos if c == "REDIRECT"), None)
+                        if redireccion is not None:
+                            eventos = [(c, d) for c, d in eventos if c != "REDIRECT"]
+                        if eventos:
+                            self._publicar_lote(eventos)
+                        if redireccion is None:
+                            continue
+                        decodificador = self._redirigir(redireccion, decodificador, detener)
+                        if decodificador is not None:
+                            continue
+                        motivo = "No se pudo conectar al servidor de la sala."
+                except OSError:
+                    if not self.activo or detener.is_set():
+                        break  # disconnect() cerró el socket
+                    motivo = "Conexión perdida."
                 except Exception as e:
-                    self.queue.put(("ERROR", f"Error recepción: {e}"))
+                    self._publicar("ERROR", f"Error recepción: {e}")
                     self.activo = False
                     break
+
+                if not self.activo or detener.is_set():
+                    break
+                decodificador = self._reconectar(motivo, detener)
+                if decodificador is None:
+                    break
         finally:
+            if not detener.is_set():
+                self.activo = False
+                self.conectado = False
+
+    def _reconectar(self, motivo, detener):
+        """
+        Reintenta la conexión con espera exponencial y jitter completo: antes
+        del intento n se espera un tiempo al azar entre 0 y
+        min(RECONEXION_MAX, RECONEXION_BASE * 2^(n-1)) segundos.
+
+        Args:
+            motivo (str): Causa de la desconexión, mostrada a la GUI.
+            detener (threading.Event): Evento de la conexión; `disconnect()` lo activa.
+
+        Returns:
+            DecodificadorTramas | None: Decodificador del nuevo socket, o None si
+            la sesión terminó (sin reconexión posible, `disconnect()` o sin más intentos).
+        """
+        self.conectado = False
+        self._cerrar_socket()
+        intentos = config.RECONEXION_INTENTOS
+        if not self.sesion_iniciada or intentos <= 0:
+            self._publicar("DISCONNECTED", motivo)
             self.activo = False
+            return None
+
+        for intento in range(1, intentos + 1):
+            espera = random.uniform(0, min(config.RECONEXION_MAX,
+                                           config.RECONEXION_BASE * 2 ** (intento - 1)))
+            self._publicar("RECONNECTING", f"{motivo} Reintentando en {espera:.1f} s "
+                                           f"(intento {intento} de {intentos})...")
+            if detener.wait(espera) or not self.activo:
+                return None
+            try:
+                decodificador, eventos = self._reanudar()
+            except (OSError, ValueError) as e:
+                self._cerrar_socket()
+                motivo = f"No se pudo reconectar: {e}."
+                continue
+            if detener.is_set():
+                self._cerrar_socket()
+                return None
+            self.conectado = True
+            self._publicar_lote([("RECONNECTED", "Conexión restablecida.")] + eventos)
+            return decodificador
+
+        self._publicar("DISCONNECTED", f"No se pudo reconectar tras {intentos} intentos.")
+        self.activo = False
+        return None
+
+    def _redirigir(self, datos, decodificador, detener):
+        """
+        Sigue un REDIRECT#host:puerto|sala: cierra la conexión actual y se une
+        a la sala en el servidor indicado, que pasa a ser el servidor del cliente.
+
+        Args:
+            datos (str): 'host:puerto|sala'.
+            decodificador (DecodificadorTramas): Decodificador de la conexión actual.
+            detener (threading.Event): Evento de la conexión.
+
+        Returns:
+            DecodificadorTramas | None: Decodificador de la conexión que queda
+            abierta (la actual si se ignora la redirección), o None si no se
+            pudo conectar al nuevo servidor (el llamador reconecta al anterior).
+        """
+        destino, _, sala = datos.partition("|")
+        host, _, puerto = destino.rpartition(":")
+        if sala != self.sala_actual or detener.is_set():
+            return decodificador  # El usuario ya pidió otra sala
+        self._redirecciones += 1
+        if self._redirecciones > config.REDIRECCIONES_MAX or not puerto.isdigit():
+            self.sala_actual = None
+            self._uniendo = False
+            self._publicar("ERROR", f"No se pudo ubicar el servidor de la sala {sala}.")
+            return decodificador
+
+        try:
+            self.socket_cliente.sendall(ProtocoloCliente.codificar("SALIR", "", self.binario))
+        except OSError:
+            pass
+        self.conectado = False
+        self._cerrar_socket()
+        anterior = self.host, self.port
+        self.host, self.port = host, int(puerto)
+        try:
+            decodificador, eventos = self._reanudar(mostrar_union=True)
+        except (OSError, ValueError) as e:
+            # Volver al servidor anterior (lo hace _reconectar), fuera de la sala
+            self._cerrar_socket()
+            self.host, self.port = anterior
+            self.sala_actual = None
+            self._uniendo = False
+            self._publicar("ERROR", f"No se pudo conectar a {destino}: {e}")
+            return None
+        self.conectado = True
+        if eventos:
+            self._publicar_lote(eventos)
+        return decodificador
+
+    def _reanudar(self, mostrar_union=False):
+        """
+        Abre un socket nuevo, repite el HELLO y, si había una sala, vuelve a
+        unirse enviando la última secuencia recibida.
+
+        Las respuestas al HELLO y al JOIN_SALA se leen aquí y no llegan a la
+        GUI (la del JOIN_SALA sí, con `mostrar_union`); lo que el servidor
+        envíe después (historial nuevo) se devuelve para publicarlo junto con
+        el aviso de reconexión.
+
+        Returns:
+            tuple: (DecodificadorTramas, list de eventos pendientes).
+
+        Raises:
+            OSError: Si no se puede conectar o el servidor rechaza el HELLO (por
+                ejemplo, si aún no ha liberado el nombre de la sesión anterior).
+        """
+        sock = socket.create_connection((self.host, self.port), timeout=config.RECONEXION_TIMEOUT)
+        self.socket_cliente = sock
+        self._conexion_nueva()
+        decodificador = self._nuevo_decodificador()
+        pendientes = []
+
+        sock.sendall(ProtocoloCliente.codificar("HELLO", self._datos_hello()))
+        comando, datos = self._respuesta(decodificador, pendientes)
+        if comando != "OK":
+            raise ConnectionRefusedError(datos)
+
+        eventos = []
+        if self.sala_actual:
+            self._uniendo = True
+            sock.sendall(ProtocoloCliente.codificar(
+                "JOIN_SALA", f"{self.sala_actual}|{self.ultimo_seq}", self.binario
+            ))
+            comando, datos = self._respuesta(decodificador, pendientes)
+            self._registrar_seq(comando, datos)
+            if comando != "OK":
+                self.sala_actual = None
+            if comando != "OK" or mostrar_union:
+                eventos.append((comando, datos))
+        sock.settimeout(None)
+        return decodificador, eventos + self._eventos(pendientes)
+
+    def _respuesta(self, decodificador, pendientes):
+        """
+        Devuelve (comando, datos) de la siguiente trama, leyendo del socket si
+        `pendientes` está vacía. Las tramas sobrantes quedan en `pendientes`;
+        CAPACIDADES y SALA se atienden aquí y se saltan.
+        """
+        while True:
+            while not pendientes:
+                tramas = decodificador.recibir(self.socket_cliente)
+                if tramas is None:
+                    raise ConnectionResetError("el servidor cerró la conexión")
+                pendientes.extend(tramas)
+            evento = self._decodificar(pendientes.pop(0))
+            if evento is not None:
+                return evento[:2]
+
+    def _eventos(self, tramas):
+        """Decodifica tramas completas en eventos (comando, datos) y registra secuencias."""
+        eventos = []
+        for trama in tramas:
+            evento = self._decodificar(trama)
+            if evento is None:
+                continue
+            comando, datos, sala = evento
+            if comando == "OK" and datos.startswith("Conexión establecida"):
+                self.sesion_iniciada = True
+            self._registrar_seq(comando, datos, sala)
+            eventos.append((comando, datos))
+        return eventos
+
+    def _decodificar(self, trama):
+        """
+        Decodifica una trama en (comando, datos, sala).
+
+        Las tramas de control del protocolo binario se atienden aquí y
+        devuelven None: CAPACIDADES activa el binario para los envíos
+        siguientes y SALA registra el id de una sala.
+        """
+        comando, datos, sala = ProtocoloCliente.decodificar_trama(trama, self._salas_ids, self._descompresor)
+        if comando == "CAPACIDADES":
+            capacidades = datos.split(",")
+            self.binario = CAPACIDAD_BINARIA in capacidades
+            if CAPACIDAD_COMPRESION in capacidades:
+                self._descompresor = ProtocoloCliente.descompresor()
+            return None
+        if comando == "SALA":
+            return None
+        return comando, datos, sala
+
+    def _datos_hello(self):
+        """Datos del HELLO: el nombre y las capacidades activadas (protocolo binario, compresión)."""
+        capacidades = []
+        if config.PROTOCOLO_BINARIO:
+            capacidades.append(CAPACIDAD_BINARIA)
+        if config.COMPRESION:
+            capacidades.append(CAPACIDAD_COMPRESION)
+        if capacidades:
+            return f"{self.nombre}|+{','.join(capacidades)}"
+        return self.nombre
+
+    def _conexion_nueva(self):
+        """Cada conexión empieza en texto, sin compresión y sin salas anunciadas."""
+        self.binario = False
+        self._salas_ids = {}
+        self._descompresor = None
+
+    def _nuevo_decodificador(self):
+        """Crea el decodificador de tramas para un socket nuevo."""
+        return DecodificadorTramas(tamaño_recepcion=self.buffer,
+                                   recepcion_maxima=config.BUFFER_MAX,
+                                   binario=config.PROTOCOLO_BINARIO or config.COMPRESION)
+
+    def _cerrar_socket(self):
+        """Cierra el socket actual; el hilo receptor despierta con un error si estaba leyendo."""
+        sock = self.socket_cliente
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+    def _publicar(self, comando, datos):
+        """Encola un solo evento para la GUI (ver _publicar_lote)."""
+        self._publicar_lote([(comando, datos)])
+
+    def _publicar_lote(self, eventos):
+        """
+        Encola un lote de eventos para la GUI y la despierta si no tenía
+        trabajo pendiente.
+
+        El lote se encola antes de revisar `_avisado`: si la GUI ya estaba
+        avisada, lo encontrará al vaciar la cola.
+        """
+        self.queue.put(eventos)
+        if not self._avisado and self.avisar is not None:
+            self._avisado = True
+            self.avisar()
+
+    def aviso_atendido(self):
+        """La GUI lo llama antes de vaciar la cola; el próximo evento vuelve a avisar."""
+        self._avisado = False
+
+    def _registrar_seq(self, comando, datos, sala=None):
+        """
+        Actualiza `ultimo_seq` con las tramas CHAT y HISTORY de la sala actual.
+
+        Las tramas binarias indican su sala (`sala`); las de otra sala no cuentan,
+        salvo las de la sala anterior mientras hay un JOIN_SALA pendiente, que
+        actualizan la secuencia a restaurar si se rechaza.
+        """
+        if sala is not None and sala != self.sala_seq:
+            if self._uniendo and comando == "CHAT" and sala == self._seq_previa[0]:
+                seq = ProtocoloCliente.procesar_chat(datos)[0]
+                self._seq_previa = (sala, max(self._seq_previa[1], seq))
+            return
+        if comando == "OK" and datos.startswith("Te has unido a la sala"):
+            self._uniendo = False
+        elif comando == "ERROR" and self._uniendo:
+            # El servidor rechazó el JOIN_SALA (p. ej. máximo de salas
+            # alcanzado): la sesión sigue en la sala anterior
+            self._uniendo = False
+            self.sala_actual = self._sala_previa
+            self.sala_seq, self.ultimo_seq = self._seq_previa
+        elif comando == "CHAT" and (sala is not None or not self._uniendo):
+            seq = ProtocoloCliente.procesar_chat(datos)[0]
+            self.ultimo_seq = max(self.ultimo_seq, seq)
+        elif comando == "HISTORY":
+            # El último mensaje del bloque es el más reciente; en una página
+            # anterior su secuencia es menor y no cambia nada
+            if isinstance(datos, tuple):
+                mensajes = datos[2]
+                seq = mensajes[-1][0] if mensajes else 0
+            else:
+                seq = ProtocoloCliente.procesar_chat(datos.rpartition("\n")[2])[0]
+            self.ultimo_seq = max(self.ultimo_seq, seq)
@@ -3,9 +3,199 @@ protocolo_cliente.py — Protocolo de comunicación del cliente con el servidor
 
 Esta clase define métodos estáticos para interpretar las respuestas del servidor
 y convertirlas en comandos y datos que pueda procesar la GUI o el backend.
-Incluye además un método auxiliar para mostrar los mensajes en consola.
+Incluye además un método auxiliar para mostrar los mensajes en consola y el
+entramado de mensajes (prefijo de longitud de 4 bytes), con un decodificador
+incremental que separa las tramas aunque TCP las una o las parta entre recv().
+
+Si el servidor acepta la capacidad "bin" del HELLO (responde
+CAPACIDADES#bin), las tramas pasan a ser binarias: longitud en varint, un
+byte de código de comando y el cuerpo, con la sala de CHAT e HISTORY como
+un entero anunciado antes en una trama SALA (ver protocolo.py del servidor).
+`decodificar_trama` devuelve CHAT e HISTORY ya separados en tuplas, que
+`procesar_chat` y `procesar_historial` aceptan igual que el texto, así que la
+GUI no distingue el protocolo.
+
+Con la capacidad "zlib" las tramas grandes llegan dentro de una trama
+binaria COMPRIMIDA, cuyo cuerpo continúa el flujo zlib de la conexión
+(iniciado con DICCIONARIO_COMPRESION); ver `descompresor`.
 """
 
+import struct
+import time
+import zlib
+import config
+
+# Cabecera de cada trama: longitud del contenido (uint32 big-endian)
+CABECERA = struct.Struct(">I")
+
+# Capacidades del HELLO: protocolo binario y compresión zlib
+CAPACIDAD_BINARIA = "bin"
+CAPACIDAD_COMPRESION = "zlib"
+
+# Código de un byte de cada comando en las tramas binarias (igual que en el servidor)
+OPCODES = {
+    "HELLO": 1, "JOIN_SALA": 2, "MSG": 3, "USER_LIST": 4, "USER_LIST_ALL": 5,
+    "ROOM_LIST": 6, "HISTORY": 7, "LEAVE_SALA": 8, "SALIR": 9, "OK": 10,
+    "ERROR": 11, "NOTIFY": 12, "CHAT": 13, "REDIRECT": 14, "SALA": 15,
+    "CAPACIDADES": 16, "NODO_USUARIOS": 17, "NODO_SALAS": 18, "COMPRIMIDA": 19,
+}
+COMANDOS_OPCODE = {codigo: comando for comando, codigo in OPCODES.items()}
+
+# Cuerpos binarios (igual que en el servidor)
+CHAT_BINARIO = struct.Struct(">IIQH")       # sala_id, seq, ts, largo del usuario
+HISTORIAL_BINARIO = struct.Struct(">IIBI")  # sala_id, primer_seq, hay_mas, cantidad
+MENSAJE_BINARIO = struct.Struct(">IQHI")    # seq, ts, largo del usuario, largo del texto
+ENTERO_BINARIO = struct.Struct(">I")        # id de sala o secuencia
+
+# Diccionario inicial del flujo zlib de cada conexión (igual en el servidor)
+DICCIONARIO_COMPRESION = (
+    "CAPACIDADES#REDIRECT#ERROR#Comando no reconocido: No hay salas activas. "
+    "No hay usuarios conectados. ha salido de la sala  se ha unido a la sala. "
+    "OK#Te has unido a la sala 'ROOM_LIST#USER_LIST#USER_LIST_ALL#HISTORY#"
+    " (No se encuentra en una sala),  (Sin sala), "
+).encode("utf-8")
+
+# bytes de un solo byte ya creados (códigos y varints cortos)
+_BYTES = [bytes((i,)) for i in range(256)]
+
+
+def codificar_varint(valor):
+    """Codifica un entero no negativo en varint (LEB128: 7 bits por byte)."""
+    if valor < 0x80:
+        return _BYTES[valor]
+    salida = bytearray()
+    while valor > 0x7F:
+        salida.append((valor & 0x7F) | 0x80)
+        valor >>= 7
+    salida.append(valor)
+    return bytes(salida)
+
+
+def leer_varint(datos, posicion=0):
+    """
+    Lee un varint de `datos` desde `posicion`.
+
+    Returns:
+        tuple: (valor, posición siguiente)
+
+    Raises:
+        ValueError: Si el varint está incompleto o es demasiado largo.
+    """
+    if posicion < len(datos) and datos[posicion] < 0x80:
+        return datos[posicion], posicion + 1
+    valor = 0
+    desplazamiento = 0
+    while True:
+        if posicion >= len(datos) or desplazamiento > 63:
+            raise ValueError("Varint incompleto")
+        byte = datos[posicion]
+        posicion += 1
+        valor |= (byte & 0x7F) << desplazamiento
+        if byte < 0x80:
+            return valor, posicion
+        desplazamiento += 7
+
+
+class DecodificadorTramas:
+    """
+    Decodificador incremental de tramas con prefijo de longitud.
+
+    Acumula en un bytearray los bytes de tramas incompletas y devuelve todas
+    las tramas completas de cada lectura. Los bytes consumidos se descartan
+    una sola vez por lectura.
+
+    `recibir` lee en un buffer reutilizable de tamaño adaptable: se duplica
+    cuando una lectura lo llena (ráfagas, historial) y se reduce a la mitad
+    cuando las lecturas son pequeñas.
+
+    Con `binario` acepta además tramas binarias (longitud en varint); se
+    distinguen de las de texto porque el primer byte de una cabecera de texto
+    es 0 (tramas de menos de 16 MiB) y el de una binaria nunca lo es.
+
+    Atributos:
+        tamaño_maximo (int): Longitud máxima aceptada para una trama.
+        tamaño_recepcion (int): Tamaño actual del buffer de recepción.
+        binario (bool): Se ofreció el protocolo binario al servidor.
+    """
+
+    def __init__(self, tamaño_maximo=64 * 1024 * 1024, tamaño_recepcion=4096,
+                 recepcion_maxima=256 * 1024, binario=False):
+        self.binario = binario
+        self.tamaño_maximo = tamaño_maximo
+        self.recepcion_minima = tamaño_recepcion
+        self.recepcion_maxima = max(tamaño_recepcion, recepcion_maxima)
+        self.tamaño_recepcion = tamaño_recepcion
+        self._recepcion = None
+        self._pendiente = bytearray()
+
+    def recibir(self, sock):
+        """
+        Lee del socket en el buffer reutilizable y devuelve las tramas completas.
+
+        Args:
+            sock (socket): Socket conectado en modo bloqueante.
+
+        Returns:
+            list | None: Tramas (bytes) completas, posiblemente vacía, o None
+                         si el servidor cerró la conexión.
+        """
+        if self._recepcion is None or len(self._recepcion) != self.tamaño_recepcion:
+            self._recepcion = memoryview(bytearray(self.tamaño_recepcion))
+        n = sock.recv_into(self._recepcion)
+        if n == 0:
+            return None
+        tramas = self.alimentar(self._recepcion[:n])
+        if n == self.tamaño_recepcion:
+            self.tamaño_recepcion = min(self.tamaño_recepcion * 2, self.recepcion_maxima)
+        elif n < self.tamaño_recepcion // 8:
+            self.tamaño_recepcion = max(self.tamaño_recepcion // 2, self.recepcion_minima)
+        return tramas
+
+    def alimentar(self, datos):
+        """
+        Añade bytes recibidos y extrae todas las tramas completas.
+
+        Args:
+            datos (bytes | memoryview): Bytes leídos del socket.
+
+        Returns:
+            list: Contenido (bytes) de cada trama completa, en orden.
+
+        Raises:
+            ValueError: Si una trama anuncia una longitud mayor que `tamaño_maximo`.
+        """
+        buffer = self._pendiente
+        buffer += datos
+        tramas = []
+        posicion = 0
+        disponible = len(buffer)
+        with memoryview(buffer) as vista:
+            while posicion < disponible:
+                if self.binario and vista[posicion]:
+                    # Trama binaria: longitud en varint
+                    try:
+                        largo, inicio = leer_varint(vista, posicion)
+                    except ValueError:
+                        if disponible - posicion >= 10:
+                            raise
+                        break
+                else:
+                    if disponible - posicion < CABECERA.size:
+                        break
+                    (largo,) = CABECERA.unpack_from(vista, posicion)
+                    inicio = posicion + CABECERA.size
+                if largo > self.tamaño_maximo:
+                    raise ValueError(f"Trama demasiado grande ({largo} bytes)")
+                fin = inicio + largo
+                if fin > disponible:
+                    break
+                tramas.append(bytes(vista[inicio:fin]))
+                posicion = fin
+        if posicion:
+            del buffer[:posicion]
+        return tramas
+
+
 class ProtocoloCliente:
     """
     Clase estática que define el protocolo de cliente para procesar respuestas
@@ -40,6 +230,184 @@ class ProtocoloCliente:
             # Mensaje de chat normal, broadcast de otro usuario
             return "CHAT", mensaje
 
+    @staticmethod
+    def codificar_trama(mensaje):
+        """
+        Codifica un comando de texto como trama lista para enviar al servidor.
+
+        Args:
+            mensaje (str): Comando con formato 'COMANDO#DATOS'.
+
+        Returns:
+            bytes: Cabecera de longitud seguida del mensaje codificado.
+        """
+        datos = mensaje.encode(config.CODIFICACION)
+        return CABECERA.pack(len(datos)) + datos
+
+    @staticmethod
+    def codificar(comando, datos="", binario=False):
+        """
+        Codifica un comando para el servidor en texto o en binario.
+
+        En binario, JOIN_SALA ('sala|ultimo_seq') lleva la secuencia como
+        uint32 seguida del nombre de la sala, y HISTORY la secuencia como uint32.
+
+        Args:
+            comando (str): Comando (p.ej. 'MSG', 'JOIN_SALA').
+            datos (str): Datos con el mismo formato que en el protocolo de texto.
+            binario (bool): El servidor aceptó el protocolo binario.
+
+        Returns:
+            bytes: Trama lista para enviar.
+        """
+        if not binario:
+            return ProtocoloCliente.codificar_trama(f"{comando}#{datos}")
+        if comando == "JOIN_SALA":
+            sala, _, seq = datos.rpartition("|")
+            cuerpo = ENTERO_BINARIO.pack(int(seq or 0)) + sala.encode(config.CODIFICACION)
+        elif comando == "HISTORY":
+            cuerpo = ENTERO_BINARIO.pack(int(datos))
+        else:
+            cuerpo = datos.encode(config.CODIFICACION)
+        return codificar_varint(len(cuerpo) + 1) + _BYTES[OPCODES[comando]] + cuerpo
+
+    @staticmethod
+    def descompresor():
+        """Crea el descompresor del flujo zlib de una conexión que negoció "zlib"."""
+        return zlib.decompressobj(zdict=DICCIONARIO_COMPRESION)
+
+    @staticmethod
+    def decodificar_trama(trama, salas, descompresor=None):
+        """
+        Convierte el contenido de una trama del servidor en (comando, datos, sala).
+
+        Los datos de una trama binaria CHAT son la tupla (seq, ts, texto) de
+        `procesar_chat`, y los de HISTORY la tupla (primer_seq, hay_mas,
+        mensajes) de `procesar_historial`; las demás traen su texto. Una trama
+        SALA registra su id en `salas`. Una trama COMPRIMIDA se descomprime y
+        se decodifica la trama que contiene.
+
+        Args:
+            trama (bytes): Contenido de la trama (sin cabecera).
+            salas (dict): {id: nombre} de las salas anunciadas en esta conexión.
+            descompresor: Flujo zlib de la conexión (ver `descompresor()`), o
+                None si no se negoció la compresión.
+
+        Returns:
+            tuple: (comando, datos, sala) donde sala es el nombre de la sala de
+            una trama binaria CHAT / HISTORY / SALA, o None.
+
+        Raises:
+            zlib.error: Si una trama comprimida no continúa el flujo.
+        """
+        if descompresor is not None and trama[:1] == _BYTES[OPCODES["COMPRIMIDA"]]:
+            trama = descompresor.decompress(trama[1:])
+        if not trama or trama[0] >= 0x20:
+            comando, datos = ProtocoloCliente.procesar_respuesta(
+                trama.decode(config.CODIFICACION, errors="replace")
+            )
+            return comando, datos, None
+        comando = COMANDOS_OPCODE.get(trama[0], f"OPCODE_{trama[0]}")
+        codificacion = config.CODIFICACION
+        try:
+            if comando == "CHAT":
+                sala_id, seq, ts, largo = CHAT_BINARIO.unpack_from(trama, 1)
+                posicion = 1 + CHAT_BINARIO.size + largo
+                texto = (trama[1 + CHAT_BINARIO.size:posicion] + b": " + trama[posicion:]).decode(
+                    codificacion, errors="replace")
+                return comando, (seq, ts, texto), salas.get(sala_id)
+            if comando == "HISTORY":
+                sala_id, primer_seq, hay_mas, cantidad = HISTORIAL_BINARIO.unpack_from(trama, 1)
+                posicion = 1 + HISTORIAL_BINARIO.size
+                desempaquetar, tamaño = MENSAJE_BINARIO.unpack_from, MENSAJE_BINARIO.size
+                mensajes = []
+                for _ in range(cantidad):
+                    seq, ts, largo_usuario, largo_texto = desempaquetar(trama, posicion)
+                    inicio = posicion + tamaño
+                    medio = inicio + largo_usuario
+                    posicion = medio + largo_texto
+                    if posicion > len(trama):
+                        raise ValueError("Mensaje incompleto")
+                    mensajes.append((seq, ts, (trama[inicio:medio] + b": " + trama[medio:posicion]).decode(
+                        codificacion, errors="replace")))
+                return comando, (primer_seq, hay_mas == 1, mensajes), salas.get(sala_id)
+            if comando == "SALA":
+                (sala_id,) = ENTERO_BINARIO.unpack_from(trama, 1)
+                sala = trama[1 + ENTERO_BINARIO.size:].decode(codificacion, errors="replace")
+                salas[sala_id] = sala
+                return comando, sala, sala
+        except (struct.error, ValueError):
+            return comando, "", None
+        return comando, trama[1:].decode(config.CODIFICACION, errors="replace").strip(), None
+
+    @staticmethod
+    def procesar_chat(datos):
+        """
+        Separa la secuencia y la marca de tiempo de un mensaje de chat.
+
+        Formato: '<seq>|<ts>|usuario: texto'. Si el mensaje no trae ese
+        prefijo (servidor antiguo), se devuelve con secuencia y marca 0. Los
+        datos de una trama binaria ya vienen como tupla y se devuelven tal cual.
+
+        Args:
+            datos (str | tuple): Datos de una trama CHAT o una línea de HISTORY.
+
+        Returns:
+            tuple: (seq: int, ts: int, texto: str) con ts en milisegundos.
+        """
+        if isinstance(datos, tuple):
+            return datos
+        partes = datos.split("|", 2)
+        if len(partes) == 3 and partes[0].isdigit() and partes[1].isdigit():
+            return int(partes[0]), int(partes[1]), partes[2]
+        return 0, 0, datos
+
+    @staticmethod
+    def formatear_chat(ts, texto):
+        """
+        Antepone la hora local del mensaje ('[HH:MM] ') si se conoce.
+
+        Args:
+            ts (int): Marca de tiempo del servidor en milisegundos (0 = desconocida).
+            texto (str): Texto 'usuario: mensaje'.
+
+        Returns:
+            str: Texto listo para mostrar.
+        """
+        if not ts:
+            return texto
+        return time.strftime("[%H:%M] ", time.localtime(ts / 1000)) + texto
+
+    @staticmethod
+    def procesar_historial(datos):
+        """
+        Interpreta los datos de una trama HISTORY.
+
+        Formato: primera línea '<primer_seq>|<hay_mas>', luego una línea
+        '<seq>|<ts>|usuario: texto' por cada mensaje. Los datos de una trama
+        binaria ya vienen como tupla y se devuelven tal cual.
+
+        Args:
+            datos (str | tuple): Datos de la trama HISTORY (sin el comando).
+
+        Returns:
+            tuple: (primer_seq: int, hay_mas: bool, mensajes: list[tuple]) donde
+            cada mensaje es (seq, ts, texto) como en procesar_chat.
+        """
+        if isinstance(datos, tuple):
+            return datos
+        cabecera, _, cuerpo = datos.partition("\n")
+        try:
+            primer, mas = cabecera.split("|", 1)
+            primer_seq, hay_mas = int(primer), mas.strip() == "1"
+        except ValueError:
+            primer_seq, hay_mas = 0, False
+        mensajes = [
+            ProtocoloCliente.procesar_chat(linea.strip())
+            for linea in cuerpo.split("\n") if linea.strip()
+        ]
+        return primer_seq, hay_mas, mensajes
+
     @staticmethod
     def mostrar_respuesta(comando, datos):
         """
@@ -64,7 +432,8 @@ class ProtocoloCliente:
         elif comando == "NOTIFY":
             return f"[NOTIFICACIÓN] {datos}"
         elif comando == "CHAT":
-            return datos
+            _, ts, texto = ProtocoloCliente.procesar_chat(datos)
+            return ProtocoloCliente.formatear_chat(ts, texto)
         else:
             # Para comandos desconocidos
             return datos
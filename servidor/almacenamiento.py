@@ -3,11 +3,76 @@ almacenamiento.py — Gestión de historial de mensajes del servidor
 
 Proporciona una forma de guardar y recuperar mensajes de chat en un archivo JSON.
 Incluye sincronización thread-safe para permitir acceso concurrente desde múltiples hilos.
+La función `crear_almacenamiento` elige el backend según `config.BACKEND_HISTORIAL`
+y, si `config.PERSISTENCIA_DIFERIDA` está activo, lo envuelve en una cola de
+escritura diferida.
 """
 
 import json
 import os
 import threading
+import time
+import config
+from registro import log
+
+
+def marca_tiempo():
+    """Marca de tiempo del servidor en milisegundos desde la época Unix."""
+    return int(time.time() * 1000)
+
+
+def crear_almacenamiento():
+    """
+    Crea el backend de historial configurado en `config.BACKEND_HISTORIAL`.
+
+    Returns:
+        Almacenamiento | AlmacenamientoJSONL | AlmacenamientoSQLite | PersistenciaDiferida:
+        Objeto con la interfaz `guardar`, `obtener_historial_sala`, `ultimo_seq` y `cerrar`.
+    """
+    backend = _crear_backend()
+    if not config.PERSISTENCIA_DIFERIDA:
+        return backend
+    from persistencia_diferida import PersistenciaDiferida
+    return PersistenciaDiferida(
+        backend,
+        capacidad=config.COLA_PERSISTENCIA_MAX,
+        lote_max=config.LOTE_PERSISTENCIA_MAX,
+        ventana=config.VENTANA_PERSISTENCIA_MS / 1000,
+        durabilidad=config.DURABILIDAD_HISTORIAL,
+        intervalo=config.DURABILIDAD_INTERVALO_MS / 1000,
+    )
+
+
+def _crear_backend():
+    """Crea el backend de disco según `config.BACKEND_HISTORIAL`."""
+    if config.BACKEND_HISTORIAL == "jsonl":
+        from almacenamiento_jsonl import AlmacenamientoJSONL
+        return AlmacenamientoJSONL(
+            config.ARCHIVO_HISTORIAL_JSONL,
+            ruta_legado=config.ARCHIVO_HISTORIAL,
+            fsync_cada=config.FSYNC_CADA_MENSAJES,
+            fsync_intervalo=config.FSYNC_INTERVALO,
+            max_por_sala=config.MAX_MENSAJES_POR_SALA,
+            compactacion_intervalo=config.COMPACTACION_INTERVALO,
+        )
+    if config.BACKEND_HISTORIAL == "sqlite":
+        from almacenamiento_sqlite import AlmacenamientoSQLite
+        return AlmacenamientoSQLite(
+            config.ARCHIVO_HISTORIAL_SQLITE,
+            ruta_legado=config.ARCHIVO_HISTORIAL,
+            commit_cada=config.FSYNC_CADA_MENSAJES,
+            commit_intervalo=config.FSYNC_INTERVALO,
+            max_por_sala=config.MAX_MENSAJES_POR_SALA,
+            max_lectores=config.SQLITE_LECTORES,
+        )
+    return Almacenamiento(config.ARCHIVO_HISTORIAL)
+
+
+def _secuencia(anterior, msg):
+    """Secuencia de un mensaje del arreglo legado: la siguiente a `anterior`, o su "seq" si es mayor."""
+    seq = msg.get("seq")
+    return seq if isinstance(seq, int) and seq > anterior else anterior + 1
+
 
 class Almacenamiento:
     """
@@ -38,7 +103,7 @@ class Almacenamiento:
             with open(self.ruta, "w", encoding="utf-8") as f:
                 json.dump([], f, ensure_ascii=False, indent=4)
 
-    def guardar(self, sala, usuario, texto):
+    def guardar(self, sala, usuario, texto, ts=None):
         """
         Guarda un mensaje en el historial.
 
@@ -46,49 +111,125 @@ class Almacenamiento:
             sala (str): Nombre de la sala donde se envió el mensaje.
             usuario (str): Nombre del usuario que envió el mensaje.
             texto (str): Contenido del mensaje.
-        """
-        nuevo_registro = {
-            "sala": sala,
-            "usuario": usuario,
-            "texto": texto
-        }
+            ts (int, opcional): Marca de tiempo en milisegundos (por defecto, ahora).
 
+        Returns:
+            int | None: Secuencia del mensaje dentro de la sala, o None si falla.
+        """
         try:
-            with self._lock:
-                # Leer historial existente
-                with open(self.ruta, "r", encoding="utf-8") as f:
-                    historial = json.load(f)
-
-                # Agregar nuevo mensaje
-                historial.append(nuevo_registro)
+            return self.guardar_lote([(sala, usuario, texto, ts)])[0]
+        except Exception as e:
+            log.error("[ERROR AL GUARDAR HISTORIAL] %s", e)
+            return None
 
-                # Guardar nuevamente
-                with open(self.ruta, "w", encoding="utf-8") as f:
-                    json.dump(historial, f, ensure_ascii=False, indent=4)
+    def guardar_lote(self, mensajes, seqs=None):
+        """
+        Guarda varios mensajes leyendo y reescribiendo el archivo una sola vez.
 
-            print(f"[HISTORIAL] Mensaje guardado de {usuario} en sala '{sala}'")
+        Args:
+            mensajes (list): Tuplas (sala, usuario, texto, ts) en orden; ts puede ser None.
+            seqs (list, opcional): Secuencias ya asignadas a los mensajes (escritura
+                diferida). Se respeta cada una mayor que la última de su sala; el
+                mensaje que deja un hueco guarda su "seq".
 
-        except Exception as e:
-            print(f"[ERROR AL GUARDAR HISTORIAL] {e}")
+        Returns:
+            list: Secuencia de cada mensaje dentro de su sala.
+        """
+        pedidas = seqs or [None] * len(mensajes)
+        with self._lock:
+            # Leer historial existente
+            with open(self.ruta, "r", encoding="utf-8") as f:
+                historial = json.load(f)
+
+            ultimos = {}
+            for msg in historial:
+                sala = msg.get("sala")
+                ultimos[sala] = _secuencia(ultimos.get(sala, 0), msg)
+
+            # Agregar nuevos mensajes
+            seqs = []
+            for (sala, usuario, texto, ts), pedida in zip(mensajes, pedidas):
+                msg = {
+                    "sala": sala,
+                    "usuario": usuario,
+                    "texto": texto,
+                    "ts": marca_tiempo() if ts is None else ts
+                }
+                seq = max(ultimos.get(sala, 0) + 1, pedida or 0)
+                if seq != ultimos.get(sala, 0) + 1:
+                    msg["seq"] = seq
+                historial.append(msg)
+                ultimos[sala] = seq
+                seqs.append(seq)
+
+            # Guardar nuevamente
+            with open(self.ruta, "w", encoding="utf-8") as f:
+                json.dump(historial, f, ensure_ascii=False, indent=4)
+        return seqs
 
-    def obtener_historial_sala(self, sala):
+    def leer_historial_sala(self, sala, ultimos=None, despues_de=None, antes_de=None):
         """
-        Recupera todos los mensajes de una sala específica.
+        Recupera los mensajes de una sala específica.
+
+        La secuencia de cada mensaje es su posición dentro de la sala (desde
+        1), salvo después de un hueco, donde el mensaje guarda su "seq".
 
         Args:
             sala (str): Nombre de la sala a consultar.
+            ultimos (int, opcional): Devolver solo los K mensajes más recientes.
+            despues_de (int, opcional): Solo mensajes con secuencia mayor a este valor.
+            antes_de (int, opcional): Solo mensajes con secuencia menor a este valor.
 
         Returns:
             list: Lista de diccionarios con los mensajes de la sala.
-                  Cada diccionario tiene las claves: "sala", "usuario", "texto".
-                  Devuelve lista vacía si ocurre un error.
+                  Cada diccionario tiene las claves: "sala", "seq", "usuario", "texto"
+                  y "ts" (ausente en mensajes guardados antes de existir).
+
+        Raises:
+            Exception: Si no se puede leer el historial.
+        """
+        with self._lock:
+            with open(self.ruta, "r", encoding="utf-8") as f:
+                historial = json.load(f)
+        # Filtrar mensajes de la sala solicitada
+        mensajes = [msg for msg in historial if msg["sala"] == sala]
+        seq = 0
+        for msg in mensajes:
+            seq = msg["seq"] = _secuencia(seq, msg)
+        if despues_de is not None:
+            mensajes = [msg for msg in mensajes if msg["seq"] > despues_de]
+        if antes_de is not None:
+            mensajes = [msg for msg in mensajes if msg["seq"] < antes_de]
+        if ultimos is not None:
+            mensajes = mensajes[-ultimos:] if ultimos > 0 else []
+        return mensajes
+
+    def obtener_historial_sala(self, sala, ultimos=None, despues_de=None, antes_de=None):
+        """
+        Igual que `leer_historial_sala`, pero un error se registra y se
+        devuelve una lista vacía.
         """
         try:
-            with self._lock:
-                with open(self.ruta, "r", encoding="utf-8") as f:
-                    historial = json.load(f)
-            # Filtrar mensajes de la sala solicitada
-            return [msg for msg in historial if msg["sala"] == sala]
+            return self.leer_historial_sala(sala, ultimos, despues_de, antes_de)
         except Exception as e:
-            print(f"[ERROR AL CARGAR HISTORIAL] {e}")
+            log.error("[ERROR AL CARGAR HISTORIAL] %s", e)
             return []
+
+    def ultimo_seq(self, sala):
+        """
+        Devuelve la secuencia del último mensaje de la sala (0 si no hay).
+
+        Raises:
+            Exception: Si no se puede leer el historial (no se supone 0: la
+                sala volvería a empezar desde 1 y repetiría secuencias).
+        """
+        mensajes = self.leer_historial_sala(sala, ultimos=1)
+        return mensajes[-1]["seq"] if mensajes else 0
+
+    def sincronizar(self):
+        """Cada guardado ya reescribe el archivo; existe por compatibilidad con otros backends."""
+        pass
+
+    def cerrar(self):
+        """No mantiene archivos abiertos; existe por compatibilidad con otros backends."""
+        pass
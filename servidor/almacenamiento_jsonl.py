@@ -0,0 +1,420 @@
+"""
+almacenamiento_jsonl.py — Historial de mensajes en formato JSON Lines
+
+Backend alternativo a `Almacenamiento` que guarda cada mensaje como una línea
+JSON al final del archivo (solo anexado). Guardar un mensaje cuesta lo mismo
+con un historial vacío que con millones de mensajes, porque nunca se vuelve a
+leer ni reescribir el archivo completo.
+
+Incluye:
+- Escritura por anexado con fsync por lotes en un hilo de fondo.
+- Número de secuencia por sala en cada mensaje e índice en disco por sala
+  (ver indice_historial.py) para lecturas por ventana.
+- Compactación en segundo plano (retención por sala y líneas corruptas).
+- Importación automática del historial legado (arreglo JSON).
+"""
+
+import json
+import os
+import threading
+import time
+from collections import Counter
+from indice_historial import IndiceHistorial, VACIO
+from almacenamiento import marca_tiempo, _secuencia
+from registro import log
+
+
+class AlmacenamientoJSONL:
+    """
+    Almacenamiento persistente de mensajes en un registro JSON Lines.
+
+    Atributos:
+        ruta (str): Ruta del archivo .jsonl donde se anexan los mensajes.
+        indice (IndiceHistorial): Índice por sala guardado en `ruta + ".idx"`.
+        fsync_cada (int): Mensajes escritos entre cada fsync.
+        fsync_intervalo (float): Segundos máximos entre fsync.
+        max_por_sala (int): Mensajes conservados por sala al compactar (0 = todos).
+        _lock (threading.Lock): Protege el archivo abierto, el índice y los contadores.
+    """
+
+    def __init__(self, ruta_archivo, ruta_legado=None, fsync_cada=64,
+                 fsync_intervalo=1.0, max_por_sala=0, compactacion_intervalo=300):
+        """
+        Abre (o crea) el registro, completa su índice y arranca el hilo de sincronización.
+
+        Args:
+            ruta_archivo (str): Ruta del archivo JSON Lines.
+            ruta_legado (str, opcional): Historial JSON antiguo a importar si el
+                registro todavía no existe.
+            fsync_cada (int): Tamaño del lote de mensajes entre fsync.
+            fsync_intervalo (float): Segundos máximos entre fsync.
+            max_por_sala (int): Retención por sala aplicada al compactar (0 = sin límite).
+            compactacion_intervalo (float): Segundos entre revisiones de compactación.
+        """
+        self.ruta = ruta_archivo
+        self.fsync_cada = max(1, fsync_cada)
+        self.fsync_intervalo = fsync_intervalo
+        self.max_por_sala = max_por_sala
+        self.compactacion_intervalo = compactacion_intervalo
+
+        self._lock = threading.Lock()
+        self._lock_compactacion = threading.Lock()
+        self._pendientes = 0
+        self._descartables = 0
+
+        carpeta = os.path.dirname(self.ruta)
+        if carpeta and not os.path.exists(carpeta):
+            os.makedirs(carpeta)
+
+        if not os.path.exists(self.ruta):
+            self._importar_legado(ruta_legado)
+
+        self._reparar_cola()
+        self.indice = self._abrir_indice()
+
+        conteos = self.indice.conteos()
+        self._lineas = sum(conteos)
+        if self.max_por_sala > 0:
+            self._descartables += sum(max(0, n - self.max_por_sala) for n in conteos)
+
+        self._archivo = open(self.ruta, "ab")
+
+        self._cerrado = False
+        self._evento = threading.Event()
+        self._hilo = threading.Thread(target=self._sincronizador, daemon=True)
+        self._hilo.start()
+
+    # ------------------ ESCRITURA ------------------
+
+    def guardar(self, sala, usuario, texto, ts=None):
+        """
+        Anexa un mensaje al registro y lo indexa con la siguiente secuencia de la sala.
+
+        Args:
+            sala (str): Nombre de la sala donde se envió el mensaje.
+            usuario (str): Nombre del usuario que envió el mensaje.
+            texto (str): Contenido del mensaje.
+            ts (int, opcional): Marca de tiempo en milisegundos (por defecto, ahora).
+
+        Returns:
+            int | None: Secuencia asignada al mensaje, o None si no se pudo guardar.
+        """
+        try:
+            return self.guardar_lote([(sala, usuario, texto, ts)])[0]
+        except Exception as e:
+            log.error("[ERROR AL GUARDAR HISTORIAL] %s", e)
+            return None
+
+    def guardar_lote(self, mensajes, seqs=None):
+        """
+        Anexa varios mensajes tomando el lock una sola vez.
+
+        Args:
+            mensajes (list): Tuplas (sala, usuario, texto, ts) en orden; ts puede ser None.
+            seqs (list, opcional): Secuencias ya asignadas a los mensajes (escritura
+                diferida). Se respeta cada una mayor que la última de su sala; los
+                números saltados quedan como hueco.
+
+        Returns:
+            list: Secuencia asignada a cada mensaje.
+        """
+        # La serialización se hace fuera del lock; solo la secuencia se inserta dentro
+        ahora = marca_tiempo()
+        serializados = [
+            (sala, json.dumps(sala, ensure_ascii=False),
+             json.dumps({"usuario": usuario, "texto": texto, "ts": ahora if ts is None else ts},
+                        ensure_ascii=False)[1:])
+            for sala, usuario, texto, ts in mensajes
+        ]
+        pedidas = seqs or [None] * len(serializados)
+        seqs = []
+        with self._lock:
+            for (sala, sala_json, cuerpo), pedida in zip(serializados, pedidas):
+                desplazamiento = self._archivo.tell()
+                seq = self.indice.registrar(sala, desplazamiento, pedida)
+                linea = f'{{"sala": {sala_json}, "seq": {seq}, {cuerpo}\n'.encode("utf-8")
+                self._archivo.write(linea)
+                seqs.append(seq)
+                if self.max_por_sala > 0 and self.indice.sala(sala).total > self.max_por_sala:
+                    self._descartables += 1
+            self._lineas += len(seqs)
+            self._pendientes += len(seqs)
+            lote_completo = self._pendientes >= self.fsync_cada
+            if lote_completo:
+                # Entregar al sistema operativo; el fsync lo hace el hilo de fondo
+                self._archivo.flush()
+        if lote_completo:
+            self._evento.set()
+        return seqs
+
+    def sincronizar(self):
+        """Vacía el buffer, actualiza el índice en disco y hace fsync del registro."""
+        with self._lock:
+            if self._archivo.closed:
+                return
+            self._archivo.flush()
+            self._pendientes = 0
+            self.indice.persistir(self._archivo.tell())
+            # Duplicar el descriptor permite hacer fsync sin retener el lock
+            fd = os.dup(self._archivo.fileno())
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def cerrar(self):
+        """Detiene el hilo de fondo, sincroniza y cierra el registro."""
+        self._cerrado = True
+        self._evento.set()
+        self._hilo.join(timeout=5)
+        self.sincronizar()
+        with self._lock:
+            self._archivo.close()
+
+    # ------------------ LECTURA ------------------
+
+    def leer_historial_sala(self, sala, ultimos=None, despues_de=None, antes_de=None):
+        """
+        Recupera mensajes de una sala usando el índice: solo se leen las líneas
+        de la ventana pedida, sin tocar los mensajes de otras salas.
+
+        Args:
+            sala (str): Nombre de la sala a consultar.
+            ultimos (int, opcional): Devolver solo los K mensajes más recientes.
+            despues_de (int, opcional): Solo mensajes con secuencia mayor a este valor.
+            antes_de (int, opcional): Solo mensajes con secuencia menor a este valor.
+
+        Returns:
+            list: Lista de diccionarios con las claves "sala", "seq", "usuario", "texto"
+                  y "ts" (si se guardó), en orden de secuencia.
+
+        Raises:
+            Exception: Si no se puede leer el historial.
+        """
+        with self._lock:
+            self._archivo.flush()
+            primer_seq, desplazamientos = self.indice.rango(
+                sala, ultimos=ultimos, despues_de=despues_de, antes_de=antes_de
+            )
+            # El archivo se abre con el lock tomado: aunque una compactación lo
+            # reemplace después, este descriptor sigue apuntando al registro
+            # al que corresponden los desplazamientos.
+            f = open(self.ruta, "rb")
+
+        mensajes = []
+        with f:
+            for seq, desplazamiento in enumerate(desplazamientos, primer_seq):
+                if desplazamiento == VACIO:
+                    continue
+                f.seek(desplazamiento)
+                try:
+                    msg = json.loads(f.readline())
+                except ValueError:
+                    continue
+                if msg.get("sala") != sala:
+                    continue
+                msg["seq"] = seq
+                mensajes.append(msg)
+        return mensajes
+
+    def obtener_historial_sala(self, sala, ultimos=None, despues_de=None, antes_de=None):
+        """
+        Igual que `leer_historial_sala`, pero un error se registra y se
+        devuelve una lista vacía.
+        """
+        try:
+            return self.leer_historial_sala(sala, ultimos, despues_de, antes_de)
+        except Exception as e:
+            log.error("[ERROR AL CARGAR HISTORIAL] %s", e)
+            return []
+
+    def ultimo_seq(self, sala):
+        """
+        Devuelve la secuencia del último mensaje guardado en la sala (0 si no hay).
+
+        Args:
+            sala (str): Nombre de la sala.
+        """
+        with self._lock:
+            return self.indice.sala(sala).siguiente_seq - 1
+
+    # ------------------ MANTENIMIENTO ------------------
+
+    def compactar(self):
+        """
+        Reescribe el registro descartando líneas corruptas y, si hay límite de
+        retención, los mensajes más antiguos de cada sala. Las secuencias de los
+        mensajes conservados no cambian; el índice se regenera con las nuevas
+        posiciones.
+
+        La copia principal se hace sin retener `_lock`; solo el final del archivo
+        escrito durante la compactación se copia con el lock tomado, justo antes
+        de reemplazar el archivo de forma atómica.
+        """
+        with self._lock_compactacion:
+            with self._lock:
+                self._archivo.flush()
+                limite = self._archivo.tell()
+
+            # Primera pasada: última secuencia de cada sala
+            ultimas = {}
+            with open(self.ruta, "rb") as f:
+                for _, msg in self._leer_validos(f, limite):
+                    ultimas[msg["sala"]] = msg["seq"]
+
+            # Segunda pasada: copiar solo lo que se conserva y anotar sus posiciones
+            temporal = self.ruta + ".compactando"
+            nuevas = {}
+            with open(self.ruta, "rb") as f, open(temporal, "wb") as destino:
+                for _, msg in self._leer_validos(f, limite):
+                    sala = msg["sala"]
+                    if self.max_por_sala > 0 and ultimas[sala] - msg["seq"] >= self.max_por_sala:
+                        continue
+                    if sala not in nuevas:
+                        nuevas[sala] = (msg["seq"], [])
+                    primer_seq, desplazamientos = nuevas[sala]
+                    # Rellenar huecos para mantener la relación secuencia → posición
+                    desplazamientos.extend(
+                        [VACIO] * (msg["seq"] - primer_seq - len(desplazamientos))
+                    )
+                    desplazamientos.append(destino.tell())
+                    destino.write((json.dumps(msg, ensure_ascii=False) + "\n").encode("utf-8"))
+
+                with self._lock:
+                    self._archivo.flush()
+                    base = destino.tell()
+                    with open(self.ruta, "rb") as origen:
+                        origen.seek(limite)
+                        cola = origen.read()
+                    destino.write(cola)
+                    destino.flush()
+                    os.fsync(destino.fileno())
+
+                    self._archivo.close()
+                    os.replace(temporal, self.ruta)
+                    self._archivo = open(self.ruta, "ab")
+
+                    self.indice.reemplazar(nuevas, base)
+                    self.indice.reconstruir(self.ruta, base)
+                    self._lineas = sum(self.indice.conteos())
+                    self._pendientes = 0
+                    self._descartables = 0
+
+        log.info("[HISTORIAL] Registro compactado: %s mensajes", self._lineas)
+
+    def _necesita_compactar(self):
+        """Indica si al menos la mitad del registro puede descartarse."""
+        return self._descartables > 0 and self._descartables * 2 >= self._lineas
+
+    def _sincronizador(self):
+        """Hilo de fondo: fsync por lotes o por tiempo y compactación periódica."""
+        ultima_revision = time.monotonic()
+        while not self._cerrado:
+            self._evento.wait(self.fsync_intervalo)
+            self._evento.clear()
+            try:
+                if self._pendientes:
+                    self.sincronizar()
+                if time.monotonic() - ultima_revision >= self.compactacion_intervalo:
+                    ultima_revision = time.monotonic()
+                    if self._necesita_compactar():
+                        self.compactar()
+            except Exception as e:
+                log.error("[ERROR SINCRONIZACIÓN HISTORIAL] %s", e)
+
+    # ------------------ AUXILIARES ------------------
+
+    @staticmethod
+    def _leer_validos(f, limite):
+        """
+        Genera (desplazamiento, mensaje) de los mensajes válidos del archivo `f`
+        hasta el byte `limite`. Los mensajes sin "seq" (importados del formato
+        legado) reciben su posición dentro de la sala.
+        """
+        leidos = 0
+        ultimas = Counter()
+        for linea in f:
+            desplazamiento = leidos
+            leidos += len(linea)
+            if leidos > limite:
+                break
+            try:
+                msg = json.loads(linea)
+            except ValueError:
+                continue
+            if not isinstance(msg, dict) or not isinstance(msg.get("sala"), str):
+                continue
+            msg["seq"] = msg.get("seq") or ultimas[msg["sala"]] + 1
+            ultimas[msg["sala"]] = msg["seq"]
+            yield desplazamiento, msg
+
+    def _abrir_indice(self):
+        """
+        Abre el índice y lo pone al día con el registro: indexa solo el tramo
+        final no cubierto, o lo reconstruye completo si no existe o no coincide.
+        """
+        indice = IndiceHistorial(self.ruta + ".idx")
+        tamaño = os.path.getsize(self.ruta)
+        if indice.cubierto is None or indice.cubierto > tamaño:
+            indice.reiniciar()
+            desde = 0
+        else:
+            desde = indice.cubierto
+        if desde < tamaño or indice.cubierto is None:
+            self._descartables += indice.reconstruir(self.ruta, desde)
+        return indice
+
+    def _importar_legado(self, ruta_legado):
+        """
+        Crea el registro a partir del historial antiguo (arreglo JSON) si existe.
+        El archivo legado no se modifica. Se conserva el "seq" que ya traiga
+        cada mensaje (si es mayor que el anterior de su sala).
+
+        Raises:
+            RuntimeError: Si el historial legado existe pero no se puede leer;
+                no se crea el registro, así que el próximo arranque reintenta.
+        """
+        historial = []
+        if ruta_legado and os.path.exists(ruta_legado):
+            try:
+                with open(ruta_legado, "r", encoding="utf-8") as f:
+                    historial = json.load(f)
+                if not isinstance(historial, list):
+                    raise ValueError("no es un arreglo JSON")
+            except (OSError, ValueError) as e:
+                log.error("[ERROR AL IMPORTAR HISTORIAL] %s: %s", ruta_legado, e)
+                raise RuntimeError(f"No se pudo importar el historial legado {ruta_legado}: {e}") from e
+        temporal = self.ruta + ".importando"
+        importados = 0
+        with open(temporal, "wb") as destino:
+            if historial:
+                ultimas = Counter()
+                for msg in historial:
+                    sala = msg.get("sala")
+                    ultimas[sala] = _secuencia(ultimas[sala], msg)
+                    registro = {
+                        "sala": sala,
+                        "seq": ultimas[sala],
+                        "usuario": msg.get("usuario"),
+                        "texto": msg.get("texto")
+                    }
+                    if "ts" in msg:
+                        registro["ts"] = msg["ts"]
+                    destino.write((json.dumps(registro, ensure_ascii=False) + "\n").encode("utf-8"))
+                    importados += 1
+            destino.flush()
+            os.fsync(destino.fileno())
+        os.replace(temporal, self.ruta)
+        if importados:
+            log.info("[HISTORIAL] Importados %s mensajes de %s", importados, ruta_legado)
+
+    def _reparar_cola(self):
+        """Completa con salto de línea una última línea truncada por un cierre abrupto."""
+        with open(self.ruta, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+                self._descartables += 1
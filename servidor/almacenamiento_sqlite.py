@@ -0,0 +1,380 @@
+"""
+almacenamiento_sqlite.py — Historial de mensajes en SQLite (modo WAL)
+
+Backend alternativo a `Almacenamiento` con la misma interfaz. Los mensajes se
+guardan en una tabla con clave primaria (sala, seq), que sirve de índice para
+leer ventanas de una sala sin recorrer las demás.
+
+- Modo WAL: las lecturas no esperan a las escrituras. Usan un grupo acotado
+  de conexiones de solo lectura que cada consulta toma y devuelve (el
+  servidor con hilos tiene un hilo por cliente: una conexión por hilo
+  dejaría abiertas las de todos los clientes que alguna vez leyeron).
+- Una sola conexión de escritura; los INSERT se confirman por lotes (commit
+  cada N mensajes o cada T segundos desde un hilo de fondo).
+- Sentencias SQL fijas y parametrizadas, que el módulo sqlite3 prepara una
+  vez y reutiliza desde su caché de sentencias.
+- Importación automática del historial legado (arreglo JSON) al crear la base.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from almacenamiento import marca_tiempo
+from registro import log
+
+# Cotas usadas cuando la consulta no limita la secuencia por un extremo
+SEQ_MINIMA = 0
+SEQ_MAXIMA = 2 ** 62
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS mensajes (
+    sala    TEXT    NOT NULL,
+    seq     INTEGER NOT NULL,
+    usuario TEXT,
+    texto   TEXT,
+    ts      INTEGER,
+    PRIMARY KEY (sala, seq)
+) WITHOUT ROWID
+"""
+
+SQL_INSERTAR = "INSERT INTO mensajes (sala, seq, usuario, texto, ts) VALUES (?, ?, ?, ?, ?)"
+SQL_RETENCION = "DELETE FROM mensajes WHERE sala = ? AND seq <= ?"
+SQL_ULTIMO_SEQ = "SELECT MAX(seq) FROM mensajes WHERE sala = ?"
+SQL_HAY_MENSAJES = "SELECT 1 FROM mensajes LIMIT 1"
+SQL_RANGO = (
+    "SELECT seq, usuario, texto, ts FROM mensajes "
+    "WHERE sala = ? AND seq > ? AND seq < ? ORDER BY seq"
+)
+SQL_ULTIMOS = (
+    "SELECT seq, usuario, texto, ts FROM mensajes "
+    "WHERE sala = ? AND seq > ? AND seq < ? ORDER BY seq DESC LIMIT ?"
+)
+
+
+class AlmacenamientoSQLite:
+    """
+    Almacenamiento persistente de mensajes en una base SQLite.
+
+    Atributos:
+        ruta (str): Ruta del archivo de base de datos.
+        commit_cada (int): Mensajes insertados entre cada commit.
+        commit_intervalo (float): Segundos máximos entre commits.
+        max_por_sala (int): Mensajes conservados por sala (0 = todos).
+        max_lectores (int): Conexiones de lectura abiertas como máximo.
+        _lock (threading.Lock): Protege la conexión de escritura y las secuencias.
+    """
+
+    def __init__(self, ruta_archivo, ruta_legado=None, commit_cada=64,
+                 commit_intervalo=1.0, max_por_sala=0, max_lectores=8):
+        """
+        Abre (o crea) la base, activa WAL y arranca el hilo de commits.
+
+        Args:
+            ruta_archivo (str): Ruta del archivo SQLite.
+            ruta_legado (str, opcional): Historial JSON antiguo a importar si la
+                base todavía no existe.
+            commit_cada (int): Tamaño del lote de mensajes entre commits.
+            commit_intervalo (float): Segundos máximos entre commits.
+            max_por_sala (int): Retención por sala (0 = sin límite).
+            max_lectores (int): Lecturas simultáneas (cada una con su
+                conexión); las demás esperan a que se libere una.
+
+        Raises:
+            RuntimeError: Si el historial legado existe pero no se puede
+                importar; la base no se deja creada, así que el próximo
+                arranque reintenta.
+        """
+        self.ruta = ruta_archivo
+        self.commit_cada = max(1, commit_cada)
+        self.commit_intervalo = commit_intervalo
+        self.max_por_sala = max_por_sala
+
+        self._lock = threading.Lock()
+        self._ultimos = {}              # {sala: última secuencia asignada}
+        self._pendientes = 0            # INSERT sin confirmar
+        self._salas_pendientes = set()  # Salas con mensajes sin confirmar
+        self.max_lectores = max(1, max_lectores)
+        self._lectores_libres = deque()  # Conexiones de lectura sin usar
+        self._cupos_lectores = threading.BoundedSemaphore(self.max_lectores)
+        self._lock_lectores = threading.Lock()
+
+        carpeta = os.path.dirname(self.ruta)
+        if carpeta and not os.path.exists(carpeta):
+            os.makedirs(carpeta)
+
+        nueva = not os.path.exists(self.ruta)
+        legado = None
+        if nueva and ruta_legado and os.path.exists(ruta_legado):
+            # Se lee antes de crear la base: si falla, no queda una base vacía
+            try:
+                with open(ruta_legado, "r", encoding="utf-8") as f:
+                    legado = json.load(f)
+                if not isinstance(legado, list):
+                    raise ValueError("no es un arreglo JSON")
+            except (OSError, ValueError) as e:
+                log.error("[ERROR AL IMPORTAR HISTORIAL] %s: %s", ruta_legado, e)
+                raise RuntimeError(f"No se pudo importar el historial legado {ruta_legado}: {e}")
+        self._conexion = self._conectar()
+        self._conexion.execute(ESQUEMA)
+        columnas = [fila[1] for fila in self._conexion.execute("PRAGMA table_info(mensajes)")]
+        if "ts" not in columnas:
+            # Base creada antes de guardar marcas de tiempo
+            self._conexion.execute("ALTER TABLE mensajes ADD COLUMN ts INTEGER")
+        self._conexion.commit()
+        if legado is not None:
+            try:
+                importados = self.importar(legado)
+            except Exception as e:
+                self._conexion.close()
+                for sufijo in ("", "-wal", "-shm"):
+                    if os.path.exists(self.ruta + sufijo):
+                        os.remove(self.ruta + sufijo)
+                log.error("[ERROR AL IMPORTAR HISTORIAL] %s: %s", ruta_legado, e)
+                raise RuntimeError(f"No se pudo importar el historial legado {ruta_legado}: {e}")
+            log.info("[HISTORIAL] Importados %s mensajes de %s", importados, ruta_legado)
+
+        self._cerrado = False
+        self._evento = threading.Event()
+        self._hilo = threading.Thread(target=self._confirmador, daemon=True)
+        self._hilo.start()
+
+    # ------------------ ESCRITURA ------------------
+
+    def guardar(self, sala, usuario, texto, ts=None):
+        """
+        Inserta un mensaje con la siguiente secuencia de la sala. El commit se
+        hace por lotes, no en cada llamada.
+
+        Args:
+            sala (str): Nombre de la sala donde se envió el mensaje.
+            usuario (str): Nombre del usuario que envió el mensaje.
+            texto (str): Contenido del mensaje.
+            ts (int, opcional): Marca de tiempo en milisegundos (por defecto, ahora).
+
+        Returns:
+            int | None: Secuencia asignada al mensaje, o None si no se pudo guardar.
+        """
+        try:
+            return self.guardar_lote([(sala, usuario, texto, ts)])[0]
+        except Exception as e:
+            log.error("[ERROR AL GUARDAR HISTORIAL] %s", e)
+            return None
+
+    def guardar_lote(self, mensajes, seqs=None):
+        """
+        Inserta varios mensajes tomando el lock una sola vez.
+
+        Args:
+            mensajes (list): Tuplas (sala, usuario, texto, ts) en orden; ts puede ser None.
+            seqs (list, opcional): Secuencias ya asignadas a los mensajes (escritura
+                diferida). Se respeta cada una mayor que la última de su sala; los
+                números saltados quedan como hueco.
+
+        Returns:
+            list: Secuencia asignada a cada mensaje.
+        """
+        pedidas = seqs or [None] * len(mensajes)
+        seqs = []
+        ahora = marca_tiempo()
+        with self._lock:
+            for (sala, usuario, texto, ts), pedida in zip(mensajes, pedidas):
+                seq = max(self._ultimo_seq(sala) + 1, pedida or 0)
+                self._conexion.execute(SQL_INSERTAR, (sala, seq, usuario, texto,
+                                                      ahora if ts is None else ts))
+                self._ultimos[sala] = seq
+                if self.max_por_sala > 0 and seq > self.max_por_sala:
+                    self._conexion.execute(SQL_RETENCION, (sala, seq - self.max_por_sala))
+                self._salas_pendientes.add(sala)
+                seqs.append(seq)
+            self._pendientes += len(seqs)
+            if self._pendientes >= self.commit_cada:
+                self._confirmar()
+        return seqs
+
+    def importar(self, mensajes):
+        """
+        Inserta en una sola transacción mensajes del formato legado o JSON Lines.
+
+        Las secuencias continúan a partir de la última de cada sala; si el
+        mensaje ya trae "seq" mayor que esa, se respeta.
+
+        Args:
+            mensajes (iterable): Diccionarios con "sala", "usuario", "texto" y
+                opcionalmente "seq" y "ts".
+
+        Returns:
+            int: Cantidad de mensajes importados.
+        """
+        filas = []
+        with self._lock:
+            ultimas = Counter()
+            for msg in mensajes:
+                sala = msg.get("sala") if isinstance(msg, dict) else None
+                if not isinstance(sala, str):
+                    continue
+                if sala not in ultimas:
+                    ultimas[sala] = self._ultimo_seq(sala)
+                seq = msg.get("seq")
+                if not isinstance(seq, int) or seq <= ultimas[sala]:
+                    seq = ultimas[sala] + 1
+                ultimas[sala] = seq
+                filas.append((sala, seq, msg.get("usuario"), msg.get("texto"), msg.get("ts")))
+            self._conexion.executemany(SQL_INSERTAR, filas)
+            self._ultimos.update(ultimas)
+            self._conexion.commit()
+            self._pendientes = 0
+            self._salas_pendientes.clear()
+        return len(filas)
+
+    def sincronizar(self):
+        """Confirma los mensajes pendientes."""
+        with self._lock:
+            self._confirmar()
+
+    def cerrar(self):
+        """Detiene el hilo de fondo, confirma lo pendiente y cierra las conexiones."""
+        self._cerrado = True
+        self._evento.set()
+        self._hilo.join(timeout=5)
+        with self._lock:
+            self._confirmar()
+            self._conexion.close()
+        with self._lock_lectores:
+            for conexion in self._lectores_libres:
+                try:
+                    conexion.close()
+                except sqlite3.Error:
+                    pass
+            self._lectores_libres.clear()
+
+    # ------------------ LECTURA ------------------
+
+    def leer_historial_sala(self, sala, ultimos=None, despues_de=None, antes_de=None):
+        """
+        Recupera mensajes de una sala con una consulta sobre la clave (sala, seq).
+
+        Se ejecuta en una conexión del grupo de lectura, en paralelo con las
+        escrituras. Si la sala tiene mensajes sin confirmar, primero se
+        confirman para que la lectura los vea.
+
+        Args:
+            sala (str): Nombre de la sala a consultar.
+            ultimos (int, opcional): Devolver solo los K mensajes más recientes.
+            despues_de (int, opcional): Solo mensajes con secuencia mayor a este valor.
+            antes_de (int, opcional): Solo mensajes con secuencia menor a este valor.
+
+        Returns:
+            list: Lista de diccionarios con las claves "sala", "seq", "usuario", "texto"
+                  y "ts" (si se guardó), en orden de secuencia.
+
+        Raises:
+            Exception: Si no se puede leer el historial.
+        """
+        if ultimos is not None and ultimos <= 0:
+            return []
+        if sala in self._salas_pendientes:
+            self.sincronizar()
+        minimo = SEQ_MINIMA if despues_de is None else despues_de
+        maximo = SEQ_MAXIMA if antes_de is None else antes_de
+        with self._lector() as conexion:
+            if ultimos is None:
+                filas = conexion.execute(SQL_RANGO, (sala, minimo, maximo)).fetchall()
+            else:
+                filas = conexion.execute(SQL_ULTIMOS, (sala, minimo, maximo, ultimos)).fetchall()
+        if ultimos is not None:
+            filas.reverse()
+        mensajes = []
+        for seq, usuario, texto, ts in filas:
+            msg = {"sala": sala, "seq": seq, "usuario": usuario, "texto": texto}
+            if ts is not None:
+                msg["ts"] = ts
+            mensajes.append(msg)
+        return mensajes
+
+    def obtener_historial_sala(self, sala, ultimos=None, despues_de=None, antes_de=None):
+        """
+        Igual que `leer_historial_sala`, pero un error se registra y se
+        devuelve una lista vacía.
+        """
+        try:
+            return self.leer_historial_sala(sala, ultimos, despues_de, antes_de)
+        except Exception as e:
+            log.error("[ERROR AL CARGAR HISTORIAL] %s", e)
+            return []
+
+    def ultimo_seq(self, sala):
+        """
+        Devuelve la secuencia del último mensaje guardado en la sala (0 si no hay).
+
+        Args:
+            sala (str): Nombre de la sala.
+        """
+        with self._lock:
+            return self._ultimo_seq(sala)
+
+    def vacia(self):
+        """Indica si la base no tiene ningún mensaje (incluidos los sin confirmar)."""
+        with self._lock:
+            return self._conexion.execute(SQL_HAY_MENSAJES).fetchone() is None
+
+    # ------------------ AUXILIARES ------------------
+
+    def _conectar(self):
+        """Abre una conexión con WAL y sincronización normal (segura en WAL)."""
+        conexion = sqlite3.connect(self.ruta, check_same_thread=False)
+        # Consumir el resultado: un cursor a medio leer mantiene abierta una
+        # transacción de lectura y la conexión dejaría de ver commits nuevos
+        conexion.execute("PRAGMA journal_mode=WAL").fetchall()
+        conexion.execute("PRAGMA synchronous=NORMAL")
+        return conexion
+
+    @contextmanager
+    def _lector(self):
+        """
+        Toma una conexión de lectura del grupo (la abre si no hay una libre) y
+        la devuelve al terminar. Con `max_lectores` lecturas en curso, espera.
+        """
+        with self._cupos_lectores:
+            with self._lock_lectores:
+                conexion = self._lectores_libres.pop() if self._lectores_libres else None
+            if conexion is None:
+                conexion = self._conectar()
+                conexion.execute("PRAGMA query_only=ON")
+            try:
+                yield conexion
+            except BaseException:
+                conexion.close()
+                raise
+            with self._lock_lectores:
+                if self._cerrado:
+                    conexion.close()
+                else:
+                    self._lectores_libres.append(conexion)
+
+    def _ultimo_seq(self, sala):
+        """Última secuencia de la sala (con el lock tomado); se consulta una vez por sala."""
+        seq = self._ultimos.get(sala)
+        if seq is None:
+            seq = self._conexion.execute(SQL_ULTIMO_SEQ, (sala,)).fetchone()[0] or 0
+            self._ultimos[sala] = seq
+        return seq
+
+    def _confirmar(self):
+        """Hace commit de los INSERT pendientes (con el lock tomado)."""
+        if self._pendientes:
+            self._conexion.commit()
+            self._pendientes = 0
+            self._salas_pendientes.clear()
+
+    def _confirmador(self):
+        """Hilo de fondo: confirma los mensajes pendientes cada `commit_intervalo`."""
+        while not self._cerrado:
+            self._evento.wait(self.commit_intervalo)
+            try:
+                if self._pendientes:
+                    self.sincronizar()
+            except Exception as e:
+                log.error("[ERROR SINCRONIZACIÓN HISTORIAL] %s", e)
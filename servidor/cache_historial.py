@@ -0,0 +1,312 @@
+"""
+cache_historial.py — Caché en memoria del historial reciente de cada sala
+
+Envuelve un backend de almacenamiento (Almacenamiento, AlmacenamientoJSONL)
+con la misma interfaz y guarda, por sala, un buffer circular con los últimos
+mensajes. `guardar` escribe en el backend y actualiza el buffer, de modo que
+las uniones a salas populares se sirven desde memoria sin acceso a disco.
+
+Los mensajes se guardan como registros `Mensaje` (mensaje.py), con el
+usuario como id, y así se devuelven; los diccionarios de los backends se
+convierten al cargarlos.
+
+La memoria total está limitada por un presupuesto global (aproximado en
+bytes); al superarlo se expulsan las salas usadas hace más tiempo (LRU).
+"""
+
+import threading
+from collections import OrderedDict, deque
+from mensaje import Mensaje
+from registro import log
+
+# Costo fijo aproximado de un mensaje en memoria (registro con __slots__,
+# enteros de seq y ts, y cabecera de la cadena del texto)
+COSTO_BASE_MENSAJE = 180
+
+# Lecturas del historial que hace un alta en sala cuando `en_memoria` ya no
+# alcanza a cubrir lo guardado desde la lectura anterior (sala muy activa
+# para el tamaño de su buffer)
+INTENTOS_UNION = 3
+
+
+class _BufferSala:
+    """
+    Últimos mensajes de una sala.
+
+    Atributos:
+        mensajes (deque): Mensajes en orden de secuencia (buffer circular).
+        completo (bool): True si el buffer contiene todo el historial de la sala.
+        bytes (int): Tamaño aproximado ocupado por los mensajes.
+    """
+
+    def __init__(self, capacidad, mensajes, completo):
+        self.mensajes = deque(maxlen=capacidad)
+        self.completo = completo
+        self.bytes = 0
+        for msg in mensajes:
+            self.agregar(msg)
+
+    def agregar(self, msg):
+        """
+        Añade un mensaje manteniendo el orden por secuencia.
+
+        Returns:
+            int: Variación en bytes del buffer.
+        """
+        antes = self.bytes
+        lleno = len(self.mensajes) == self.mensajes.maxlen
+        if self.mensajes and msg.seq < self.mensajes[-1].seq:
+            # Dos guardados concurrentes pueden llegar en desorden
+            posicion = len(self.mensajes)
+            while posicion > 0 and self.mensajes[posicion - 1].seq > msg.seq:
+                posicion -= 1
+            if lleno:
+                if posicion == 0:
+                    return 0
+                self._descartar_primero()
+                posicion -= 1
+            self.mensajes.insert(posicion, msg)
+        else:
+            if lleno:
+                self._descartar_primero()
+            self.mensajes.append(msg)
+        self.bytes += _tamaño(msg)
+        return self.bytes - antes
+
+    def _descartar_primero(self):
+        """Saca el mensaje más antiguo; el buffer deja de tener el historial completo."""
+        self.bytes -= _tamaño(self.mensajes.popleft())
+        self.completo = False
+
+    def ventana(self, ultimos=None, despues_de=None, antes_de=None):
+        """
+        Intenta resolver la consulta solo con el buffer.
+
+        Returns:
+            list | None: Mensajes de la ventana, o None si el buffer no alcanza.
+        """
+        seleccion = [
+            msg for msg in self.mensajes
+            if (despues_de is None or msg.seq > despues_de)
+            and (antes_de is None or msg.seq < antes_de)
+        ]
+        if ultimos is not None:
+            seleccion = seleccion[-ultimos:] if ultimos > 0 else []
+
+        if self.completo:
+            return seleccion
+        primero = self.mensajes[0].seq if self.mensajes else None
+        if primero is None:
+            return None
+        if despues_de is not None and despues_de + 1 >= primero:
+            return seleccion
+        if ultimos is not None and len(seleccion) >= ultimos:
+            return seleccion
+        return None
+
+
+def _tamaño(msg):
+    """Tamaño aproximado en memoria de un mensaje del historial (el nombre del usuario se comparte)."""
+    return COSTO_BASE_MENSAJE + len(msg.texto)
+
+
+class CacheHistorial:
+    """
+    Caché LRU por sala delante de un backend de historial.
+
+    Atributos:
+        backend: Almacenamiento real (guardar / leer_historial_sala /
+            obtener_historial_sala / ultimo_seq / cerrar), o la cola de
+            escritura diferida que lo envuelve.
+        mensajes_por_sala (int): Capacidad del buffer circular de cada sala.
+        presupuesto_bytes (int): Memoria máxima aproximada de toda la caché.
+        aciertos, fallos, expulsiones (int): Contadores de uso.
+        _salas (OrderedDict): {nombre_sala: _BufferSala} en orden de uso.
+        _lock (threading.Lock): Protege los buffers y los contadores.
+    """
+
+    def __init__(self, backend, mensajes_por_sala=500, presupuesto_bytes=16 * 1024 * 1024):
+        self.backend = backend
+        self.mensajes_por_sala = mensajes_por_sala
+        self.presupuesto_bytes = presupuesto_bytes
+
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+
+        self._salas = OrderedDict()
+        self._bytes = 0
+        # Mensajes guardados mientras una sala se está cargando desde el backend
+        self._cargando = {}
+        self._lock = threading.Lock()
+
+    def guardar(self, sala, usuario, texto, ts=None):
+        """
+        Guarda el mensaje en el backend y lo añade al buffer de la sala si está en caché.
+
+        Returns:
+            int | None: Secuencia asignada por el backend.
+        """
+        seq = self.backend.guardar(sala, usuario, texto, ts)
+        with self._lock:
+            buffer = self._salas.get(sala)
+            if seq is None:
+                # No se conoce la secuencia: la sala se recargará en el próximo acceso
+                if buffer is not None:
+                    self._quitar(sala)
+                return seq
+            msg = Mensaje(seq, ts, usuario, texto)
+            if sala in self._cargando:
+                self._cargando[sala].append(msg)
+            if buffer is not None:
+                self._bytes += buffer.agregar(msg)
+                self._ajustar_presupuesto(sala)
+        return seq
+
+    def obtener_historial_sala(self, sala, ultimos=None, despues_de=None, antes_de=None):
+        """
+        Devuelve mensajes de la sala desde la caché si es posible; si no, carga
+        los últimos mensajes de la sala desde el backend.
+
+        Returns:
+            list[Mensaje]: Registros compartidos con la caché (no deben modificarse).
+        """
+        with self._lock:
+            buffer = self._salas.get(sala)
+            if buffer is not None:
+                self._salas.move_to_end(sala)
+                resultado = buffer.ventana(ultimos, despues_de, antes_de)
+                if resultado is not None:
+                    self.aciertos += 1
+                    return resultado
+            self.fallos += 1
+            cargar = buffer is None and sala not in self._cargando
+            if cargar:
+                self._cargando[sala] = []
+
+        if cargar:
+            buffer = self._cargar(sala)
+            if buffer is not None:
+                with self._lock:
+                    resultado = buffer.ventana(ultimos, despues_de, antes_de)
+                if resultado is not None:
+                    return resultado
+
+        # Ventana más antigua que lo guardado en memoria
+        return [Mensaje.desde_dict(msg) for msg in self.backend.obtener_historial_sala(
+            sala, ultimos=ultimos, despues_de=despues_de, antes_de=antes_de
+        )]
+
+    def en_memoria(self, sala, despues_de=None, ultimos=None):
+        """
+        Devuelve los mensajes de la sala posteriores a `despues_de` que ya
+        están en memoria, sin consultar nunca el backend (se puede llamar
+        desde el bucle de asyncio).
+
+        Args:
+            despues_de (int, opcional): Solo mensajes con secuencia mayor a este valor.
+            ultimos (int, opcional): Devolver como máximo los K más recientes.
+
+        Returns:
+            list[Mensaje] | None: Los del buffer de la sala, o los guardados
+            mientras se carga; vacía si la sala no está en caché. None si el
+            buffer ya descartó mensajes posteriores a `despues_de` (y no
+            alcanza con los `ultimos` que quedan): hay que volver a leer.
+        """
+        with self._lock:
+            buffer = self._salas.get(sala)
+            mensajes = buffer.mensajes if buffer is not None else sorted(
+                self._cargando.get(sala, ()), key=lambda msg: msg.seq
+            )
+            seleccion = []
+            for msg in reversed(mensajes):
+                if despues_de is not None and msg.seq <= despues_de:
+                    break
+                if ultimos is not None and len(seleccion) >= ultimos:
+                    break
+                seleccion.append(msg)
+            if (buffer is not None and not buffer.completo and len(seleccion) == len(mensajes)
+                    and (ultimos is None or len(seleccion) < ultimos)
+                    and (not mensajes or mensajes[0].seq > (despues_de or 0) + 1)):
+                return None
+        seleccion.reverse()
+        return seleccion
+
+    def ultimo_seq(self, sala):
+        """Devuelve la secuencia del último mensaje de la sala (0 si no hay)."""
+        with self._lock:
+            buffer = self._salas.get(sala)
+            if buffer is not None:
+                if buffer.mensajes:
+                    return buffer.mensajes[-1].seq
+                if buffer.completo:
+                    return 0
+        return self.backend.ultimo_seq(sala)
+
+    def estadisticas(self):
+        """
+        Devuelve los contadores de la caché.
+
+        Returns:
+            dict: aciertos, fallos, expulsiones, salas, mensajes y bytes en memoria.
+        """
+        with self._lock:
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "expulsiones": self.expulsiones,
+                "salas": len(self._salas),
+                "mensajes": sum(len(b.mensajes) for b in self._salas.values()),
+                "bytes": self._bytes,
+            }
+
+    def cerrar(self):
+        """Cierra el backend subyacente."""
+        self.backend.cerrar()
+
+    # ------------------ AUXILIARES ------------------
+
+    def _cargar(self, sala):
+        """
+        Carga los últimos mensajes de la sala desde el backend y los instala en caché.
+
+        Returns:
+            _BufferSala | None: El buffer instalado, o None si el backend
+            falló; en ese caso la sala no queda en caché y el próximo acceso
+            vuelve a intentarlo.
+        """
+        try:
+            mensajes = [Mensaje.desde_dict(msg) for msg in
+                        self.backend.leer_historial_sala(sala, ultimos=self.mensajes_por_sala)]
+        except Exception as e:
+            log.error("[ERROR AL CARGAR HISTORIAL] Sala '%s': %s", sala, e)
+            with self._lock:
+                self._cargando.pop(sala, None)
+            return None
+        with self._lock:
+            recientes = self._cargando.pop(sala, [])
+            completo = len(mensajes) < self.mensajes_por_sala
+            buffer = _BufferSala(self.mensajes_por_sala, mensajes, completo)
+            ultimo = mensajes[-1].seq if mensajes else 0
+            for msg in recientes:
+                if msg.seq > ultimo:
+                    buffer.agregar(msg)
+            self._salas[sala] = buffer
+            self._bytes += buffer.bytes
+            self._ajustar_presupuesto(sala)
+        return buffer
+
+    def _quitar(self, sala):
+        """Elimina una sala de la caché (con el lock tomado)."""
+        buffer = self._salas.pop(sala)
+        self._bytes -= buffer.bytes
+
+    def _ajustar_presupuesto(self, protegida):
+        """Expulsa salas menos usadas hasta respetar el presupuesto (con el lock tomado)."""
+        while self._bytes > self.presupuesto_bytes and len(self._salas) > 1:
+            sala = next(iter(self._salas))
+            if sala == protegida:
+                self._salas.move_to_end(sala)
+                continue
+            self._quitar(sala)
+            self.expulsiones += 1
@@ -0,0 +1,159 @@
+"""
+cluster.py — Reparto de salas entre varios servidores (nodos)
+
+Con `config.NODOS` se despliegan varios servidores independientes; cada sala
+pertenece a uno solo, elegido con un hash consistente de su nombre. Todos los
+nodos usan la misma lista, así que coinciden en el dueño de cada sala sin
+comunicarse, y agregar o quitar un nodo solo mueve las salas de ese tramo
+del anillo.
+
+Si un cliente pide JOIN_SALA de una sala de otro nodo, el servidor responde
+`REDIRECT#host:puerto|sala` y el cliente se reconecta a ese nodo (HELLO y
+JOIN_SALA con su última secuencia). Los listados USER_LIST / USER_LIST_ALL y
+ROOM_LIST agregan lo de los demás nodos consultándolos con los comandos
+internos NODO_USUARIOS y NODO_SALAS; un nodo que no responde a tiempo se
+omite del listado.
+"""
+
+import bisect
+import hashlib
+import socket
+from protocolo import ProtocoloServidor, DecodificadorTramas
+from registro import log
+import config
+
+
+def _hash(texto):
+    """Hash estable de 64 bits (igual en todos los procesos y nodos)."""
+    return int.from_bytes(hashlib.blake2b(texto.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class AnilloHash:
+    """
+    Anillo de hash consistente con nodos virtuales.
+
+    Atributos:
+        nodos (list): Nodos del anillo ("host:puerto").
+        virtuales (int): Puntos del anillo por nodo (reparten la carga de forma más pareja).
+    """
+
+    def __init__(self, nodos, virtuales=64):
+        self.nodos = list(nodos)
+        self.virtuales = max(1, virtuales)
+        puntos = sorted((_hash(f"{nodo}#{i}"), nodo) for nodo in self.nodos for i in range(self.virtuales))
+        self._claves = [clave for clave, _ in puntos]
+        self._dueños = [nodo for _, nodo in puntos]
+
+    def nodo(self, clave):
+        """
+        Nodo al que pertenece una clave (nombre de sala).
+
+        Returns:
+            str | None: "host:puerto", o None si el anillo está vacío.
+        """
+        if not self._claves:
+            return None
+        return self._dueños[bisect.bisect(self._claves, _hash(clave)) % len(self._claves)]
+
+
+def codificar_usuarios(filas):
+    """Texto de NODO_USUARIOS: una línea 'nombre<TAB>sala' por usuario (sala vacía = sin sala)."""
+    return "\n".join(f"{nombre}\t{sala or ''}" for nombre, sala in filas)
+
+
+def decodificar_usuarios(texto):
+    """Pares (nombre, sala) de un texto de NODO_USUARIOS."""
+    filas = []
+    for linea in texto.split("\n"):
+        if linea:
+            nombre, _, sala = linea.partition("\t")
+            filas.append((nombre, sala or None))
+    return filas
+
+
+class Cluster:
+    """
+    Vista de este servidor sobre el clúster.
+
+    Atributos:
+        propio (str): Dirección de este nodo ("host:puerto", como en NODOS).
+        anillo (AnilloHash): Reparto de salas entre los nodos.
+        timeout (float): Segundos máximos de cada consulta a otro nodo.
+        activo (bool): True si hay más de un nodo.
+    """
+
+    def __init__(self, nodos=None, propio=None, virtuales=None, timeout=None):
+        nodos = list(config.NODOS if nodos is None else nodos)
+        self.propio = config.NODO_PROPIO if propio is None else propio
+        self.timeout = config.NODOS_TIMEOUT if timeout is None else timeout
+        if nodos and self.propio not in nodos:
+            log.error("[CLÚSTER] NODO_PROPIO (%r) no está en NODOS; se ignora el clúster.", self.propio)
+            nodos = []
+        self.anillo = AnilloHash(nodos, config.NODOS_VIRTUALES if virtuales is None else virtuales)
+        self.activo = len(nodos) > 1
+        if self.activo:
+            log.info("[CLÚSTER] Nodo %s de %s", self.propio, ", ".join(nodos))
+
+    def redireccion(self, sala):
+        """
+        Nodo al que debe ir un cliente que pide unirse a `sala`.
+
+        Returns:
+            str | None: "host:puerto" del dueño, o None si la sala es de este nodo.
+        """
+        if not self.activo:
+            return None
+        dueño = self.anillo.nodo(sala)
+        return None if dueño == self.propio else dueño
+
+    def es_propia(self, sala):
+        """Indica si la sala pertenece a este nodo."""
+        return self.redireccion(sala) is None
+
+    def otros(self):
+        """Direcciones de los demás nodos."""
+        return [nodo for nodo in self.anillo.nodos if nodo != self.propio] if self.activo else []
+
+    def usuarios_remotos(self):
+        """Pares (nombre, sala) de los usuarios conectados a los demás nodos."""
+        filas = []
+        for nodo in self.otros():
+            texto = self.consultar(nodo, "NODO_USUARIOS")
+            if texto is not None:
+                filas.extend(decodificar_usuarios(texto))
+        return filas
+
+    def salas_remotas(self):
+        """Nombres de las salas de los demás nodos."""
+        salas = []
+        for nodo in self.otros():
+            texto = self.consultar(nodo, "NODO_SALAS")
+            if texto:
+                salas.extend(texto.split("\n"))
+        return salas
+
+    def consultar(self, nodo, comando):
+        """
+        Envía un comando interno a otro nodo y devuelve los datos de su respuesta.
+
+        Returns:
+            str | None: Datos de la respuesta, o None si el nodo no respondió.
+        """
+        host, _, puerto = nodo.rpartition(":")
+        try:
+            with socket.create_connection((host, int(puerto)), timeout=self.timeout) as sock:
+                sock.sendall(ProtocoloServidor.trama(comando))
+                decodificador = DecodificadorTramas(config.BUFFER, config.TAMAÑO_MAXIMO_TRAMA)
+                while True:
+                    tramas = decodificador.recibir(sock)
+                    if not tramas:
+                        if tramas is None:
+                            raise ConnectionResetError("conexión cerrada")
+                        continue
+                    respuesta, datos = ProtocoloServidor.decodificar_trama(tramas[0])
+                    if respuesta != comando:
+                        raise ValueError(f"respuesta inesperada {respuesta}")
+                    return datos
+        except (OSError, ValueError) as e:
+            log.warning("[CLÚSTER] Sin respuesta de %s a %s: %s", nodo, comando, e)
+            return None
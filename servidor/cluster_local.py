@@ -0,0 +1,79 @@
+"""
+cluster_local.py — Lanza un clúster de servidores en esta máquina
+
+Inicia un nodo por puerto indicado, todos en 127.0.0.1, cada uno con su
+propio directorio de datos (`../datos/nodo_<puerto>/`) y con NODOS apuntando
+a todos ellos, para probar el reparto de salas entre nodos sin varias
+máquinas. Cada nodo se ejecuta en un proceso aparte con el modo del
+servidor configurado (hilos, asyncio o multiproceso) y sus métricas en
+METRICAS_PUERTO + índice * PROCESOS_SERVIDOR. Ctrl+C detiene todos.
+
+Uso (desde la carpeta servidor/):
+    python cluster_local.py 5000 5001 5002
+El cliente puede conectarse a cualquiera de los puertos.
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import config
+
+CARPETA_DATOS = os.path.join("..", "datos")
+
+
+def _nodo(puerto, puertos):
+    """Ejecuta un nodo en este proceso (modo interno --nodo)."""
+    nodos = [f"127.0.0.1:{p}" for p in puertos]
+    indice = puertos.index(puerto)
+    carpeta = os.path.join(CARPETA_DATOS, f"nodo_{puerto}")
+    config.SERVIDOR_HOST = "127.0.0.1"
+    config.SERVIDOR_PUERTO = puerto
+    config.NODOS = nodos
+    config.NODO_PROPIO = nodos[indice]
+    config.ARCHIVO_HISTORIAL = os.path.join(carpeta, "historial.json")
+    config.ARCHIVO_HISTORIAL_JSONL = os.path.join(carpeta, "historial.jsonl")
+    config.ARCHIVO_HISTORIAL_SQLITE = os.path.join(carpeta, "historial.db")
+    if config.METRICAS_PUERTO:
+        config.METRICAS_PUERTO += indice * max(1, config.PROCESOS_SERVIDOR)
+
+    if config.PROCESOS_SERVIDOR > 1:
+        from multiproceso import Coordinador
+        servidor = Coordinador(config.PROCESOS_SERVIDOR)
+    elif config.MODO_SERVIDOR == "asyncio":
+        from nucleo_servidor_async import ServidorChatAsync
+        servidor = ServidorChatAsync()
+    else:
+        from nucleo_servidor import ServidorChat
+        servidor = ServidorChat()
+    servidor.iniciar()
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--nodo":
+        _nodo(int(sys.argv[2]), [int(p) for p in sys.argv[3:]])
+        return
+
+    puertos = [int(p) for p in sys.argv[1:]]
+    if len(puertos) < 2:
+        print("Uso: python cluster_local.py PUERTO PUERTO [PUERTO ...]")
+        sys.exit(1)
+    procesos = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "--nodo", str(puerto)]
+                         + [str(p) for p in puertos])
+        for puerto in puertos
+    ]
+    try:
+        for proceso in procesos:
+            proceso.wait()
+    except KeyboardInterrupt:
+        # Ctrl+C también llega a los nodos (mismo grupo de procesos); se espera a que cierren
+        for proceso in procesos:
+            try:
+                proceso.wait(15)
+            except subprocess.TimeoutExpired:
+                proceso.send_signal(signal.SIGTERM)
+
+
+if __name__ == "__main__":
+    main()
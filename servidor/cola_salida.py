@@ -0,0 +1,193 @@
+"""
+cola_salida.py — Colas de salida por conexión para el servidor con hilos
+
+Cada conexión tiene una cola de tramas pendientes de envío y un hilo escritor
+que la vacía. Retransmitir a una sala solo encola (nunca bloquea), así que un
+cliente lento no frena al remitente ni al resto de la sala.
+
+Cuando los bytes pendientes de una conexión (encolados o en el lote que el
+escritor está enviando) superan el límite (marca de agua alta) se aplica la
+política configurada:
+- "desconectar": se cierra la conexión del cliente lento.
+- "descartar": se descartan las tramas nuevas hasta que la cola baje.
+"""
+
+import socket
+import threading
+from collections import deque
+from itertools import islice
+from registro import log
+
+# Máximo de buffers por llamada a sendmsg (IOV_MAX suele ser 1024)
+MAX_BUFFERS_ENVIO = 512
+
+DESCONECTAR = "desconectar"
+DESCARTAR = "descartar"
+
+
+class MetricasColas:
+    """
+    Contadores compartidos por todas las colas de salida del servidor.
+
+    Atributos:
+        descartadas (int): Tramas descartadas por superar el límite.
+        desconexiones (int): Clientes desconectados por lentos.
+        maxima (int): Mayor cantidad de bytes pendientes observada en una cola.
+    """
+
+    def __init__(self):
+        self.descartadas = 0
+        self.desconexiones = 0
+        self.maxima = 0
+        self._lock = threading.Lock()
+
+    def registrar_descarte(self):
+        """Cuenta una trama descartada."""
+        with self._lock:
+            self.descartadas += 1
+
+    def registrar_desconexion(self):
+        """Cuenta un cliente desconectado por lento."""
+        with self._lock:
+            self.desconexiones += 1
+
+    def registrar_profundidad(self, pendientes):
+        """Actualiza el máximo de bytes pendientes (solo toma el lock si hay un nuevo máximo)."""
+        if pendientes > self.maxima:
+            with self._lock:
+                self.maxima = max(self.maxima, pendientes)
+
+
+class ColaSalida:
+    """
+    Cola de tramas salientes de una conexión, vaciada por un hilo escritor.
+
+    Atributos:
+        sock (socket): Socket del cliente.
+        limite (int): Bytes pendientes a partir de los cuales se aplica la política.
+        politica (str): DESCONECTAR o DESCARTAR.
+        metricas (MetricasColas): Contadores compartidos.
+    """
+
+    def __init__(self, sock, limite, politica=DESCONECTAR, metricas=None):
+        self.sock = sock
+        self.limite = limite
+        self.politica = politica
+        self.metricas = metricas or MetricasColas()
+
+        self._tramas = deque()
+        self._bytes = 0
+        self._cerrada = False
+        self._condicion = threading.Condition()
+        self._hilo = threading.Thread(target=self._escritor, daemon=True)
+        self._hilo.start()
+
+    @property
+    def pendientes(self):
+        """Bytes aún no enviados: los encolados y los del lote en envío."""
+        return self._bytes
+
+    def encolar(self, trama, descartable=True):
+        """
+        Añade una trama para enviar sin bloquear al llamador.
+
+        Args:
+            trama (bytes): Trama ya codificada (puede compartirse entre colas).
+            descartable (bool): False para las tramas que no pueden perderse
+                (un flujo comprimido): con la política "descartar" se
+                desconecta al cliente en lugar de descartarla.
+
+        Returns:
+            bool: False si la cola está cerrada o la trama se descartó.
+        """
+        with self._condicion:
+            if self._cerrada:
+                return False
+            if self._bytes and self._bytes + len(trama) > self.limite:
+                if self.politica == DESCARTAR and descartable:
+                    self.metricas.registrar_descarte()
+                    return False
+                self._cerrada = True
+                self._condicion.notify()
+            else:
+                self._tramas.append(trama)
+                self._bytes += len(trama)
+                self.metricas.registrar_profundidad(self._bytes)
+                self._condicion.notify()
+                return True
+
+        # Cliente lento: cortar la conexión; su hilo lector hará la limpieza
+        self.metricas.registrar_desconexion()
+        log.warning("[COLA] Cliente lento desconectado (cola de salida llena).")
+        self._cortar()
+        return False
+
+    def cerrar(self, espera=1.0):
+        """
+        Deja de aceptar tramas y espera (como máximo `espera` segundos) a que
+        el escritor envíe lo pendiente.
+        """
+        with self._condicion:
+            self._cerrada = True
+            self._condicion.notify()
+        if threading.current_thread() is not self._hilo:
+            self._hilo.join(espera)
+
+    def _escritor(self):
+        """Hilo escritor: envía de una vez todas las tramas acumuladas."""
+        while True:
+            with self._condicion:
+                while not self._tramas and not self._cerrada:
+                    self._condicion.wait()
+                if not self._tramas:
+                    return
+                lote = list(self._tramas)
+                self._tramas.clear()
+                # El lote sigue contando en `_bytes` hasta que termine de enviarse
+                tamaño = sum(len(trama) for trama in lote)
+            try:
+                self._enviar_lote(lote)
+                with self._condicion:
+                    self._bytes -= tamaño
+            except OSError:
+                with self._condicion:
+                    self._cerrada = True
+                    self._tramas.clear()
+                    self._bytes = 0
+                self._cortar()
+                return
+
+    def _enviar_lote(self, lote):
+        """
+        Envía un lote de tramas sin copiarlas a un buffer intermedio.
+
+        Las tramas de difusión se comparten entre todas las colas de la sala,
+        así que se envían con sendmsg (escritura dispersa) en lugar de unirlas
+        con b"".join. Donde no existe sendmsg (Windows) se unen y se usa sendall.
+        """
+        if len(lote) == 1:
+            self.sock.sendall(lote[0])
+            return
+        if not hasattr(self.sock, "sendmsg"):
+            self.sock.sendall(b"".join(lote))
+            return
+        buffers = deque(memoryview(trama) for trama in lote)
+        while buffers:
+            grupo = list(islice(buffers, MAX_BUFFERS_ENVIO))
+            enviados = self.sock.sendmsg(grupo)
+            # Descartar lo enviado; un envío parcial deja el resto de un buffer
+            while enviados:
+                primero = buffers[0]
+                if enviados >= len(primero):
+                    enviados -= len(primero)
+                    buffers.popleft()
+                else:
+                    buffers[0] = primero[enviados:]
+                    enviados = 0
+
+    def _cortar(self):
+        """Interrumpe la conexión para que el hilo lector del cliente termine."""
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
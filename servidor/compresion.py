@@ -0,0 +1,104 @@
+"""
+compresion.py — Compresión zlib por conexión de las tramas grandes
+
+Con la capacidad "zlib" del HELLO, cada conexión tiene un flujo zlib propio
+que empieza con un diccionario compartido (DICCIONARIO_COMPRESION, textos que
+se repiten en las respuestas del servidor). Las tramas de al menos
+COMPRESION_UMBRAL bytes (historial al unirse, listados de usuarios y salas,
+mensajes largos) se envían como una trama binaria COMPRIMIDA con su contenido
+comprimido en ese flujo y vaciado con Z_SYNC_FLUSH. Como el flujo conserva lo
+anterior, los nombres de usuario y de sala que se repiten entre tramas
+también se comprimen. Las tramas pequeñas van sin comprimir.
+
+El cliente descomprime en el mismo orden en que se comprimió, así que las
+tramas comprimidas de una conexión deben encolarse en el orden en que se
+comprimen (`CompresorConexion.lock`) y no pueden descartarse sin romper el
+flujo.
+"""
+
+import threading
+import time
+import zlib
+import config
+from metricas import ContadoresRepartidos
+from protocolo import ProtocoloServidor, OPCODES, DICCIONARIO_COMPRESION
+
+# Ventana (2^bits bytes) y nivel de memoria del compresor: zlib usa unos
+# 2^(bits+2) + 2^(memoria+9) bytes por conexión (32 KiB con estos valores,
+# frente a ~256 KiB con los valores por omisión)
+VENTANA_BITS = 12
+NIVEL_MEMORIA = 5
+
+
+class CompresorConexion:
+    """
+    Flujo zlib de una conexión.
+
+    Atributos:
+        lock (threading.Lock): Mantiene juntos comprimir y encolar, para que
+            las tramas lleguen en el orden en que se comprimieron.
+    """
+
+    __slots__ = ("zlib", "lock")
+
+    def __init__(self, nivel):
+        self.zlib = zlib.compressobj(nivel, zlib.DEFLATED, VENTANA_BITS, NIVEL_MEMORIA,
+                                     zlib.Z_DEFAULT_STRATEGY, DICCIONARIO_COMPRESION)
+        self.lock = threading.Lock()
+
+
+class Compresion:
+    """
+    Crea los compresores de las conexiones y lleva los contadores.
+
+    Atributos:
+        umbral (int): Bytes a partir de los cuales se comprime una trama.
+        nivel (int): Nivel de zlib (1 = más rápido, 9 = más compacto).
+
+    Los contadores (ver `estadisticas`) se reparten por hilo.
+    """
+
+    def __init__(self, umbral=None, nivel=None):
+        self.umbral = config.COMPRESION_UMBRAL if umbral is None else umbral
+        self.nivel = config.COMPRESION_NIVEL if nivel is None else nivel
+        self._contadores = ContadoresRepartidos(
+            "tramas", "bytes_originales", "bytes_comprimidos", "segundos_cpu"
+        )
+
+    def compresor(self):
+        """Crea el flujo zlib de una conexión que negoció "zlib"."""
+        return CompresorConexion(self.nivel)
+
+    def comprimir(self, compresor, trama):
+        """
+        Comprime una trama en el flujo de la conexión si alcanza el umbral.
+
+        Args:
+            compresor (CompresorConexion | None): Flujo de la conexión (None = sin compresión).
+            trama (bytes): Trama ya codificada (texto o binaria).
+
+        Returns:
+            bytes: La trama COMPRIMIDA, o la misma trama si no corresponde comprimirla.
+        """
+        if compresor is None or len(trama) < self.umbral:
+            return trama
+        inicio = time.thread_time()
+        flujo = compresor.zlib
+        datos = flujo.compress(ProtocoloServidor.contenido(trama)) + flujo.flush(zlib.Z_SYNC_FLUSH)
+        comprimida = ProtocoloServidor.trama_binaria(OPCODES["COMPRIMIDA"], datos)
+        self._contadores.sumar(1, len(trama), len(comprimida), time.thread_time() - inicio)
+        return comprimida
+
+    def estadisticas(self):
+        """
+        Devuelve los contadores de compresión.
+
+        Returns:
+            dict: tramas comprimidas, sus bytes originales y comprimidos, los
+            segundos de CPU dedicados a comprimir, la relación de compresión
+            (originales / comprimidos) y los microsegundos de CPU por KiB original.
+        """
+        totales = self._contadores.totales()
+        totales["relacion"] = totales["bytes_originales"] / (totales["bytes_comprimidos"] or 1)
+        totales["us_por_kib"] = totales["segundos_cpu"] * 1e6 * 1024 / (totales["bytes_originales"] or 1)
+        return totales
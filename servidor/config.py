@@ -11,11 +11,149 @@ SERVIDOR_HOST = "0.0.0.0"
 # Puerto TCP donde escuchará el servidor
 SERVIDOR_PUERTO = 5000
 
+# Modelo de concurrencia: "hilos" (un hilo por cliente) o "asyncio" (bucle de eventos)
+MODO_SERVIDOR = "hilos"
+
+# Procesos trabajadores que comparten el puerto con SO_REUSEPORT (1 = un solo
+# proceso). Con más de uno, cada trabajador es un ServidorChat con hilos y un
+# proceso coordinador guarda el historial y la presencia y reparte las
+# difusiones de cada sala entre los trabajadores (ver multiproceso.py).
+PROCESOS_SERVIDOR = 1
+
+# Hilos del coordinador para guardar mensajes y leer historial (modo
+# multiproceso). Las tareas de una sala se atienden en orden; las de salas
+# distintas, en paralelo, y sus escrituras comparten commit.
+HILOS_COORDINADOR = 8
+
+# Nodos del clúster: "host:puerto" de cada servidor, incluido este, tal como
+# los alcanzan los clientes. Cada sala pertenece a un solo nodo (hash
+# consistente de su nombre); JOIN_SALA de una sala de otro nodo responde
+# REDIRECT y el cliente se reconecta allí. Lista vacía = un solo servidor.
+NODOS = []
+
+# Dirección de este servidor tal como aparece en NODOS
+NODO_PROPIO = ""
+
+# Puntos del anillo de hash consistente por nodo
+NODOS_VIRTUALES = 64
+
+# Segundos máximos para consultar a otro nodo (listados de usuarios y salas)
+NODOS_TIMEOUT = 1.0
+
+# Conexiones pendientes de aceptar que admite el socket de escucha
+BACKLOG_CONEXIONES = 1024
+
 # Ruta del archivo JSON donde se almacenará el historial de mensajes
 ARCHIVO_HISTORIAL = "../datos/historial.json"
 
+# Backend de historial: "json" (arreglo JSON legado), "jsonl" (registro de solo
+# anexado) o "sqlite" (base SQLite en modo WAL)
+BACKEND_HISTORIAL = "jsonl"
+
+# Ruta del registro JSON Lines (una línea por mensaje). Si no existe, se crea
+# importando el contenido de ARCHIVO_HISTORIAL.
+ARCHIVO_HISTORIAL_JSONL = "../datos/historial.jsonl"
+
+# Ruta de la base SQLite del backend "sqlite". Si no existe, se crea
+# importando el contenido de ARCHIVO_HISTORIAL.
+ARCHIVO_HISTORIAL_SQLITE = "../datos/historial.db"
+
+# Conexiones de lectura de SQLite abiertas como máximo (lecturas simultáneas)
+SQLITE_LECTORES = 8
+
+# Mensajes escritos entre cada fsync del registro JSON Lines (o commit de SQLite)
+FSYNC_CADA_MENSAJES = 64
+
+# Segundos máximos entre fsync (o commit) aunque no se complete el lote
+FSYNC_INTERVALO = 1.0
+
+# Mensajes conservados por sala en JSON Lines y SQLite (0 = sin límite)
+MAX_MENSAJES_POR_SALA = 0
+
+# Segundos entre revisiones de compactación en segundo plano
+COMPACTACION_INTERVALO = 300
+
+# Escritura diferida del historial: un hilo de fondo guarda los mensajes en
+# grupos y el remitente no espera al disco
+PERSISTENCIA_DIFERIDA = True
+
+# Mensajes máximos en la cola de escritura diferida (si se llena, el remitente espera)
+COLA_PERSISTENCIA_MAX = 10000
+
+# Mensajes máximos escritos por grupo
+LOTE_PERSISTENCIA_MAX = 256
+
+# Milisegundos que el hilo de escritura espera para juntar un grupo
+VENTANA_PERSISTENCIA_MS = 5
+
+# Durabilidad del historial con escritura diferida: "mensaje" (cada mensaje
+# espera a que su grupo esté sincronizado), "intervalo" (sincroniza cada
+# DURABILIDAD_INTERVALO_MS) o "cierre" (vacía y sincroniza al cerrar)
+DURABILIDAD_HISTORIAL = "intervalo"
+
+# Milisegundos entre sincronizaciones en durabilidad "intervalo"
+DURABILIDAD_INTERVALO_MS = 1000
+
 # Tamaño máximo de buffer para recibir mensajes (bytes)
 BUFFER = 1024
 
+# Longitud máxima (bytes) de una trama recibida de un cliente
+TAMAÑO_MAXIMO_TRAMA = 64 * 1024
+
 # Codificación de caracteres utilizada para enviar y recibir datos
 CODIFICACION = "utf-8"
+
+# Aceptar el protocolo binario (capacidad "bin" del HELLO): códigos de un
+# byte, longitudes en varint y salas como enteros. Los clientes que no lo
+# ofrecen siguen usando el protocolo de texto.
+PROTOCOLO_BINARIO = True
+
+# Aceptar la compresión zlib por conexión (capacidad "zlib" del HELLO) para
+# las tramas de al menos COMPRESION_UMBRAL bytes: historial al unirse,
+# listados y mensajes largos. Nivel de zlib de 1 (rápido) a 9 (compacto).
+COMPRESION = True
+COMPRESION_UMBRAL = 512
+COMPRESION_NIVEL = 6
+
+# Mensajes recientes que se guardan en memoria por cada sala
+CACHE_MENSAJES_POR_SALA = 500
+
+# Memoria máxima aproximada (bytes) de la caché de historial de todas las salas
+CACHE_PRESUPUESTO_BYTES = 32 * 1024 * 1024
+
+# Máximo de mensajes del historial enviados al unirse a una sala
+REPLAY_MAX_MENSAJES = 200
+
+# Mensajes por página al pedir historial anterior (comando HISTORY)
+REPLAY_PAGINA = 200
+
+# Bytes pendientes de envío por conexión a partir de los cuales se aplica la
+# política de cliente lento
+LIMITE_COLA_SALIDA = 1024 * 1024
+
+# Política ante un cliente lento: "desconectar" (cierra la conexión) o
+# "descartar" (descarta las tramas nuevas hasta que la cola baje)
+POLITICA_CLIENTE_LENTO = "desconectar"
+
+# Salas y nombres de usuario distintos que registra cada proceso (ver
+# identificadores.py). Alcanzado MAX_SALAS, JOIN_SALA a una sala nueva
+# responde ERROR; los usuarios que superan el máximo funcionan igual, sin
+# compartir la copia de su nombre.
+MAX_SALAS = 10000
+MAX_USUARIOS_REGISTRADOS = 100000
+
+# Nivel mínimo de los mensajes de registro: "debug", "info", "aviso" o "error"
+NIVEL_REGISTRO = "info"
+
+# Mensajes de registro en espera de escribirse; si se llena, se descartan
+REGISTRO_COLA_MAX = 10000
+
+# Puerto de administración con las métricas en formato de texto de Prometheus
+# (GET /metrics); 0 lo desactiva. Escucha solo en la dirección local. En modo
+# multiproceso el trabajador i usa METRICAS_PUERTO + i.
+METRICAS_HOST = "127.0.0.1"
+METRICAS_PUERTO = 9300
+
+# Salas con serie propia en chat_mensajes_total; las demás se cuentan juntas
+# en sala="_otras" (cada serie ocupa memoria en el servidor y en Prometheus)
+METRICAS_MAX_SALAS = 200
@@ -0,0 +1,108 @@
+"""
+difusion.py — Tramas de difusión codificadas una sola vez por mensaje
+
+Al retransmitir a una sala, el texto se formatea y codifica una sola vez en un
+objeto `bytes` inmutable que se comparte entre las colas de salida de todos
+los miembros. Si en la sala hay clientes con el protocolo de texto y con el
+binario, cada codificación se crea una vez, la primera vez que se pide. Los
+contadores permiten comprobar que el costo de codificación por mensaje es
+constante, sin importar el tamaño de la sala; se reparten por hilo
+(`ContadoresRepartidos`) para que las difusiones de salas distintas no
+compartan un lock.
+"""
+
+from metricas import ContadoresRepartidos
+from protocolo import ProtocoloServidor
+
+
+class TramaDifusion:
+    """
+    Trama de una difusión en sus dos codificaciones (texto y binaria).
+
+    Cada una se codifica la primera vez que la pide un miembro con ese
+    protocolo; el mismo objeto bytes va a todos los demás.
+    """
+
+    __slots__ = ("_codificar", "_tramas")
+
+    def __init__(self, texto, binaria):
+        self._codificar = (texto, binaria)
+        self._tramas = [None, None]
+
+    def para(self, sesion):
+        """
+        Trama para la sesión, según el protocolo que negoció.
+
+        Returns:
+            bytes: Trama inmutable, segura para compartir entre colas.
+        """
+        indice = 1 if sesion.binario else 0
+        trama = self._tramas[indice]
+        if trama is None:
+            trama = self._tramas[indice] = self._codificar[indice]()
+        return trama
+
+    @property
+    def bytes_codificados(self):
+        """Bytes de las codificaciones creadas."""
+        return sum(len(trama) for trama in self._tramas if trama is not None)
+
+
+class Difusion:
+    """
+    Construye tramas de difusión y lleva la cuenta de codificaciones y entregas
+    (ver `estadisticas`).
+    """
+
+    def __init__(self):
+        self._contadores = ContadoresRepartidos("difusiones", "bytes_codificados", "entregas")
+
+    def trama(self, comando, datos=""):
+        """
+        Prepara la trama COMANDO#DATOS que se enviará a toda una sala.
+
+        Returns:
+            TramaDifusion: Trama en texto y en binario (ver `TramaDifusion.para`).
+        """
+        return TramaDifusion(
+            lambda: ProtocoloServidor.trama(comando, datos),
+            lambda: ProtocoloServidor.trama(comando, datos, binario=True),
+        )
+
+    def chat(self, sala_id, seq, ts, usuario, texto):
+        """
+        Prepara la trama CHAT de un mensaje retransmitido a una sala.
+
+        Returns:
+            TramaDifusion: Trama en texto y en binario (ver `TramaDifusion.para`).
+        """
+        return TramaDifusion(
+            lambda: ProtocoloServidor.trama_chat(seq, ts, usuario, texto),
+            lambda: ProtocoloServidor.trama_chat(seq, ts, usuario, texto, binario=True, sala_id=sala_id),
+        )
+
+    def registrar(self, trama, entregas):
+        """
+        Cuenta una difusión ya encolada.
+
+        Args:
+            trama (TramaDifusion): Trama devuelta por `trama()` o `chat()`.
+            entregas (int): Destinatarios a los que se encoló.
+        """
+        self._contadores.sumar(1, trama.bytes_codificados, entregas)
+
+    def estadisticas(self):
+        """
+        Devuelve los contadores de difusión.
+
+        Returns:
+            dict: difusiones (tramas codificadas, una por mensaje retransmitido),
+            bytes codificados y entregas (tramas encoladas a destinatarios), más
+            los bytes asignados por difusión (constante en el tamaño de la sala)
+            y las entregas por difusión (destinatarios que compartieron cada trama).
+        """
+        totales = self._contadores.totales()
+        difusiones = totales["difusiones"] or 1
+        totales["bytes_por_difusion"] = totales["bytes_codificados"] / difusiones
+        totales["entregas_por_difusion"] = totales["entregas"] / difusiones
+        return totales
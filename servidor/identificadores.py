@@ -0,0 +1,89 @@
+"""
+identificadores.py — Nombres internados como enteros pequeños
+
+`Identificadores` asigna a cada nombre un id estable mientras dure el proceso
+del servidor (desde 1; 0 significa "sin sala") y permite volver del id al
+nombre. Hay un registro por proceso para las salas (SALAS) y otro para los
+usuarios (USUARIOS):
+
+- El protocolo binario envía la sala de cada CHAT e HISTORY como su id.
+- Los mensajes del historial en memoria (mensaje.py) guardan el id del
+  usuario en lugar de una copia de su nombre por mensaje.
+- Las sesiones guardan la copia registrada de su nombre y su sala
+  (`interno`), así que miles de miembros de una sala comparten una sola
+  cadena en lugar de una por trama JOIN_SALA decodificada.
+
+Los nombres no se liberan (los ids viajan en las tramas y en los mensajes
+de la caché), así que cada registro tiene un máximo de nombres distintos
+(MAX_SALAS, MAX_USUARIOS_REGISTRADOS). Lleno el registro, `id` devuelve None
+para un nombre nuevo e `interno` lo devuelve sin registrar: el servidor
+rechaza las salas nuevas y los usuarios nuevos siguen funcionando con su
+propia copia del nombre.
+"""
+
+import threading
+import config
+
+
+class Identificadores:
+    """
+    Registro nombre ↔ id.
+
+    Consultar un nombre ya registrado no toma el lock; solo el alta de un
+    nombre nuevo lo hace.
+
+    Atributos:
+        nombres (list): Nombre de cada id (posición 0 sin usar). Solo crece;
+            se puede indexar sin lock con un id ya asignado.
+        maximo (int): Nombres distintos que admite el registro.
+        _ids (dict): {nombre: id}
+    """
+
+    def __init__(self, maximo):
+        self._ids = {}
+        self.nombres = [None]
+        self.maximo = maximo
+        self._lock = threading.Lock()
+
+    def id(self, nombre):
+        """
+        Devuelve el id de `nombre`, asignándole uno nuevo la primera vez.
+
+        Returns:
+            int | None: El id, o None si el nombre es nuevo y el registro está lleno.
+        """
+        identificador = self._ids.get(nombre)
+        if identificador is None:
+            with self._lock:
+                identificador = self._ids.get(nombre)
+                if identificador is None:
+                    if len(self._ids) >= self.maximo:
+                        return None
+                    identificador = len(self.nombres)
+                    self.nombres.append(nombre)
+                    self._ids[nombre] = identificador
+        return identificador
+
+    def nombre(self, identificador):
+        """Devuelve el nombre de un id, o None si no existe."""
+        if 0 < identificador < len(self.nombres):
+            return self.nombres[identificador]
+        return None
+
+    def interno(self, nombre):
+        """
+        Devuelve la copia registrada de `nombre` (la misma cadena en todo el
+        proceso), o el propio `nombre` si el registro está lleno.
+        """
+        identificador = self.id(nombre)
+        if identificador is None:
+            return nombre
+        return self.nombres[identificador]
+
+    def __len__(self):
+        return len(self._ids)
+
+
+# Registros del proceso
+SALAS = Identificadores(config.MAX_SALAS)
+USUARIOS = Identificadores(config.MAX_USUARIOS_REGISTRADOS)
@@ -0,0 +1,271 @@
+"""
+indice_historial.py — Índice en disco por sala para el registro JSON Lines
+
+Para cada sala se guarda un archivo binario con la posición (byte) de cada
+mensaje dentro del registro, ordenado por número de secuencia. Con él se
+pueden leer "los últimos K mensajes de la sala X" o "los mensajes posteriores
+a la secuencia S" sin recorrer el historial de las demás salas.
+
+Formato de cada archivo `<sha1(sala)>.idx`:
+- 8 bytes: número de secuencia del primer mensaje indexado.
+- 8 bytes por mensaje: desplazamiento de su línea en el registro.
+
+El archivo `estado.json` guarda hasta qué byte del registro está indexado,
+para completar el índice al arrancar sin recorrer todo el registro.
+
+El índice no es seguro para hilos: quien lo usa (AlmacenamientoJSONL) lo
+protege con su propio lock.
+"""
+
+import hashlib
+import json
+import os
+import struct
+
+# Desplazamiento usado para secuencias que no existen en el registro
+VACIO = 0xFFFFFFFFFFFFFFFF
+
+
+class _SalaIndexada:
+    """
+    Estado en memoria del índice de una sala.
+
+    Atributos:
+        primer_seq (int): Secuencia del primer mensaje indexado.
+        en_disco (int): Entradas ya escritas en el archivo de la sala.
+        pendientes (list): Desplazamientos registrados aún no escritos.
+    """
+
+    def __init__(self, primer_seq, en_disco):
+        self.primer_seq = primer_seq
+        self.en_disco = en_disco
+        self.pendientes = []
+
+    @property
+    def total(self):
+        """Número de mensajes indexados (en disco y pendientes)."""
+        return self.en_disco + len(self.pendientes)
+
+    @property
+    def siguiente_seq(self):
+        """Secuencia que recibirá el próximo mensaje de la sala."""
+        return self.primer_seq + self.total
+
+
+class IndiceHistorial:
+    """
+    Índice por sala y por secuencia de los mensajes de un registro JSON Lines.
+
+    Atributos:
+        carpeta (str): Carpeta donde se guardan los archivos del índice.
+        cubierto (int | None): Bytes del registro ya indexados (None si no hay índice).
+        _salas (dict): {nombre_sala: _SalaIndexada} cargadas en memoria.
+    """
+
+    ENTRADA = struct.Struct("<Q")
+
+    def __init__(self, carpeta):
+        self.carpeta = carpeta
+        if not os.path.exists(self.carpeta):
+            os.makedirs(self.carpeta)
+        self._salas = {}
+        self.cubierto = self._leer_estado()
+
+    # ------------------ CONSULTA ------------------
+
+    def sala(self, sala):
+        """Devuelve el estado de la sala, cargándolo del disco si hace falta."""
+        indexada = self._salas.get(sala)
+        if indexada is None:
+            ruta = self._ruta_sala(sala)
+            if os.path.exists(ruta):
+                with open(ruta, "rb") as f:
+                    cabecera = f.read(self.ENTRADA.size)
+                    primer_seq = self.ENTRADA.unpack(cabecera)[0]
+                    en_disco = (os.fstat(f.fileno()).st_size - self.ENTRADA.size) // self.ENTRADA.size
+                indexada = _SalaIndexada(primer_seq, en_disco)
+            else:
+                indexada = _SalaIndexada(1, 0)
+            self._salas[sala] = indexada
+        return indexada
+
+    def rango(self, sala, ultimos=None, despues_de=None, antes_de=None):
+        """
+        Calcula los desplazamientos de una ventana de mensajes de la sala.
+
+        Args:
+            sala (str): Nombre de la sala.
+            ultimos (int, opcional): Quedarse solo con los K mensajes más recientes.
+            despues_de (int, opcional): Solo secuencias mayores que este valor.
+            antes_de (int, opcional): Solo secuencias menores que este valor.
+
+        Returns:
+            tuple: (primer_seq, desplazamientos) de la ventana solicitada.
+        """
+        indexada = self.sala(sala)
+        inicio = indexada.primer_seq
+        fin = indexada.siguiente_seq
+        if despues_de is not None:
+            inicio = max(inicio, despues_de + 1)
+        if antes_de is not None:
+            fin = min(fin, antes_de)
+        if ultimos is not None:
+            inicio = max(inicio, fin - ultimos)
+        if inicio >= fin:
+            return inicio, []
+
+        desde = inicio - indexada.primer_seq
+        hasta = fin - indexada.primer_seq
+        desplazamientos = []
+        if desde < indexada.en_disco:
+            leer_hasta = min(hasta, indexada.en_disco)
+            with open(self._ruta_sala(sala), "rb") as f:
+                f.seek(self.ENTRADA.size * (1 + desde))
+                datos = f.read(self.ENTRADA.size * (leer_hasta - desde))
+            desplazamientos.extend(d for (d,) in self.ENTRADA.iter_unpack(datos))
+        if hasta > indexada.en_disco:
+            desplazamientos.extend(
+                indexada.pendientes[max(0, desde - indexada.en_disco):hasta - indexada.en_disco]
+            )
+        return inicio, desplazamientos
+
+    def conteos(self):
+        """Devuelve el número de mensajes indexados de cada sala (sin leer entradas)."""
+        cargadas = {
+            os.path.basename(self._ruta_sala(sala)): indexada.total
+            for sala, indexada in self._salas.items()
+        }
+        totales = list(cargadas.values())
+        for nombre in os.listdir(self.carpeta):
+            if nombre.endswith(".idx") and nombre not in cargadas:
+                tamaño = os.path.getsize(os.path.join(self.carpeta, nombre))
+                totales.append(max(0, tamaño - self.ENTRADA.size) // self.ENTRADA.size)
+        return totales
+
+    # ------------------ ACTUALIZACIÓN ------------------
+
+    def registrar(self, sala, desplazamiento, seq=None):
+        """
+        Añade al índice el siguiente mensaje de la sala.
+
+        Con `seq` mayor que la siguiente secuencia, el mensaje se indexa con
+        esa secuencia y las intermedias quedan vacías (como en `reconstruir`).
+
+        Returns:
+            int: Secuencia asignada al mensaje.
+        """
+        indexada = self.sala(sala)
+        if seq is not None and indexada.total == 0:
+            indexada.primer_seq = seq
+        siguiente = indexada.siguiente_seq
+        if seq is None or seq < siguiente:
+            seq = siguiente
+        indexada.pendientes.extend([VACIO] * (seq - siguiente))
+        indexada.pendientes.append(desplazamiento)
+        return seq
+
+    def persistir(self, cubierto):
+        """
+        Escribe en disco las entradas pendientes y marca el registro como
+        indexado hasta el byte `cubierto`.
+        """
+        for sala, indexada in self._salas.items():
+            if not indexada.pendientes:
+                continue
+            with open(self._ruta_sala(sala), "ab") as f:
+                if f.tell() == 0:
+                    f.write(self.ENTRADA.pack(indexada.primer_seq))
+                f.write(b"".join(self.ENTRADA.pack(d) for d in indexada.pendientes))
+            indexada.en_disco += len(indexada.pendientes)
+            indexada.pendientes = []
+        self._escribir_estado(cubierto)
+
+    def reconstruir(self, ruta_registro, desde=0):
+        """
+        Indexa el registro a partir del byte `desde`.
+
+        Los mensajes con secuencia ya indexada se ignoran, de modo que es seguro
+        repetir la indexación de un tramo tras un cierre abrupto.
+
+        Returns:
+            int: Número de líneas corruptas encontradas.
+        """
+        corruptas = 0
+        fin = desde
+        with open(ruta_registro, "rb") as f:
+            f.seek(desde)
+            for linea in f:
+                desplazamiento = fin
+                fin += len(linea)
+                try:
+                    msg = json.loads(linea)
+                    sala = msg["sala"]
+                except (ValueError, KeyError, TypeError):
+                    sala = None
+                if not isinstance(sala, str):
+                    corruptas += 1
+                    continue
+                indexada = self.sala(sala)
+                seq = msg.get("seq") or indexada.siguiente_seq
+                if indexada.total == 0:
+                    indexada.primer_seq = seq
+                if seq < indexada.siguiente_seq:
+                    continue
+                # Huecos de secuencia (mensajes perdidos) se marcan como vacíos
+                indexada.pendientes.extend([VACIO] * (seq - indexada.siguiente_seq))
+                indexada.pendientes.append(desplazamiento)
+        self.persistir(fin)
+        return corruptas
+
+    def reemplazar(self, salas, cubierto):
+        """
+        Sustituye el índice completo (tras compactar el registro).
+
+        Args:
+            salas (dict): {nombre_sala: (primer_seq, lista_de_desplazamientos)}
+            cubierto (int): Bytes del nuevo registro cubiertos por el índice.
+        """
+        nuevos = set()
+        for sala, (primer_seq, desplazamientos) in salas.items():
+            ruta = self._ruta_sala(sala)
+            nuevos.add(os.path.basename(ruta))
+            with open(ruta + ".tmp", "wb") as f:
+                f.write(self.ENTRADA.pack(primer_seq))
+                f.write(b"".join(self.ENTRADA.pack(d) for d in desplazamientos))
+            os.replace(ruta + ".tmp", ruta)
+        for nombre in os.listdir(self.carpeta):
+            if nombre.endswith(".idx") and nombre not in nuevos:
+                os.remove(os.path.join(self.carpeta, nombre))
+        self._salas = {}
+        self._escribir_estado(cubierto)
+
+    def reiniciar(self):
+        """Borra todo el índice para reconstruirlo desde cero."""
+        for nombre in os.listdir(self.carpeta):
+            if nombre.endswith(".idx") or nombre == "estado.json":
+                os.remove(os.path.join(self.carpeta, nombre))
+        self._salas = {}
+        self.cubierto = None
+
+    # ------------------ AUXILIARES ------------------
+
+    def _ruta_sala(self, sala):
+        """Ruta del archivo de índice de una sala (nombre derivado con SHA-1)."""
+        nombre = hashlib.sha1(sala.encode("utf-8")).hexdigest()
+        return os.path.join(self.carpeta, nombre + ".idx")
+
+    def _leer_estado(self):
+        """Lee hasta qué byte del registro está indexado, o None si no se sabe."""
+        try:
+            with open(os.path.join(self.carpeta, "estado.json"), "r", encoding="utf-8") as f:
+                return int(json.load(f)["cubierto"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _escribir_estado(self, cubierto):
+        """Guarda de forma atómica el byte del registro cubierto por el índice."""
+        ruta = os.path.join(self.carpeta, "estado.json")
+        with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"cubierto": cubierto}, f)
+        os.replace(ruta + ".tmp", ruta)
+        self.cubierto = cubierto
@@ -0,0 +1,57 @@
+"""
+mensaje.py — Registro compacto de un mensaje del historial en memoria
+
+Los backends devuelven cada mensaje como un diccionario con sus propias
+copias de "sala" y "usuario". La caché de historial los guarda, en cambio,
+como `Mensaje`: un objeto con __slots__ (sin diccionario por instancia), sin
+la sala (la conoce el buffer de la sala) y con el usuario como id del
+registro USUARIOS. Es lo que devuelve `CacheHistorial.obtener_historial_sala`
+y lo que reciben `construir_historial` y `trama_historial`.
+"""
+
+from identificadores import USUARIOS
+
+_NOMBRES_USUARIOS = USUARIOS.nombres
+
+
+class Mensaje:
+    """
+    Mensaje del historial.
+
+    Atributos:
+        seq (int): Secuencia del mensaje en su sala.
+        ts (int): Marca de tiempo del servidor en milisegundos (0 si no se conoce).
+        usuario_id (int | str): Id del remitente en USUARIOS, o su nombre si
+            el registro está lleno.
+        texto (str): Texto del mensaje.
+    """
+
+    __slots__ = ("seq", "ts", "usuario_id", "texto")
+
+    def __init__(self, seq, ts, usuario, texto):
+        self.seq = seq
+        self.ts = ts or 0
+        usuario = usuario or ""
+        self.usuario_id = USUARIOS.id(usuario) or usuario
+        self.texto = texto or ""
+
+    @property
+    def usuario(self):
+        """Nombre del remitente."""
+        usuario_id = self.usuario_id
+        if isinstance(usuario_id, str):
+            return usuario_id
+        return _NOMBRES_USUARIOS[usuario_id]
+
+    @classmethod
+    def desde_dict(cls, msg):
+        """Crea el registro de un mensaje tal como lo devuelve un backend."""
+        return cls(msg["seq"], msg.get("ts"), msg["usuario"], msg["texto"])
+
+    def __reduce__(self):
+        # Entre procesos (bus del modo multiproceso) viaja el nombre: los ids
+        # son propios de cada proceso
+        return Mensaje, (self.seq, self.ts, self.usuario, self.texto)
+
+    def __repr__(self):
+        return f"Mensaje({self.seq}, {self.ts}, {self.usuario!r}, {self.texto!r})"
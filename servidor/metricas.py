@@ -0,0 +1,608 @@
+"""
+metricas.py — Métricas del servidor en formato de texto de Prometheus
+
+Tipos de métrica:
+- `Contador`: valor que solo crece (conexiones, mensajes por sala). La tasa
+  por segundo se obtiene en Prometheus con rate().
+- `Histograma`: distribución de duraciones en cubetas fijas (latencia de
+  difusión, de `guardar`).
+- `EsperasLocks`: histograma de la espera de los locks del servidor.
+- Indicadores: funciones que se evalúan al consultar las métricas (conexiones
+  abiertas, profundidad de las colas), sin costo en el camino caliente.
+
+Contadores e histogramas reparten sus series en franjas por hilo, así que
+registrar un mensaje no serializa a los hilos de salas distintas en un lock
+de la métrica (`ContadoresRepartidos` hace lo mismo para los contadores de
+difusión y compresión). `LockMedido` envuelve un lock y registra cuánto esperó cada
+adquisición en una serie propia.
+`MetricasServidor` reúne las métricas que comparten ServidorChat y
+ServidorChatAsync, y `ServidorMetricas` las publica en un puerto HTTP local
+(GET /metrics), en un hilo aparte.
+"""
+
+import itertools
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import config
+import registro
+from registro import log
+
+# Límites superiores (segundos) de las cubetas de los histogramas de latencia
+CUBETAS_SEGUNDOS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+TIPO_CONTENIDO = "text/plain; version=0.0.4; charset=utf-8"
+
+# Franjas en que se reparten las series de contadores e histogramas
+FRANJAS = 16
+
+# Valor de etiqueta de las series que no caben en `max_series`
+SERIE_OTRAS = "_otras"
+
+_hilo = threading.local()
+_siguiente_franja = itertools.count()
+
+
+def franja():
+    """Franja del hilo actual; se asignan en turno rotativo la primera vez."""
+    try:
+        return _hilo.franja
+    except AttributeError:
+        _hilo.franja = next(_siguiente_franja) % FRANJAS
+        return _hilo.franja
+
+
+def _escapar(valor):
+    """Escapa el valor de una etiqueta según el formato de texto de Prometheus."""
+    return str(valor).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _etiquetas(nombres, valores, extra=""):
+    """Devuelve '{a="x",b="y"}' (o '' si no hay etiquetas)."""
+    partes = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _numero(valor):
+    """Formatea un número para la salida de texto."""
+    if isinstance(valor, float):
+        if valor == float("inf"):
+            return "+Inf"
+        return repr(valor)
+    return str(valor)
+
+
+class ContadoresRepartidos:
+    """
+    Contadores sumados en cada mensaje, repartidos en FRANJAS con su lock.
+
+    Cada hilo suma en su franja (ver `franja`) y `totales` suma todas, para
+    que los hilos de salas distintas no compartan un lock por mensaje.
+
+    Atributos:
+        nombres (tuple): Nombre de cada contador, en el orden de `sumar`.
+    """
+
+    def __init__(self, *nombres):
+        self.nombres = nombres
+        self._franjas = [(threading.Lock(), [0] * len(nombres)) for _ in range(FRANJAS)]
+
+    def sumar(self, *cantidades):
+        """Suma una cantidad a cada contador (en el orden de `nombres`)."""
+        lock, valores = self._franjas[franja()]
+        with lock:
+            for i, cantidad in enumerate(cantidades):
+                valores[i] += cantidad
+
+    def totales(self):
+        """
+        Returns:
+            dict: {nombre: total de todas las franjas}.
+        """
+        totales = [0] * len(self.nombres)
+        for lock, valores in self._franjas:
+            with lock:
+                for i, valor in enumerate(valores):
+                    totales[i] += valor
+        return dict(zip(self.nombres, totales))
+
+
+class _MetricaEtiquetada:
+    """
+    Base de `Contador` e `Histograma`: series por valores de etiqueta
+    repartidas en FRANJAS, cada una con su lock.
+
+    Cada hilo escribe siempre en la misma franja (ver `franja`), así que los
+    hilos de salas distintas casi nunca comparten lock; al consultar se suman
+    todas. Con `max_series`, las combinaciones de etiquetas nuevas que pasen
+    del límite se cuentan juntas en SERIE_OTRAS (por ejemplo, una serie por
+    sala no crece sin límite aunque los clientes creen salas sin parar).
+    """
+
+    def __init__(self, nombre, ayuda, etiquetas=(), max_series=None):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.max_series = max_series
+        self._franjas = [(threading.Lock(), {}) for _ in range(FRANJAS)]
+        self._conocidas = set()
+        self._lock = threading.Lock()
+
+    def _serie(self, valores):
+        """Devuelve los valores de etiqueta con que se registra (SERIE_OTRAS si no caben)."""
+        if self.max_series is None or valores in self._conocidas:
+            return valores
+        with self._lock:
+            if valores not in self._conocidas:
+                if len(self._conocidas) >= self.max_series:
+                    return (SERIE_OTRAS,) * len(valores)
+                self._conocidas.add(valores)
+        return valores
+
+    def _copias(self):
+        """Series de cada franja, copiadas bajo su lock."""
+        copias = []
+        for lock, series in self._franjas:
+            with lock:
+                copias.append([(v, self._copiar(s)) for v, s in series.items()])
+        return copias
+
+    @staticmethod
+    def _copiar(serie):
+        return serie
+
+
+class Contador(_MetricaEtiquetada):
+    """
+    Contador monótono, opcionalmente con etiquetas.
+
+    Atributos:
+        nombre (str): Nombre de la métrica.
+        ayuda (str): Descripción (línea HELP).
+        etiquetas (tuple): Nombres de las etiquetas.
+        max_series (int | None): Máximo de series distintas (None = sin límite).
+    """
+
+    tipo = "counter"
+
+    def inc(self, *valores, cantidad=1):
+        """
+        Suma `cantidad` a la serie con esos valores de etiqueta.
+
+        Args:
+            *valores: Un valor por cada nombre de `etiquetas`.
+            cantidad (int | float): Incremento (por defecto 1).
+        """
+        valores = self._serie(valores)
+        lock, series = self._franjas[franja()]
+        with lock:
+            series[valores] = series.get(valores, 0) + cantidad
+
+    def _sumar(self):
+        """{valores: total} sumando todas las franjas."""
+        totales = {}
+        for copia in self._copias():
+            for valores, n in copia:
+                totales[valores] = totales.get(valores, 0) + n
+        return totales
+
+    def valor(self, *valores):
+        """Devuelve el valor actual de una serie (0 si no existe)."""
+        return self._sumar().get(valores, 0)
+
+    def lineas(self):
+        """Líneas de muestra en formato de texto."""
+        series = sorted(self._sumar().items())
+        if not series and not self.etiquetas:
+            series = [((), 0)]
+        return [f"{self.nombre}{_etiquetas(self.etiquetas, v)} {_numero(n)}" for v, n in series]
+
+
+class Histograma(_MetricaEtiquetada):
+    """
+    Histograma de cubetas fijas, opcionalmente con etiquetas.
+
+    Atributos:
+        nombre (str): Nombre de la métrica.
+        ayuda (str): Descripción (línea HELP).
+        cubetas (tuple): Límites superiores, en orden creciente.
+        etiquetas (tuple): Nombres de las etiquetas.
+        max_series (int | None): Máximo de series distintas (None = sin límite).
+    """
+
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, cubetas=CUBETAS_SEGUNDOS, etiquetas=(), max_series=None):
+        super().__init__(nombre, ayuda, etiquetas, max_series)
+        self.cubetas = tuple(cubetas)
+
+    def serie_vacia(self):
+        """Serie sin observaciones: [conteos por cubeta (+Inf al final), suma]."""
+        return [[0] * (len(self.cubetas) + 1), 0.0]
+
+    def observar(self, valor, *valores):
+        """
+        Registra una observación.
+
+        Args:
+            valor (float): Valor observado (por ejemplo, segundos).
+            *valores: Un valor por cada nombre de `etiquetas`.
+        """
+        indice = bisect_left(self.cubetas, valor)
+        valores = self._serie(valores)
+        lock, series = self._franjas[franja()]
+        with lock:
+            serie = series.get(valores)
+            if serie is None:
+                serie = series[valores] = self.serie_vacia()
+            serie[0][indice] += 1
+            serie[1] += valor
+
+    @staticmethod
+    def _copiar(serie):
+        return (list(serie[0]), serie[1])
+
+    def _sumar(self):
+        """{valores: (conteos, suma)} sumando todas las franjas."""
+        return _sumar_series(copia for franja in self._copias() for copia in franja)
+
+    def conteo(self, *valores):
+        """Devuelve cuántas observaciones tiene una serie."""
+        serie = self._sumar().get(valores)
+        return sum(serie[0]) if serie else 0
+
+    def lineas(self):
+        """Líneas de muestra en formato de texto (cubetas acumuladas, _sum y _count)."""
+        series = sorted(self._sumar().items())
+        if not series and not self.etiquetas:
+            series = [((), self.serie_vacia())]
+        lineas = []
+        for valores, (conteos, suma) in series:
+            acumulado = 0
+            for limite, conteo in zip(self.cubetas + (float("inf"),), conteos):
+                acumulado += conteo
+                le = _etiquetas(self.etiquetas, valores, f'le="{_numero(float(limite))}"')
+                lineas.append(f"{self.nombre}_bucket{le} {acumulado}")
+            base = _etiquetas(self.etiquetas, valores)
+            lineas.append(f"{self.nombre}_sum{base} {_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{base} {acumulado}")
+        return lineas
+
+
+def _sumar_series(series):
+    """Suma pares (valores, (conteos, suma)) de histograma por valores de etiqueta."""
+    totales = {}
+    for valores, (conteos, suma) in series:
+        total = totales.get(valores)
+        if total is None:
+            totales[valores] = (list(conteos), suma)
+        else:
+            totales[valores] = ([a + b for a, b in zip(total[0], conteos)], total[1] + suma)
+    return totales
+
+
+class EsperasLocks(Histograma):
+    """
+    Histograma de la espera de los `LockMedido`, etiquetado por lock.
+
+    Cada lock lleva su propia serie y la actualiza mientras lo tiene tomado,
+    así que medir no agrega ningún lock compartido entre salas; al consultar
+    se suman las series de los locks con la misma etiqueta. Las series se
+    conservan mientras viva el servidor (las salas no se eliminan).
+    """
+
+    def __init__(self, nombre, ayuda, cubetas=CUBETAS_SEGUNDOS):
+        super().__init__(nombre, ayuda, cubetas, etiquetas=("lock",))
+        self._por_lock = []  # [(valores, serie)] de cada LockMedido
+
+    def lock(self, etiqueta, lock=None):
+        """Crea un `LockMedido` que registra su espera con lock=`etiqueta`."""
+        medido = LockMedido(self, etiqueta, lock)
+        with self._lock:
+            self._por_lock.append(((etiqueta,), medido.serie))
+        return medido
+
+    def observar(self, valor, *valores):
+        raise TypeError("Las esperas las registra cada LockMedido")
+
+    def _sumar(self):
+        with self._lock:
+            por_lock = list(self._por_lock)
+        # Las series se leen sin el lock al que pertenecen: a lo sumo faltan
+        # las adquisiciones en curso
+        return _sumar_series((v, (list(s[0]), s[1])) for v, s in por_lock)
+
+
+class Indicador:
+    """
+    Valor calculado por una función al consultar las métricas.
+
+    Atributos:
+        nombre (str): Nombre de la métrica.
+        ayuda (str): Descripción (línea HELP).
+        funcion (callable): Devuelve el valor actual (int o float).
+        tipo (str): "gauge", o "counter" si la función lee un contador ya
+            existente (por ejemplo, de `estadisticas()`).
+    """
+
+    def __init__(self, nombre, ayuda, funcion, tipo="gauge"):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.funcion = funcion
+        self.tipo = tipo
+
+    def lineas(self):
+        """Línea de muestra con el valor actual (ninguna si la función falla)."""
+        try:
+            return [f"{self.nombre} {_numero(self.funcion())}"]
+        except Exception:
+            return []
+
+
+class LockMedido:
+    """
+    Lock que registra en su serie de `EsperasLocks` el tiempo de espera de
+    cada adquisición.
+
+    Si el lock está libre se toma sin medir: solo se suma 1 a la cubeta de
+    espera 0. Las adquisiciones con contención llaman dos veces al reloj. La
+    serie se actualiza con el propio lock tomado, sin ningún otro lock.
+
+    Atributos:
+        etiqueta (str): Valor de la etiqueta con que se registra.
+        serie (list): [conteos por cubeta (+Inf al final), suma de esperas].
+    """
+
+    __slots__ = ("etiqueta", "serie", "_cubetas", "_lock")
+
+    def __init__(self, esperas, etiqueta, lock=None):
+        self.etiqueta = etiqueta
+        self.serie = esperas.serie_vacia()
+        self._cubetas = esperas.cubetas
+        self._lock = lock or threading.Lock()
+
+    def acquire(self, blocking=True, timeout=-1):
+        """Igual que `threading.Lock.acquire`, registrando la espera."""
+        if self._lock.acquire(False):
+            self.serie[0][0] += 1
+            return True
+        if not blocking:
+            return False
+        inicio = time.perf_counter()
+        tomado = self._lock.acquire(True, timeout)
+        if tomado:
+            espera = time.perf_counter() - inicio
+            serie = self.serie
+            serie[0][bisect_left(self._cubetas, espera)] += 1
+            serie[1] += espera
+        return tomado
+
+    def release(self):
+        """Libera el lock."""
+        self._lock.release()
+
+    def locked(self):
+        """Indica si el lock está tomado."""
+        return self._lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+
+class Metricas:
+    """
+    Registro de métricas del servidor.
+
+    Las métricas se crean una vez (al construir el servidor) y se guardan como
+    atributos de quien las usa; `texto()` recorre todas para la exposición.
+    """
+
+    def __init__(self):
+        self._metricas = []
+        self._lock = threading.Lock()
+
+    def _agregar(self, metrica):
+        with self._lock:
+            self._metricas.append(metrica)
+        return metrica
+
+    def contador(self, nombre, ayuda, etiquetas=(), max_series=None):
+        """Crea y registra un `Contador`."""
+        return self._agregar(Contador(nombre, ayuda, etiquetas, max_series))
+
+    def histograma(self, nombre, ayuda, cubetas=CUBETAS_SEGUNDOS, etiquetas=(), max_series=None):
+        """Crea y registra un `Histograma`."""
+        return self._agregar(Histograma(nombre, ayuda, cubetas, etiquetas, max_series))
+
+    def esperas_locks(self, nombre, ayuda, cubetas=CUBETAS_SEGUNDOS):
+        """Crea y registra un `EsperasLocks`."""
+        return self._agregar(EsperasLocks(nombre, ayuda, cubetas))
+
+    def indicador(self, nombre, ayuda, funcion, tipo="gauge"):
+        """Crea y registra un `Indicador` calculado por `funcion`."""
+        return self._agregar(Indicador(nombre, ayuda, funcion, tipo))
+
+    def texto(self):
+        """
+        Devuelve todas las métricas en formato de texto de Prometheus.
+
+        Returns:
+            str: Bloques HELP / TYPE / muestras, terminados en salto de línea.
+        """
+        with self._lock:
+            metricas = list(self._metricas)
+        lineas = []
+        for metrica in metricas:
+            muestras = metrica.lineas()
+            if not muestras:
+                continue
+            lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+            lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+            lineas.extend(muestras)
+        return "\n".join(lineas) + "\n"
+
+
+class MetricasServidor(Metricas):
+    """
+    Métricas del servidor de chat.
+
+    Atributos:
+        conexiones (Contador): Conexiones aceptadas.
+        mensajes (Contador): Mensajes de chat recibidos, por sala (a lo sumo
+            METRICAS_MAX_SALAS series; el resto se cuenta en sala="_otras").
+        difusion (Histograma): Segundos en encolar un mensaje a toda la sala.
+        guardar (Histograma): Segundos de `historial.guardar`.
+        espera_lock (EsperasLocks): Segundos de espera por lock ("global" o "sala").
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.conexiones = self.contador(
+            "chat_conexiones_total", "Conexiones de clientes aceptadas.")
+        self.mensajes = self.contador(
+            "chat_mensajes_total", "Mensajes de chat recibidos, por sala.", ("sala",),
+            max_series=config.METRICAS_MAX_SALAS)
+        self.difusion = self.histograma(
+            "chat_difusion_segundos", "Tiempo en encolar un mensaje para todos los miembros de la sala.")
+        self.guardar = self.histograma(
+            "chat_guardar_segundos", "Latencia de historial.guardar (asignar secuencia y encolar o escribir).")
+        self.espera_lock = self.esperas_locks(
+            "chat_lock_espera_segundos", "Espera para adquirir los locks del servidor.")
+
+    def lock(self, nombre):
+        """Crea un lock cuya espera se registra con la etiqueta lock=`nombre`."""
+        return self.espera_lock.lock(nombre)
+
+    def observar_servidor(self, servidor):
+        """
+        Registra los indicadores que se leen del servidor al consultar:
+        conexiones abiertas, colas de salida, difusión, compresión, caché y
+        persistencia.
+
+        Args:
+            servidor: ServidorChat o ServidorChatAsync (estadisticas_colas,
+                estadisticas_persistencia, difusion, compresion, historial).
+        """
+        def de(funcion, clave):
+            return lambda: funcion()[clave]
+
+        colas = servidor.estadisticas_colas
+        compresion = servidor.compresion.estadisticas
+        persistencia = servidor.estadisticas_persistencia
+        difusion = servidor.difusion.estadisticas
+        cache = servidor.historial.estadisticas
+        for nombre, ayuda, funcion, tipo in (
+            ("chat_conexiones_abiertas", "Conexiones abiertas.", de(colas, "conexiones"), "gauge"),
+            ("chat_cola_salida_bytes", "Bytes pendientes de envío en todas las colas de salida.",
+             de(colas, "pendientes_total"), "gauge"),
+            ("chat_cola_salida_max_bytes", "Bytes pendientes en la cola de salida más llena.",
+             de(colas, "pendientes_max"), "gauge"),
+            ("chat_cola_salida_descartadas_total", "Tramas descartadas por cola de salida llena.",
+             de(colas, "descartadas"), "counter"),
+            ("chat_clientes_lentos_total", "Clientes desconectados por cola de salida llena.",
+             de(colas, "desconexiones_lentos"), "counter"),
+            ("chat_difusiones_total", "Tramas de difusión codificadas.", de(difusion, "difusiones"), "counter"),
+            ("chat_entregas_total", "Tramas de difusión encoladas a destinatarios.",
+             de(difusion, "entregas"), "counter"),
+            ("chat_compresion_tramas_total", "Tramas enviadas comprimidas (zlib por conexión).",
+             de(compresion, "tramas"), "counter"),
+            ("chat_compresion_bytes_originales_total", "Bytes de las tramas comprimidas antes de comprimir.",
+             de(compresion, "bytes_originales"), "counter"),
+            ("chat_compresion_bytes_total", "Bytes enviados en lugar de las tramas comprimidas.",
+             de(compresion, "bytes_comprimidos"), "counter"),
+            ("chat_compresion_cpu_segundos_total", "Tiempo de CPU dedicado a comprimir tramas.",
+             de(compresion, "segundos_cpu"), "counter"),
+            ("chat_cache_aciertos_total", "Lecturas de historial servidas desde la caché.",
+             de(cache, "aciertos"), "counter"),
+            ("chat_cache_fallos_total", "Lecturas de historial que fueron al backend.",
+             de(cache, "fallos"), "counter"),
+            ("chat_cache_bytes", "Bytes aproximados de la caché de historial.", de(cache, "bytes"), "gauge"),
+            ("chat_persistencia_en_cola", "Mensajes en la cola de escritura diferida.",
+             de(persistencia, "en_cola"), "gauge"),
+            ("chat_persistencia_escritos_total", "Mensajes escritos por la escritura diferida.",
+             de(persistencia, "escritos"), "counter"),
+            ("chat_persistencia_lotes_total", "Grupos escritos por la escritura diferida.",
+             de(persistencia, "lotes"), "counter"),
+            ("chat_persistencia_sincronizaciones_total", "Sincronizaciones (fsync/commit) del historial.",
+             de(persistencia, "sincronizaciones"), "counter"),
+            ("chat_persistencia_esperas_total", "Guardados que esperaron por la cola de persistencia llena.",
+             de(persistencia, "esperas_cola_llena"), "counter"),
+            ("chat_registro_descartados_total", "Mensajes de registro descartados por cola llena.",
+             registro.descartados, "counter"),
+        ):
+            self.indicador(nombre, ayuda, funcion, tipo)
+
+
+def iniciar_servidor_metricas(metricas, host, puerto):
+    """
+    Abre el puerto de métricas si `puerto` no es 0. Un error al abrirlo se
+    registra y no impide que el servidor de chat arranque.
+
+    Returns:
+        ServidorMetricas | None: Servidor iniciado, o None.
+    """
+    if not puerto:
+        return None
+    servidor = ServidorMetricas(metricas, host, puerto)
+    try:
+        servidor.iniciar()
+    except OSError as e:
+        log.error("[MÉTRICAS] No se pudo abrir %s:%s: %s", host, puerto, e)
+        return None
+    log.info("[MÉTRICAS] Disponibles en http://%s:%s/metrics", host, servidor.puerto)
+    return servidor
+
+
+class ServidorMetricas:
+    """
+    Puerto de administración HTTP que responde GET /metrics con `Metricas.texto()`.
+
+    Atributos:
+        metricas (Metricas): Registro a publicar.
+        host, puerto: Dirección de escucha (conviene una dirección local).
+    """
+
+    def __init__(self, metricas, host, puerto):
+        self.metricas = metricas
+        self.host = host
+        self.puerto = puerto
+        self._http = None
+
+    def iniciar(self):
+        """Abre el puerto y atiende consultas en un hilo de fondo."""
+        metricas = self.metricas
+
+        class Manejador(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                cuerpo = metricas.texto().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", TIPO_CONTENIDO)
+                self.send_header("Content-Length", str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def log_message(self, formato, *args):
+                pass  # Sin una línea de registro por consulta
+
+        self._http = ThreadingHTTPServer((self.host, self.puerto), Manejador)
+        self._http.daemon_threads = True
+        self.puerto = self._http.server_address[1]
+        threading.Thread(target=self._http.serve_forever, daemon=True).start()
+
+    def cerrar(self):
+        """Deja de atender consultas y cierra el puerto."""
+        if self._http is not None:
+            self._http.shutdown()
+            self._http.server_close()
+            self._http = None
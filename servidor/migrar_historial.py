@@ -0,0 +1,97 @@
+"""
+migrar_historial.py — Migra el historial JSON (o JSON Lines) a SQLite
+
+Copia todos los mensajes del historial existente a la base SQLite usada por
+el backend "sqlite", conservando el orden y asignando secuencias por sala.
+El archivo de origen no se modifica. Si la base de destino ya tiene mensajes
+(p. ej. una migración anterior) no se importa nada, salvo con --forzar, que
+añade los mensajes a continuación de los existentes.
+
+Uso (desde la carpeta servidor/):
+    python migrar_historial.py
+    python migrar_historial.py ../datos/historial.json ../datos/historial.db
+    python migrar_historial.py ../datos/historial.jsonl ../datos/historial.db
+    python migrar_historial.py ../datos/historial.json ../datos/historial.db --forzar
+"""
+
+import json
+import os
+import sys
+from almacenamiento_sqlite import AlmacenamientoSQLite
+import config
+
+# Mensajes insertados por transacción durante la migración
+LOTE_MIGRACION = 10000
+
+
+def leer_historial(ruta):
+    """
+    Genera los mensajes de un historial JSON (arreglo) o JSON Lines.
+
+    Args:
+        ruta (str): Archivo de origen.
+
+    Returns:
+        iterable: Diccionarios de mensaje en orden. Las líneas corruptas de un
+        archivo JSON Lines se omiten.
+    """
+    if ruta.endswith(".jsonl"):
+        with open(ruta, "r", encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    yield json.loads(linea)
+                except ValueError:
+                    continue
+    else:
+        with open(ruta, "r", encoding="utf-8") as f:
+            yield from json.load(f)
+
+
+def migrar(origen, destino, forzar=False):
+    """
+    Importa todos los mensajes de `origen` en la base SQLite `destino`.
+
+    Args:
+        origen (str): Historial JSON o JSON Lines.
+        destino (str): Base SQLite.
+        forzar (bool): Importar aunque la base ya tenga mensajes (se
+            duplican los que ya se hubieran migrado).
+
+    Returns:
+        int: Cantidad de mensajes migrados.
+
+    Raises:
+        ValueError: Si la base de destino ya tiene mensajes y no se pide forzar.
+    """
+    almacenamiento = AlmacenamientoSQLite(destino)
+    total = 0
+    lote = []
+    try:
+        if not forzar and not almacenamiento.vacia():
+            raise ValueError(f"La base {destino} ya tiene mensajes (use --forzar para añadirlos igualmente)")
+        for msg in leer_historial(origen):
+            lote.append(msg)
+            if len(lote) >= LOTE_MIGRACION:
+                total += almacenamiento.importar(lote)
+                lote = []
+                print(f"[MIGRACIÓN] {total} mensajes...")
+        total += almacenamiento.importar(lote)
+    finally:
+        almacenamiento.cerrar()
+    return total
+
+
+if __name__ == "__main__":
+    forzar = "--forzar" in sys.argv[1:]
+    argumentos = [a for a in sys.argv[1:] if a != "--forzar"]
+    origen = argumentos[0] if len(argumentos) > 0 else config.ARCHIVO_HISTORIAL
+    destino = argumentos[1] if len(argumentos) > 1 else config.ARCHIVO_HISTORIAL_SQLITE
+    if not os.path.exists(origen):
+        print(f"[MIGRACIÓN] No existe el archivo de origen: {origen}")
+        sys.exit(1)
+    try:
+        total = migrar(origen, destino, forzar)
+    except ValueError as e:
+        print(f"[MIGRACIÓN] {e}")
+        sys.exit(1)
+    print(f"[MIGRACIÓN] {total} mensajes copiados de {origen} a {destino}")
@@ -0,0 +1,638 @@
+"""
+multiproceso.py — Servidor con varios procesos trabajadores y un bus de salas
+
+Con `config.PROCESOS_SERVIDOR > 1` el servidor usa varios núcleos:
+
+- Cada trabajador es un proceso con un `ServidorChat` (un hilo por cliente)
+  que abre su propio socket de escucha con SO_REUSEPORT en el mismo puerto;
+  el sistema operativo reparte las conexiones nuevas entre ellos.
+- El coordinador (proceso principal) es el único dueño del historial y de la
+  presencia: nombres registrados, sala de cada sesión y cuántos miembros
+  tiene cada sala en cada trabajador.
+- Cada trabajador se comunica con el coordinador por un Pipe (socket Unix)
+  que hace de bus de salas. El coordinador atiende los buses en un solo
+  hilo que solo actualiza la presencia y reparte el trabajo: guardar
+  mensajes y leer historial se hace en `TareasPorSala`, en orden dentro de
+  cada sala (así las secuencias y las difusiones de una sala salen en
+  orden) y en paralelo entre salas. Cada difusión se envía solo a los
+  trabajadores con miembros en la sala, y cada trabajador la codifica una
+  vez y la reparte a sus clientes.
+
+Un hilo lector por trabajador procesa lo que llega del bus en orden. El alta
+en una sala (JOIN_SALA) la confirma ese hilo al recibir el historial, así
+que ninguna difusión de la sala llega al cliente antes que el historial ni
+se pierde entre la lectura del historial y el alta (ver
+ServidorChat.unirse_sala).
+
+Los trabajadores publican sus métricas en METRICAS_PUERTO + índice; las de
+caché y persistencia las piden al coordinador. Con durabilidad "mensaje"
+cada guardado espera su commit en la cola de su sala; los de salas
+distintas esperan a la vez y comparten commit.
+"""
+
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import socket
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from almacenamiento import crear_almacenamiento, marca_tiempo
+from cache_historial import CacheHistorial
+from nucleo_servidor import ServidorChat
+import registro
+from registro import log
+import config
+
+
+def disponible():
+    """Indica si el sistema permite compartir el puerto con SO_REUSEPORT."""
+    return hasattr(socket, "SO_REUSEPORT")
+
+
+# ------------------ TRABAJADORES ------------------
+
+class BusSalas:
+    """
+    Extremo del bus de salas en un trabajador.
+
+    `enviar` puede llamarse desde cualquier hilo; `pedir` envía una petición
+    numerada y espera a que el hilo lector entregue la respuesta con
+    `responder`.
+
+    Atributos:
+        conexion (Connection): Extremo del Pipe hacia el coordinador.
+        espera (float): Segundos máximos de espera de una respuesta.
+        cerrado (bool): True después de `cerrar`.
+    """
+
+    def __init__(self, conexion, espera=10.0):
+        self.conexion = conexion
+        self.espera = espera
+        self.cerrado = False
+        self._lock = threading.Lock()
+        self._numeros = itertools.count(1)
+        self._pendientes = {}   # {número de petición: [Event, respuesta]}
+
+    def enviar(self, *mensaje):
+        """
+        Envía un mensaje al coordinador.
+
+        Returns:
+            bool: False si el bus ya está cerrado o falló el envío.
+        """
+        with self._lock:
+            if self.cerrado:
+                return False
+            try:
+                self.conexion.send(mensaje)
+                return True
+            except (OSError, ValueError):
+                return False
+
+    def pedir(self, tipo, *args):
+        """
+        Envía una petición y espera su respuesta.
+
+        Raises:
+            ConnectionError: Si el bus está cerrado o el coordinador no responde.
+        """
+        numero = next(self._numeros)
+        espera = [threading.Event(), None]
+        self._pendientes[numero] = espera
+        try:
+            if not self.enviar(tipo, numero, *args) or not espera[0].wait(self.espera) or self.cerrado:
+                raise ConnectionError(f"Sin respuesta del coordinador ({tipo})")
+        finally:
+            self._pendientes.pop(numero, None)
+        return espera[1]
+
+    def responder(self, numero, valor):
+        """Entrega la respuesta de una petición al hilo que la espera."""
+        espera = self._pendientes.get(numero)
+        if espera is not None:
+            espera[1] = valor
+            espera[0].set()
+
+    def recibir(self):
+        """Bloquea hasta el siguiente mensaje del coordinador (EOFError si se cerró)."""
+        return self.conexion.recv()
+
+    def cerrar(self):
+        """Cierra el bus y libera las peticiones en espera."""
+        with self._lock:
+            if self.cerrado:
+                return
+            self.cerrado = True
+            self.conexion.close()
+        for espera in list(self._pendientes.values()):
+            espera[0].set()
+
+
+class HistorialRemoto:
+    """
+    Historial visto desde un trabajador: las lecturas se piden al coordinador,
+    que es el único que abre el almacenamiento. Los mensajes no se guardan
+    desde aquí (ver ServidorTrabajador.publicar_mensaje).
+    """
+
+    def __init__(self, bus):
+        self.bus = bus
+
+    def obtener_historial_sala(self, sala, ultimos=None, despues_de=None, antes_de=None):
+        """Mensajes de la sala, con los mismos filtros que CacheHistorial."""
+        return self.bus.pedir("historial", sala, ultimos, despues_de, antes_de)
+
+    def estadisticas(self):
+        """Métricas de la caché del coordinador."""
+        return self.bus.pedir("estadisticas")["cache"]
+
+    def cerrar(self):
+        """Cierra el bus; el coordinador vacía y cierra el almacenamiento."""
+        self.bus.cerrar()
+
+
+class ServidorTrabajador(ServidorChat):
+    """
+    ServidorChat de un proceso trabajador.
+
+    Atiende a sus clientes igual que ServidorChat, pero el registro de nombres,
+    la presencia, los listados, el historial y las difusiones pasan por el
+    coordinador. Las salas locales solo guardan los miembros conectados a
+    este trabajador.
+
+    Atributos:
+        indice (int): Número de trabajador (desde 0).
+        bus (BusSalas): Conexión con el coordinador.
+    """
+
+    def __init__(self, indice, conexion):
+        self.indice = indice
+        self.bus = BusSalas(conexion)
+        self._ids = itertools.count(1)
+        self._por_id = {}       # {id de sesión: Sesion}
+        super().__init__()
+        threading.Thread(target=self._escuchar_bus, daemon=True).start()
+
+    def abrir_socket(self):
+        """Abre el socket de escucha compartiendo el puerto con los demás trabajadores."""
+        servidor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        servidor.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        servidor.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        servidor.bind((self.host, self.puerto))
+        servidor.listen(config.BACKLOG_CONEXIONES)
+        return servidor
+
+    def crear_historial(self):
+        return HistorialRemoto(self.bus)
+
+    def _id(self, sesion):
+        """Identificador de la sesión en el bus (se asigna la primera vez)."""
+        if sesion.id is None:
+            sesion.id = next(self._ids)
+            self._por_id[sesion.id] = sesion
+        return sesion.id
+
+    # ------------------ COMANDOS ------------------
+
+    def registrar_nombre(self, sesion, nombre):
+        """Reserva el nombre en el coordinador (único entre todos los trabajadores)."""
+        if not self.bus.pedir("hola", self._id(sesion), nombre):
+            return False
+        return super().registrar_nombre(sesion, nombre)
+
+    def unirse_sala(self, sesion, sala, despues_de=None):
+        """
+        Sale de la sala anterior y pide el alta al coordinador; el alta local,
+        la confirmación y el historial los completa el hilo del bus al recibir
+        la respuesta (ver `_unido`). Las notificaciones de entrada y salida
+        las difunde el coordinador.
+        """
+        sala = self.ids_salas.interno(sala)
+        anterior = sesion.sala
+        if anterior is not None and anterior != sala:
+            actual = self.salas[anterior]
+            with actual.lock:
+                actual.miembros.discard(sesion)
+        self.obtener_sala(sala)
+        sesion.sala = sala
+        self.bus.enviar("unirse", self._id(sesion), sesion.nombre_o(), sala, despues_de)
+        log.info("[%s] ➤ %s se ha unido.", sala, sesion.nombre_o())
+
+    def salir_sala(self, sesion, sala):
+        if not super().salir_sala(sesion, sala):
+            return False
+        self.bus.enviar("salir", self._id(sesion), sala)
+        return True
+
+    def publicar_mensaje(self, sesion, texto):
+        """Envía el mensaje al coordinador, que lo guarda y lo difunde a la sala."""
+        self.metricas.mensajes.inc(sesion.sala)
+        self.bus.enviar("mensaje", sesion.sala, sesion.nombre_o(), texto)
+
+    def retransmitir(self, sesion, sala, mensaje, seq=None, ts=None):
+        self.bus.enviar("difundir", sala, None, "CHAT", (seq or 0, ts or 0, sesion.nombre_o(), mensaje))
+
+    def retransmitir_evento(self, sesion, sala, mensaje):
+        self.bus.enviar("difundir", sala, self._id(sesion), "NOTIFY", mensaje)
+
+    def filas_usuarios(self):
+        return self.bus.pedir("usuarios")
+
+    def nombres_salas(self):
+        return self.bus.pedir("salas")
+
+    def estadisticas_persistencia(self):
+        return self.bus.pedir("estadisticas")["persistencia"]
+
+    def desconectar(self, sesion):
+        super().desconectar(sesion)
+        if sesion.id is not None:
+            self._por_id.pop(sesion.id, None)
+            self.bus.enviar("adios", sesion.id)
+
+    # ------------------ BUS ------------------
+
+    def _escuchar_bus(self):
+        """Procesa en orden lo que llega del coordinador; si el bus se corta, detiene el trabajador."""
+        try:
+            while True:
+                tipo, *datos = self.bus.recibir()
+                if tipo == "difusion":
+                    self._entregar(*datos)
+                elif tipo == "respuesta":
+                    self.bus.responder(*datos)
+                elif tipo == "unido":
+                    self._unido(*datos)
+        except (EOFError, OSError):
+            pass
+        except Exception as e:
+            log.error("[ERROR bus trabajador %s] %s", self.indice, e)
+        if not self.bus.cerrado:
+            log.info("[TRABAJADOR %s] El coordinador cerró el bus; terminando.", self.indice)
+            self.bus.cerrar()
+            try:
+                # Despierta accept() en iniciar() para que el proceso termine
+                self.servidor.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _unido(self, id_sesion, sala, mensajes):
+        """Completa un alta: miembro local, confirmación e historial bajo el lock de la sala."""
+        sesion = self._por_id.get(id_sesion)
+        if sesion is None or sesion.sala != sala:
+            return  # Se desconectó o cambió de sala mientras tanto
+        actual = self.obtener_sala(sala)
+        with actual.lock:
+            actual.miembros.add(sesion)
+            self.confirmar_union(sesion, sala)
+            self.escribir_historial(sesion, mensajes, primera_pagina=True)
+
+    def _entregar(self, sala, excluir, comando, datos):
+        """
+        Codifica una vez (por protocolo) una difusión del coordinador y la
+        encola a los miembros locales. Los datos de CHAT son (seq, ts, usuario, texto).
+        """
+        inicio = time.perf_counter()
+        if comando == "CHAT":
+            trama = self.difusion.chat(self.ids_salas.id(sala) or 0, *datos)
+        else:
+            trama = self.difusion.trama(comando, datos)
+        entregas = 0
+        for s in self.miembros(sala):
+            if excluir is None or s.id != excluir:
+                entregas += self.enviar(s, trama.para(s))
+        self.difusion.registrar(trama, entregas)
+        if comando == "CHAT":
+            self.metricas.difusion.observar(time.perf_counter() - inicio)
+
+
+def _trabajador(indice, conexion, heredadas=()):
+    """
+    Punto de entrada de cada proceso trabajador.
+
+    Args:
+        heredadas (list): Extremos del coordinador de los buses ya creados; se
+            cierran para que el trabajador vea el fin de su bus si el
+            coordinador termina.
+    """
+    for otra in heredadas:
+        otra.close()
+    if config.METRICAS_PUERTO:
+        config.METRICAS_PUERTO += indice
+    try:
+        servidor = ServidorTrabajador(indice, conexion)
+    except OSError as e:
+        log.error("[TRABAJADOR %s] No se pudo abrir %s:%s: %s",
+                  indice, config.SERVIDOR_HOST, config.SERVIDOR_PUERTO, e)
+        return
+    try:
+        servidor.iniciar()
+    except OSError:
+        pass  # El coordinador cerró el bus y se despertó accept()
+
+
+# ------------------ COORDINADOR ------------------
+
+class TareasPorSala:
+    """
+    Ejecuta tareas en un grupo de hilos, en orden dentro de cada sala.
+
+    Cada sala con tareas pendientes tiene una cola y a lo sumo un hilo del
+    grupo atendiéndola; las salas distintas avanzan en paralelo. Un hilo
+    atiende como máximo `tanda` tareas seguidas de una sala antes de
+    cederle el turno a las demás.
+
+    Atributos:
+        tanda (int): Tareas de una sala por turno de un hilo.
+        _colas (dict): {sala: deque de (función, argumentos)} de las salas
+            con un hilo asignado.
+    """
+
+    def __init__(self, hilos, tanda=64):
+        self.tanda = tanda
+        self._ejecutor = ThreadPoolExecutor(max_workers=max(1, hilos), thread_name_prefix="coordinador")
+        self._colas = {}
+        self._lock = threading.Lock()
+
+    def encolar(self, sala, funcion, *args):
+        """Agrega una tarea a la cola de la sala; se ejecuta después de las anteriores de esa sala."""
+        with self._lock:
+            cola = self._colas.get(sala)
+            if cola is not None:
+                cola.append((funcion, args))
+                return
+            self._colas[sala] = deque([(funcion, args)])
+        self._ejecutor.submit(self._atender, sala)
+
+    def cerrar(self):
+        """Espera a que terminen todas las tareas encoladas."""
+        self._ejecutor.shutdown(wait=True)
+
+    def _atender(self, sala):
+        """Ejecuta tareas de la sala hasta vaciar su cola o completar una tanda."""
+        for _ in range(self.tanda):
+            with self._lock:
+                cola = self._colas[sala]
+                if not cola:
+                    del self._colas[sala]
+                    return
+                funcion, args = cola.popleft()
+            try:
+                funcion(*args)
+            except Exception as e:
+                log.error("[ERROR tarea coordinador] Sala '%s': %s", sala, e)
+        self._ejecutor.submit(self._atender, sala)
+
+
+class Coordinador:
+    """
+    Proceso principal del modo multiproceso.
+
+    Atributos:
+        procesos (list): Procesos trabajadores.
+        conexiones (dict): {Connection: índice del trabajador} de los buses abiertos.
+        historial: Caché de historial delante del backend (único dueño).
+        nombres: {nombre: clave} de los usuarios registrados.
+        presencia: {clave: [nombre, sala]} de las sesiones conocidas.
+        salas: {nombre_sala: Counter({trabajador: miembros})}.
+        tareas (TareasPorSala): Guardados y lecturas de historial, por sala.
+
+    La clave de una sesión es (índice del trabajador, id de sesión). La
+    presencia la modifica solo el hilo de `iniciar`; los hilos de `tareas`
+    leen `salas` al difundir, así que sus cambios se hacen con `_lock`. Cada
+    bus tiene además su lock de envío, porque escriben en él el hilo de
+    `iniciar` y los de `tareas`.
+    """
+
+    def __init__(self, procesos):
+        # Los trabajadores se crean antes que cualquier hilo de este proceso
+        self.procesos = []
+        self.conexiones = {}
+        self._salidas = []
+        for indice in range(procesos):
+            propia, ajena = multiprocessing.Pipe()
+            proceso = multiprocessing.Process(target=_trabajador, args=(indice, ajena, self._salidas + [propia]),
+                                              name=f"trabajador-{indice}")
+            proceso.start()
+            ajena.close()
+            self.procesos.append(proceso)
+            self.conexiones[propia] = indice
+            self._salidas.append(propia)
+
+        registro.configurar(config.NIVEL_REGISTRO, config.REGISTRO_COLA_MAX)
+        self.historial = CacheHistorial(
+            crear_almacenamiento(),
+            mensajes_por_sala=config.CACHE_MENSAJES_POR_SALA,
+            presupuesto_bytes=config.CACHE_PRESUPUESTO_BYTES,
+        )
+        self.nombres = {}
+        self.presencia = {}
+        self.salas = {s: Counter() for s in ("Juegos", "Series")}  # Salas por defecto
+        self.tareas = TareasPorSala(config.HILOS_COORDINADOR)
+        self._lock = threading.Lock()
+        self._envios = [threading.Lock() for _ in self._salidas]
+        log.info("[SERVIDOR] %s procesos trabajadores en %s:%s",
+                 procesos, config.SERVIDOR_HOST, config.SERVIDOR_PUERTO)
+
+    def iniciar(self):
+        """Atiende los buses de los trabajadores hasta Ctrl+C o hasta que terminen todos."""
+        try:
+            while self.conexiones:
+                for conexion in multiprocessing.connection.wait(list(self.conexiones)):
+                    self._leer(conexion)
+            log.error("[SERVIDOR] Terminaron todos los trabajadores.")
+        except KeyboardInterrupt:
+            log.info("[SERVIDOR] Cerrando servidor...")
+        finally:
+            self.tareas.cerrar()
+            for conexion in self._salidas:
+                conexion.close()
+            for proceso in self.procesos:
+                proceso.join(5)
+                if proceso.is_alive():
+                    proceso.terminate()
+                    proceso.join()
+            self.historial.cerrar()
+            registro.detener()
+
+    def _leer(self, conexion):
+        """Atiende todos los mensajes ya recibidos de un trabajador."""
+        trabajador = self.conexiones[conexion]
+        try:
+            while True:
+                mensaje = conexion.recv()
+                try:
+                    self.atender(trabajador, *mensaje)
+                except Exception as e:
+                    log.error("[ERROR bus coordinador] %s: %s", mensaje[0], e)
+                if not conexion.poll():
+                    return
+        except (EOFError, OSError):
+            self._retirar(conexion)
+
+    def _enviar(self, trabajador, *mensaje):
+        try:
+            with self._envios[trabajador]:
+                self._salidas[trabajador].send(mensaje)
+        except (OSError, ValueError):
+            pass  # El trabajador terminó; su bus se retira al leer el EOF
+
+    def atender(self, trabajador, tipo, *datos):
+        """
+        Procesa un mensaje del bus de un trabajador.
+
+        Lo que toca el almacenamiento (guardar, leer historial) se encola en
+        `tareas` para no frenar el bus; lo demás se resuelve aquí.
+        """
+        if tipo == "mensaje":
+            sala, usuario, texto = datos
+            self.tareas.encolar(sala, self._guardar, sala, usuario, texto, marca_tiempo())
+
+        elif tipo == "difundir":
+            sala, id_sesion, comando, texto = datos
+            self.difundir(sala, None if id_sesion is None else (trabajador, id_sesion), comando, texto)
+
+        elif tipo == "unirse":
+            id_sesion, nombre, sala, despues_de = datos
+            self.unirse(trabajador, id_sesion, nombre, sala, despues_de)
+
+        elif tipo == "salir":
+            id_sesion, sala = datos
+            self._quitar((trabajador, id_sesion), sala)
+
+        elif tipo == "adios":
+            (id_sesion,) = datos
+            self._olvidar((trabajador, id_sesion))
+
+        elif tipo == "hola":
+            numero, id_sesion, nombre = datos
+            self._enviar(trabajador, "respuesta", numero, self.registrar_nombre((trabajador, id_sesion), nombre))
+
+        elif tipo == "historial":
+            numero, sala, ultimos, despues_de, antes_de = datos
+            self.tareas.encolar(sala, self._historial, trabajador, numero, sala, ultimos, despues_de, antes_de)
+
+        elif tipo == "usuarios":
+            (numero,) = datos
+            filas = [(nombre, self.presencia[clave][1]) for nombre, clave in self.nombres.items()]
+            self._enviar(trabajador, "respuesta", numero, filas)
+
+        elif tipo == "salas":
+            (numero,) = datos
+            self._enviar(trabajador, "respuesta", numero, list(self.salas))
+
+        elif tipo == "estadisticas":
+            (numero,) = datos
+            backend = self.historial.backend
+            self._enviar(trabajador, "respuesta", numero, {
+                "cache": self.historial.estadisticas(),
+                "persistencia": backend.estadisticas() if hasattr(backend, "estadisticas") else {},
+            })
+
+    # ------------------ TAREAS DE SALA ------------------
+
+    def _guardar(self, sala, usuario, texto, ts):
+        """Guarda un mensaje y lo difunde con su secuencia (hilo de `tareas`)."""
+        try:
+            seq = self.historial.guardar(sala, usuario, texto, ts)
+        except Exception as e:
+            log.error("[ERROR registro historial] %s", e)
+            seq = None
+        self.difundir(sala, None, "CHAT", (seq or 0, ts, usuario, texto))
+
+    def _historial(self, trabajador, numero, sala, ultimos, despues_de, antes_de):
+        """Responde una petición de historial (hilo de `tareas`)."""
+        mensajes = self.historial.obtener_historial_sala(
+            sala, ultimos=ultimos, despues_de=despues_de, antes_de=antes_de
+        )
+        self._enviar(trabajador, "respuesta", numero, mensajes)
+
+    def _unido(self, trabajador, id_sesion, nombre, sala, despues_de):
+        """
+        Envía al trabajador el historial de un alta y notifica a la sala
+        (hilo de `tareas`). Va en la cola de la sala: incluye todo mensaje
+        guardado antes, y los guardados después se difunden tras el "unido".
+        """
+        mensajes = self.historial.obtener_historial_sala(
+            sala, ultimos=config.REPLAY_MAX_MENSAJES, despues_de=despues_de
+        )
+        self._enviar(trabajador, "unido", id_sesion, sala, mensajes)
+        self.difundir(sala, (trabajador, id_sesion), "NOTIFY", f"{nombre} se ha unido a la sala.")
+
+    # ------------------ PRESENCIA ------------------
+
+    def registrar_nombre(self, clave, nombre):
+        """Asigna el nombre a la sesión si nadie más lo usa en ningún trabajador."""
+        actual = self.nombres.get(nombre)
+        if actual is not None and actual != clave:
+            return False
+        presencia = self.presencia.setdefault(clave, [None, None])
+        if presencia[0] is not None and presencia[0] != nombre:
+            self.nombres.pop(presencia[0], None)
+        self.nombres[nombre] = clave
+        presencia[0] = nombre
+        return True
+
+    def unirse(self, trabajador, id_sesion, nombre, sala, despues_de):
+        """
+        Mueve la sesión a la sala y notifica a la anterior; el historial y el
+        aviso a la sala nueva los envía `_unido` desde la cola de la sala.
+        """
+        clave = (trabajador, id_sesion)
+        presencia = self.presencia.setdefault(clave, [None, None])
+        anterior = presencia[1]
+        if anterior != sala:
+            if anterior is not None:
+                self._quitar(clave, anterior)
+                self.difundir(anterior, clave, "NOTIFY", f"{nombre} ha salido de la sala {anterior}.")
+            presencia[1] = sala
+            with self._lock:
+                self.salas.setdefault(sala, Counter())[trabajador] += 1
+        self.tareas.encolar(sala, self._unido, trabajador, id_sesion, nombre, sala, despues_de)
+
+    def difundir(self, sala, excluir, comando, datos):
+        """
+        Reenvía una difusión a los trabajadores con miembros en la sala.
+
+        Args:
+            excluir (tuple | None): Clave de la sesión que no debe recibirla.
+            datos: Texto de la trama, o (seq, ts, usuario, texto) si es CHAT;
+                cada trabajador la codifica según el protocolo de sus clientes.
+        """
+        with self._lock:
+            destinos = [t for t, miembros in self.salas.get(sala, {}).items() if miembros]
+        for trabajador in destinos:
+            id_excluido = excluir[1] if excluir is not None and excluir[0] == trabajador else None
+            self._enviar(trabajador, "difusion", sala, id_excluido, comando, datos)
+
+    def _quitar(self, clave, sala):
+        """Quita la sesión de la sala si es su sala actual."""
+        presencia = self.presencia.get(clave)
+        if sala is None or presencia is None or presencia[1] != sala:
+            return
+        presencia[1] = None
+        with self._lock:
+            miembros = self.salas[sala]
+            miembros[clave[0]] -= 1
+            if miembros[clave[0]] <= 0:
+                del miembros[clave[0]]
+
+    def _olvidar(self, clave):
+        """Elimina una sesión desconectada: su sala y su nombre."""
+        presencia = self.presencia.get(clave)
+        if presencia is None:
+            return
+        self._quitar(clave, presencia[1])
+        if presencia[0] is not None and self.nombres.get(presencia[0]) == clave:
+            del self.nombres[presencia[0]]
+        del self.presencia[clave]
+
+    def _retirar(self, conexion):
+        """Olvida las sesiones de un trabajador que terminó."""
+        trabajador = self.conexiones.pop(conexion)
+        conexion.close()
+        for clave in [c for c in self.presencia if c[0] == trabajador]:
+            self._olvidar(clave)
+        log.error("[SERVIDOR] Terminó el trabajador %s.", trabajador)
@@ -10,15 +10,28 @@ Gestiona:
 
 Utiliza:
 - threading para manejar múltiples clientes simultáneamente
+- ColaSalida para enviar sin bloquear (una cola y un hilo escritor por cliente)
 - socket para comunicación TCP
-- Almacenamiento JSON para historial
+- Almacenamiento JSON / JSON Lines para historial, con caché LRU en memoria
 - ProtocoloServidor para construcción y parseo de mensajes
+- MetricasServidor (puerto de métricas) y un registro que no bloquea
 """
 
 import socket
 import threading
-from protocolo import ProtocoloServidor
-from almacenamiento import Almacenamiento
+import time
+from protocolo import ProtocoloServidor, DecodificadorTramas, CAPACIDAD_BINARIA, CAPACIDAD_COMPRESION
+from identificadores import SALAS, USUARIOS
+from compresion import Compresion
+from almacenamiento import crear_almacenamiento, marca_tiempo
+from cache_historial import CacheHistorial, INTENTOS_UNION
+from cola_salida import ColaSalida, MetricasColas
+from difusion import Difusion
+from sesion import Sesion, Sala, texto_lista_usuarios
+from metricas import MetricasServidor, iniciar_servidor_metricas
+from cluster import Cluster, codificar_usuarios
+import registro
+from registro import log
 import config
 
 class ServidorChat:
@@ -28,32 +41,84 @@ class ServidorChat:
     Atributos:
         host, puerto        → Configuración de red
         servidor            → Socket principal
-        clientes            → Diccionario {socket: nombre}
-        salas               → Diccionario {nombre_sala: [sockets]}
-        historial           → Objeto Almacenamiento para mensajes
-        _lock               → Lock para operaciones thread-safe
+        sesiones            → Diccionario {socket: Sesion} de todas las conexiones
+        nombres             → Diccionario {nombre: Sesion} de los usuarios registrados
+        salas               → Diccionario {nombre_sala: Sala}
+        metricas_colas      → Contadores de descartes y clientes lentos
+        difusion            → Codifica una vez cada trama retransmitida a una sala
+        ids_salas           → Id entero de cada sala (registro SALAS del proceso)
+        compresion          → Compresores zlib por conexión y sus contadores
+        historial           → Caché de historial delante del backend de almacenamiento
+        metricas            → Contadores e histogramas (ver metricas.py)
+        servidor_metricas   → Puerto de administración con las métricas (o None)
+        cluster             → Reparto de salas entre nodos (ver cluster.py)
+        _lock               → Lock global (sesiones, nombres y alta de salas)
+
+    Cada Sesion guarda su sala actual (índice inverso usuario → sala).
+
+    Locks y orden de adquisición:
+        1. self._lock (global): protege `sesiones`, `nombres` y la creación de
+           salas en `salas`. Las salas nunca se eliminan, así que leer
+           `self.salas.get(nombre)` no necesita el lock.
+        2. Sala.lock (uno por sala): protege `miembros` de esa sala. Al unirse
+           también cubre lo agregado desde la caché en memoria a la lectura
+           del historial, nunca el backend (ver unirse_sala).
+        3. Locks internos del historial y de ColaSalida de cada sesión.
+    Un hilo puede tomar un lock de nivel mayor teniendo uno menor, nunca al
+    revés, y nunca tiene dos locks de sala a la vez (al cambiar de sala se
+    libera la anterior antes de tomar la nueva). Así los mensajes de salas
+    distintas no compiten por ningún lock del servidor.
+
+    `Sesion.sala` solo la modifica el hilo de la propia conexión; otros hilos
+    (listados) la leen sin lock y pueden ver un valor apenas desactualizado.
     """
 
     def __init__(self):
+        registro.configurar(config.NIVEL_REGISTRO, config.REGISTRO_COLA_MAX)
+        self.metricas = MetricasServidor()
+
         # Configuración del servidor TCP
         self.host = config.SERVIDOR_HOST
         self.puerto = config.SERVIDOR_PUERTO
-        self.servidor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.servidor.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.servidor.bind((self.host, self.puerto))
-        self.servidor.listen()
+        self.servidor = self.abrir_socket()
 
-        print(f"[SERVIDOR] En ejecución en {self.host}:{self.puerto}")
-        print("[SERVIDOR] Esperando conexiones...")
+        log.info("[SERVIDOR] En ejecución en %s:%s", self.host, self.puerto)
+        log.info("[SERVIDOR] Esperando conexiones...")
 
         # Estructuras de datos
-        self.clientes = {}       # {socket: nombre}
-        self.salas = {}          # {nombre_sala: [sockets]}
+        self.sesiones = {}       # {socket: Sesion}
+        self.nombres = {}        # {nombre: Sesion}
+        self.salas = {}          # {nombre_sala: Sala}
         for s in ("Juegos", "Series"):  # Salas por defecto
-            self.salas[s] = []
-
-        self.historial = Almacenamiento(config.ARCHIVO_HISTORIAL)
-        self._lock = threading.Lock()
+            self.salas[s] = Sala(s, self.metricas.lock("sala"))
+        self.metricas_colas = MetricasColas()
+        self.difusion = Difusion()
+        self.ids_salas = SALAS
+        self.compresion = Compresion()
+
+        self.historial = self.crear_historial()
+        self._lock = self.metricas.lock("global")
+        self.cluster = Cluster()
+        self.metricas.observar_servidor(self)
+        self.servidor_metricas = iniciar_servidor_metricas(
+            self.metricas, config.METRICAS_HOST, config.METRICAS_PUERTO
+        )
+
+    def abrir_socket(self):
+        """Crea el socket de escucha en host:puerto."""
+        servidor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        servidor.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        servidor.bind((self.host, self.puerto))
+        servidor.listen(config.BACKLOG_CONEXIONES)
+        return servidor
+
+    def crear_historial(self):
+        """Crea la caché de historial delante del backend configurado."""
+        return CacheHistorial(
+            crear_almacenamiento(),
+            mensajes_por_sala=config.CACHE_MENSAJES_POR_SALA,
+            presupuesto_bytes=config.CACHE_PRESUPUESTO_BYTES,
+        )
 
     def iniciar(self):
         """Acepta conexiones entrantes y lanza un hilo por cliente."""
@@ -64,8 +129,14 @@ class ServidorChat:
                                         args=(cliente, direccion), daemon=True)
                 hilo.start()
         except KeyboardInterrupt:
-            print("[SERVIDOR] Cerrando servidor...")
+            log.info("[SERVIDOR] Cerrando servidor...")
+        finally:
             self.servidor.close()
+            if self.servidor_metricas is not None:
+                self.servidor_metricas.cerrar()
+            # Escribe y sincroniza los mensajes que sigan en la cola de persistencia
+            self.historial.cerrar()
+            registro.detener()
 
     def manejar_cliente(self, cliente, direccion):
         """
@@ -74,226 +145,434 @@ class ServidorChat:
         - Procesamiento según protocolo
         - Gestión de salas y desconexión
         """
-        print(f"[NUEVA CONEXIÓN] Desde {direccion}")
-        nombre = None
-        sala_actual = None
+        log.debug("[NUEVA CONEXIÓN] Desde %s", direccion)
+        self.metricas.conexiones.inc()
+        sesion = Sesion(cliente, direccion, ColaSalida(
+            cliente, config.LIMITE_COLA_SALIDA,
+            config.POLITICA_CLIENTE_LENTO, self.metricas_colas,
+        ))
+        with self._lock:
+            self.sesiones[cliente] = sesion
+
+        decodificador = DecodificadorTramas(config.BUFFER, config.TAMAÑO_MAXIMO_TRAMA)
+        salir = False
 
         try:
-            while True:
-                mensaje = cliente.recv(config.BUFFER).decode(config.CODIFICACION)
-                if not mensaje:
+            while not salir:
+                # Una lectura puede traer varias tramas (o ninguna completa)
+                tramas = decodificador.recibir(cliente)
+                if tramas is None:
                     break
 
-                comando, datos = ProtocoloServidor.procesar_mensaje(mensaje)
-
-                # ------------------ COMANDOS ------------------
-                if comando == "HELLO":
-                    # Registro de nombre de usuario
-                    nombre = datos
-                    if self.nombre_duplicado(nombre):
-                        cliente.send(ProtocoloServidor.construir_respuesta(
-                            "ERROR", "Nombre ya en uso."
-                        ).encode(config.CODIFICACION))
-                        cliente.close()
-                        return
-
-                    with self._lock:
-                        self.clientes[cliente] = nombre
-                    cliente.send(ProtocoloServidor.construir_respuesta(
-                        "OK", f"Conexión establecida. Bienvenido, {nombre}."
-                    ).encode(config.CODIFICACION))
-                    print(f"[+] Usuario conectado: {nombre}")
-
-                elif comando == "JOIN_SALA":
-                    # Usuario se une a una sala
-                    sala_actual = datos
-                    self.unirse_sala(cliente, sala_actual)
-
-                    # Enviar historial previo al cliente
-                    historial_sala = self.historial.obtener_historial_sala(sala_actual)
-                    if historial_sala:
-                        for msg in historial_sala:
-                            try:
-                                mensaje_hist = f"{msg['usuario']}: {msg['texto']}"
-                                resp = ProtocoloServidor.construir_respuesta("CHAT", mensaje_hist)
-                                cliente.send((resp + "\n").encode(config.CODIFICACION))
-                            except Exception:
-                                pass
-
-                elif comando == "MSG" and sala_actual:
-                    # Retransmitir mensaje a sala y guardar historial
-                    self.retransmitir(cliente, sala_actual, datos)
-                    try:
-                        usuario = self.clientes.get(cliente, "Desconocido")
-                        self.historial.guardar(sala_actual, usuario, datos)
-                    except Exception as e:
-                        print(f"[ERROR registro historial] {e}")
-
-                elif comando == "USER_LIST":
-                    self.enviar_lista_usuarios(cliente)
-
-                elif comando == "USER_LIST_ALL":
-                    # Listar todos los usuarios conectados con su sala
-                    usuarios_info = []
-                    with self._lock:
-                        for c, nombre_usuario in self.clientes.items():
-                            sala = None
-                            for s, sockets in self.salas.items():
-                                if c in sockets:
-                                    sala = s
-                                    break
-                            sala_texto = sala if sala else "Sin sala"
-                            usuarios_info.append(f"{nombre_usuario} ({sala_texto})")
-                    texto = ", ".join(usuarios_info) if usuarios_info else "No hay usuarios conectados."
-                    cliente.send(ProtocoloServidor.construir_respuesta(
-                        "USER_LIST_ALL", texto
-                    ).encode(config.CODIFICACION))
-
-                elif comando == "ROOM_LIST":
-                    self.enviar_lista_salas(cliente)
-
-                elif comando == "LEAVE_SALA":
-                    # Usuario abandona sala, notificar a otros
-                    sala = datos
-                    nombre_usuario = self.clientes.get(cliente, "Desconocido")
-                    if sala in self.salas and cliente in self.salas[sala]:
-                        for c in list(self.salas[sala]):
-                            if c != cliente:
-                                try:
-                                    c.send(ProtocoloServidor.construir_respuesta(
-                                        "NOTIFY", f"{nombre_usuario} ha salido de la sala {sala}."
-                                    ).encode(config.CODIFICACION))
-                                except Exception:
-                                    self.desconectar(c, sala)
-                        with self._lock:
-                            if cliente in self.salas[sala]:
-                                self.salas[sala].remove(cliente)
-                    cliente.send(ProtocoloServidor.construir_respuesta(
-                        "OK", f"Has salido de la sala {sala}."
-                    ).encode(config.CODIFICACION))
-
-                elif comando == "SALIR":
-                    # Desconexión voluntaria
-                    break
+                for trama in tramas:
+                    comando, datos = ProtocoloServidor.decodificar_trama(trama)
+
+                    # ------------------ COMANDOS ------------------
+                    if comando == "HELLO":
+                        # Registro de nombre de usuario y capacidades del cliente
+                        nombre, capacidades = ProtocoloServidor.procesar_hello(datos)
+                        if not self.registrar_nombre(sesion, nombre):
+                            # desconectar() vacía la cola antes de cerrar el socket
+                            self.enviar(sesion, ProtocoloServidor.trama(
+                                "ERROR", "Nombre ya en uso.", sesion.binario
+                            ))
+                            return
+
+                        self.negociar(sesion, capacidades)
+                        self.enviar(sesion, ProtocoloServidor.trama(
+                            "OK", f"Conexión establecida. Bienvenido, {nombre}.", sesion.binario
+                        ))
+                        log.info("[+] Usuario conectado: %s", nombre)
+
+                    elif comando == "JOIN_SALA":
+                        # Usuario se une a una sala y recibe el historial previo
+                        # (solo lo posterior a la última secuencia que ya tiene).
+                        # Si la sala es de otro nodo, el cliente debe ir a ese nodo.
+                        sala, ultimo_seq = ProtocoloServidor.procesar_union(datos)
+                        destino = self.cluster.redireccion(sala)
+                        if destino:
+                            self.enviar(sesion, ProtocoloServidor.trama(
+                                "REDIRECT", f"{destino}|{sala}", sesion.binario
+                            ))
+                        elif self.ids_salas.id(sala) is None:
+                            self.enviar(sesion, ProtocoloServidor.trama(
+                                "ERROR", "Se alcanzó el máximo de salas.", sesion.binario
+                            ))
+                        else:
+                            self.unirse_sala(sesion, sala, ultimo_seq)
+
+                    elif comando == "HISTORY" and sesion.sala:
+                        # Página de mensajes anteriores a la secuencia indicada
+                        try:
+                            antes_de = int(datos)
+                        except ValueError:
+                            antes_de = None
+                        self.enviar_historial(sesion, sesion.sala, antes_de)
+
+                    elif comando == "MSG" and sesion.sala:
+                        self.publicar_mensaje(sesion, datos)
+
+                    elif comando == "USER_LIST":
+                        self.enviar_lista_usuarios(sesion)
+
+                    elif comando == "USER_LIST_ALL":
+                        # Listar todos los usuarios conectados con su sala
+                        self.enviar_lista_usuarios(sesion, "USER_LIST_ALL", "Sin sala")
+
+                    elif comando == "ROOM_LIST":
+                        self.enviar_lista_salas(sesion)
+
+                    elif comando == "NODO_USUARIOS":
+                        # Consulta de otro nodo del clúster: solo los usuarios de este
+                        self.enviar(sesion, ProtocoloServidor.trama(
+                            comando, codificar_usuarios(self.filas_usuarios())
+                        ))
+
+                    elif comando == "NODO_SALAS":
+                        self.enviar(sesion, ProtocoloServidor.trama(comando, "\n".join(self.salas_propias())))
+
+                    elif comando == "LEAVE_SALA":
+                        # Usuario abandona sala, notificar a otros
+                        sala = datos
+                        if self.salir_sala(sesion, sala):
+                            self.retransmitir_evento(
+                                sesion, sala, f"{sesion.nombre_o()} ha salido de la sala {sala}."
+                            )
+                        self.enviar(sesion, ProtocoloServidor.trama(
+                            "OK", f"Has salido de la sala {sala}.", sesion.binario
+                        ))
+
+                    elif comando == "SALIR":
+                        # Desconexión voluntaria
+                        salir = True
+                        break
 
-                else:
-                    # Comando no reconocido
-                    cliente.send(ProtocoloServidor.construir_respuesta(
-                        "ERROR", f"Comando no reconocido: {comando}"
-                    ).encode(config.CODIFICACION))
+                    else:
+                        # Comando no reconocido
+                        self.enviar(sesion, ProtocoloServidor.trama(
+                            "ERROR", f"Comando no reconocido: {comando}", sesion.binario
+                        ))
 
         except ConnectionResetError:
             pass
         except Exception as e:
-            print(f"[ERROR hilo cliente] {e}")
+            log.error("[ERROR hilo cliente] %s", e)
         finally:
             # Limpiar cliente y sala
-            self.desconectar(cliente, sala_actual)
+            self.desconectar(sesion)
 
     # ------------------ MÉTODOS AUXILIARES ------------------
 
-    def nombre_duplicado(self, nombre):
-        """Verifica si ya existe un usuario con ese nombre."""
-        with self._lock:
-            return nombre in self.clientes.values()
+    def enviar(self, sesion, trama):
+        """
+        Encola una trama ya codificada en la cola de salida del cliente.
 
-    def unirse_sala(self, cliente, sala):
-        """Agrega un cliente a una sala y notifica a los demás."""
-        with self._lock:
-            if sala not in self.salas:
-                self.salas[sala] = []
-            if cliente not in self.salas[sala]:
-                self.salas[sala].append(cliente)
-
-        nombre = self.clientes.get(cliente, "Desconocido")
-        print(f"[{sala}] ➤ {nombre} se ha unido.")
-        self.retransmitir_evento(cliente, sala, f"{nombre} se ha unido a la sala.")
-        cliente.send(ProtocoloServidor.construir_respuesta(
-            "OK", f"Te has unido a la sala '{sala}'."
-        ).encode(config.CODIFICACION))
-
-    def retransmitir(self, cliente, sala, mensaje):
-        """Envía un mensaje a todos los clientes de la sala."""
-        nombre = self.clientes.get(cliente, "Desconocido")
-        texto = f"{nombre}: {mensaje}"
-        vivos = []
-        for c in list(self.salas.get(sala, [])):
-            try:
-                c.send(f"{texto}\n".encode(config.CODIFICACION))
-                vivos.append(c)
-            except Exception:
-                self.desconectar(c, sala)
-        with self._lock:
-            self.salas[sala] = vivos
-
-    def retransmitir_evento(self, cliente, sala, mensaje):
-        """Envía notificación a todos los clientes de la sala, excepto al remitente."""
-        vivos = []
-        for c in list(self.salas.get(sala, [])):
-            try:
-                if c != cliente:
-                    c.send(ProtocoloServidor.construir_respuesta(
-                        "NOTIFY", mensaje).encode(config.CODIFICACION))
-                vivos.append(c)
-            except Exception:
-                self.desconectar(c, sala)
+        Nunca bloquea: el hilo escritor de la cola hace el envío real. Si el
+        cliente no lee y su cola supera LIMITE_COLA_SALIDA se aplica
+        POLITICA_CLIENTE_LENTO. Si el cliente negoció la compresión, las tramas
+        grandes se comprimen en su flujo zlib.
+
+        Returns:
+            bool: False si la trama se descartó o la cola ya está cerrada.
+        """
+        compresor = sesion.compresor
+        if compresor is None or len(trama) < self.compresion.umbral:
+            return sesion.cola.encolar(trama)
+        with compresor.lock:
+            return sesion.cola.encolar(self.compresion.comprimir(compresor, trama), descartable=False)
+
+    def negociar(self, sesion, capacidades):
+        """
+        Acepta las capacidades del HELLO que admite el servidor.
+
+        La respuesta CAPACIDADES va en texto; las tramas siguientes usan el
+        protocolo y la compresión negociados. Un segundo HELLO no vuelve a
+        negociar.
+        """
+        aceptadas = ProtocoloServidor.capacidades_aceptadas(capacidades)
+        if not aceptadas or sesion.binario or sesion.compresor is not None:
+            return
+        self.enviar(sesion, ProtocoloServidor.trama("CAPACIDADES", ",".join(aceptadas)))
+        sesion.binario = CAPACIDAD_BINARIA in aceptadas
+        if CAPACIDAD_COMPRESION in aceptadas:
+            sesion.compresor = self.compresion.compresor()
+
+    def registrar_nombre(self, sesion, nombre):
+        """
+        Asigna el nombre a la sesión si nadie más lo usa. La sesión guarda la
+        copia registrada del nombre (USUARIOS), la misma que usa el historial.
+
+        Returns:
+            bool: False si el nombre ya está en uso.
+        """
+        nombre = USUARIOS.interno(nombre)
         with self._lock:
-            self.salas[sala] = vivos
+            if nombre in self.nombres:
+                return False
+            if sesion.nombre is not None:
+                self.nombres.pop(sesion.nombre, None)
+            self.nombres[nombre] = sesion
+            sesion.nombre = nombre
+        return True
+
+    def obtener_sala(self, nombre):
+        """Devuelve la Sala con ese nombre, creándola si no existe."""
+        sala = self.salas.get(nombre)
+        if sala is None:
+            with self._lock:
+                sala = self.salas.setdefault(nombre, Sala(nombre, self.metricas.lock("sala")))
+        return sala
+
+    def unirse_sala(self, sesion, sala, despues_de=None):
+        """
+        Agrega un cliente a una sala, le envía la confirmación y el historial,
+        y notifica a los demás. Si estaba en otra sala, primero sale de ella.
+
+        El historial se lee sin el lock de la sala (puede ir al backend).
+        Después, con el lock tomado, se agrega lo guardado mientras tanto
+        (solo de la caché en memoria), se da el alta y se encolan la
+        confirmación y el historial: ninguna difusión de la sala se cuela
+        antes del historial, y cualquier mensaje guardado antes del alta está
+        en el historial. Un mensaje puede llegar en ambos; el cliente descarta
+        los repetidos por secuencia. Si la caché ya descartó parte de lo
+        guardado mientras tanto, se vuelve a leer (hasta INTENTOS_UNION
+        veces; la última lectura se hace con el lock tomado).
+
+        Args:
+            despues_de (int, opcional): Última secuencia que el cliente ya tiene.
+        """
+        sala = self.ids_salas.interno(sala)
+        anterior = sesion.sala
+        if anterior is not None and anterior != sala:
+            self.salir_sala(sesion, anterior)
+        limite = config.REPLAY_MAX_MENSAJES
+        nueva = self.obtener_sala(sala)
+        for intento in range(INTENTOS_UNION):
+            mensajes = self.historial.obtener_historial_sala(sala, ultimos=limite, despues_de=despues_de)
+            desde = mensajes[-1].seq if mensajes else despues_de
+            with nueva.lock:
+                recientes = self.historial.en_memoria(sala, despues_de=desde, ultimos=limite)
+                if recientes is None:
+                    if intento + 1 < INTENTOS_UNION:
+                        continue  # La caché ya descartó parte de lo nuevo: volver a leer
+                    # Sala demasiado activa para su caché: leer con el lock tomado
+                    mensajes = self.historial.obtener_historial_sala(sala, ultimos=limite, despues_de=despues_de)
+                    recientes = []
+                mensajes = (mensajes + recientes)[-limite:]
+                nueva.miembros.add(sesion)
+                sesion.sala = sala
+                self.confirmar_union(sesion, sala)
+                self.escribir_historial(sesion, mensajes, primera_pagina=True)
+            break
+
+        nombre = sesion.nombre_o()
+        if anterior is not None and anterior != sala:
+            self.retransmitir_evento(sesion, anterior, f"{nombre} ha salido de la sala {anterior}.")
+        log.info("[%s] ➤ %s se ha unido.", sala, nombre)
+        self.retransmitir_evento(sesion, sala, f"{nombre} se ha unido a la sala.")
+
+    def confirmar_union(self, sesion, sala):
+        """Encola la confirmación de JOIN_SALA; en binario la precede el id de la sala (SALA)."""
+        if sesion.binario:
+            self.enviar(sesion, ProtocoloServidor.trama_sala(self.ids_salas.id(sala), sala))
+        self.enviar(sesion, ProtocoloServidor.trama(
+            "OK", f"Te has unido a la sala '{sala}'.", sesion.binario
+        ))
+
+    def salir_sala(self, sesion, sala):
+        """
+        Quita al cliente de la sala indicada si es su sala actual.
 
-    def enviar_lista_usuarios(self, cliente):
-        """Envía al cliente la lista de usuarios y la sala en la que están."""
-        usuarios_info = []
+        Returns:
+            bool: True si el cliente estaba en esa sala.
+        """
+        if sala is None or sesion.sala != sala:
+            return False
+        actual = self.salas[sala]
+        with actual.lock:
+            actual.miembros.discard(sesion)
+        sesion.sala = None
+        return True
+
+    def enviar_historial(self, sesion, sala, antes_de=None, despues_de=None):
+        """
+        Envía el historial de la sala en una sola trama HISTORY.
+
+        Sin `antes_de` se envían los últimos REPLAY_MAX_MENSAJES mensajes (solo
+        los posteriores a `despues_de`, si se indica); con `antes_de` se envía
+        la página de REPLAY_PAGINA mensajes anterior a esa secuencia. Todo el
+        bloque se codifica una vez y se encola como una trama.
+        """
+        if antes_de is None:
+            limite = config.REPLAY_MAX_MENSAJES
+        else:
+            limite = config.REPLAY_PAGINA
+        mensajes = self.historial.obtener_historial_sala(
+            sala, ultimos=limite, despues_de=despues_de, antes_de=antes_de
+        )
+        self.escribir_historial(sesion, mensajes, primera_pagina=antes_de is None)
+
+    def escribir_historial(self, sesion, mensajes, primera_pagina):
+        """Encola un bloque de historial en una trama HISTORY (nada si la primera página está vacía)."""
+        if not mensajes and primera_pagina:
+            return
+        hay_mas = bool(mensajes) and mensajes[0].seq > 1
+        self.enviar(sesion, ProtocoloServidor.trama_historial(
+            mensajes, hay_mas, sesion.binario, self.ids_salas.id(sesion.sala) if sesion.binario else 0
+        ))
+
+    def publicar_mensaje(self, sesion, texto):
+        """Guarda un mensaje en el historial de la sala actual (asigna la secuencia) y lo retransmite."""
+        sala = sesion.sala
+        ts = marca_tiempo()
+        inicio = time.perf_counter()
+        try:
+            seq = self.historial.guardar(sala, sesion.nombre_o(), texto, ts)
+        except Exception as e:
+            log.error("[ERROR registro historial] %s", e)
+            seq = None
+        self.metricas.guardar.observar(time.perf_counter() - inicio)
+        self.metricas.mensajes.inc(sala)
+        self.retransmitir(sesion, sala, texto, seq, ts)
+
+    def retransmitir(self, sesion, sala, mensaje, seq=None, ts=None):
+        """
+        Encola un mensaje para todos los clientes de la sala.
+
+        Solo encola: un cliente lento no retrasa al remitente ni al resto. Los
+        clientes cuyo envío falla los retira su propio hilo al desconectarse.
+        La trama se codifica una vez por protocolo y el mismo objeto bytes va a
+        todas las colas. Lleva la secuencia del mensaje en la sala y su marca de tiempo.
+        """
+        inicio = time.perf_counter()
+        trama = self.difusion.chat(self.ids_salas.id(sala), seq or 0, ts or 0, sesion.nombre_o(), mensaje)
+        entregas = 0
+        for s in self.miembros(sala):
+            entregas += self.enviar(s, trama.para(s))
+        self.difusion.registrar(trama, entregas)
+        self.metricas.difusion.observar(time.perf_counter() - inicio)
+
+    def retransmitir_evento(self, sesion, sala, mensaje):
+        """Encola una notificación para todos los clientes de la sala, excepto el remitente."""
+        trama = self.difusion.trama("NOTIFY", mensaje)
+        entregas = 0
+        for s in self.miembros(sala):
+            if s is not sesion:
+                entregas += self.enviar(s, trama.para(s))
+        self.difusion.registrar(trama, entregas)
+
+    def miembros(self, sala):
+        """Copia de los miembros de la sala tomada solo con el lock de esa sala."""
+        actual = self.salas.get(sala)
+        if actual is None:
+            return []
+        with actual.lock:
+            return list(actual.miembros)
+
+    def enviar_lista_usuarios(self, sesion, comando="USER_LIST", sin_sala="No se encuentra en una sala"):
+        """
+        Envía al cliente la lista de usuarios y la sala en la que están.
+
+        El lock solo se toma para copiar los pares (nombre, sala); el texto se
+        arma fuera de él. En un clúster se agregan los usuarios de los demás nodos.
+        """
+        filas = self.filas_usuarios() + self.cluster.usuarios_remotos()
+        self.enviar(sesion, ProtocoloServidor.trama(
+            comando, texto_lista_usuarios(filas, sin_sala), sesion.binario
+        ))
+
+    def filas_usuarios(self):
+        """Pares (nombre, sala) de los usuarios registrados."""
         with self._lock:
-            for c, nombre in self.clientes.items():
-                sala = None
-                for s, sockets in self.salas.items():
-                    if c in sockets:
-                        sala = s
-                        break
-                estado = sala if sala else "No se encuentra en una sala"
-                usuarios_info.append(f"{nombre} ({estado})")
-        texto = ", ".join(usuarios_info) if usuarios_info else "No hay usuarios conectados."
-        cliente.send(ProtocoloServidor.construir_respuesta(
-            "USER_LIST", texto
-        ).encode(config.CODIFICACION))
-
-    def enviar_lista_salas(self, cliente):
-        """Envía al cliente la lista de salas existentes."""
-        if not self.salas:
-            cliente.send(ProtocoloServidor.construir_respuesta(
-                "ROOM_LIST", "No hay salas activas."
-            ).encode(config.CODIFICACION))
+            return [(s.nombre, s.sala) for s in self.nombres.values()]
+
+    def nombres_salas(self):
+        """Nombres de las salas existentes."""
+        return list(self.salas)
+
+    def salas_propias(self):
+        """Salas existentes que pertenecen a este nodo del clúster."""
+        return [s for s in self.nombres_salas() if self.cluster.es_propia(s)]
+
+    def enviar_lista_salas(self, sesion):
+        """Envía al cliente la lista de salas existentes (de todos los nodos del clúster)."""
+        nombres_salas = list(dict.fromkeys(self.salas_propias() + self.cluster.salas_remotas()))
+        if not nombres_salas:
+            self.enviar(sesion, ProtocoloServidor.trama(
+                "ROOM_LIST", "No hay salas activas.", sesion.binario
+            ))
             return
-        lista = ", ".join(self.salas.keys())
-        cliente.send(ProtocoloServidor.construir_respuesta(
-            "ROOM_LIST", lista
-        ).encode(config.CODIFICACION))
+        lista = ", ".join(nombres_salas)
+        self.enviar(sesion, ProtocoloServidor.trama(
+            "ROOM_LIST", lista, sesion.binario
+        ))
 
-    def desconectar(self, cliente, sala):
+    def estadisticas_colas(self):
         """
-        Elimina cliente de estructuras y notifica salida de sala.
-        Cierra socket y limpia diccionarios.
+        Devuelve el estado de las colas de salida.
+
+        Returns:
+            dict: conexiones, bytes pendientes (total y máximo actual), máximo
+            histórico, tramas descartadas y clientes desconectados por lentos.
+        """
+        with self._lock:
+            pendientes = [s.cola.pendientes for s in self.sesiones.values()]
+        return {
+            "conexiones": len(pendientes),
+            "pendientes_total": sum(pendientes),
+            "pendientes_max": max(pendientes, default=0),
+            "maxima_historica": self.metricas_colas.maxima,
+            "descartadas": self.metricas_colas.descartadas,
+            "desconexiones_lentos": self.metricas_colas.desconexiones,
+        }
+
+    def estadisticas_persistencia(self):
         """
-        nombre = self.clientes.get(cliente, "Usuario")
-        print(f"[-] {nombre} se ha desconectado.")
+        Devuelve las métricas de la cola de escritura diferida del historial.
 
-        if sala and cliente in self.salas.get(sala, []):
-            try:
-                self.salas[sala].remove(cliente)
-            except ValueError:
-                pass
-            self.retransmitir(cliente, sala, f"{nombre} ha salido de la sala.")
+        Returns:
+            dict: mensajes en cola, lotes, sincronizaciones, etc. (vacío si la
+            escritura diferida no está activa).
+        """
+        backend = self.historial.backend
+        return backend.estadisticas() if hasattr(backend, "estadisticas") else {}
+
+    def desconectar(self, sesion):
+        """
+        Elimina cliente de estructuras y notifica salida de sala.
+        Vacía su cola de salida, cierra el socket y limpia diccionarios.
+        """
+        nombre = sesion.nombre_o("Usuario")
+        log.info("[-] %s se ha desconectado.", nombre)
 
+        sala = sesion.sala
+        self.salir_sala(sesion, sala)
         with self._lock:
-            if cliente in self.clientes:
-                del self.clientes[cliente]
+            self.sesiones.pop(sesion.conexion, None)
+            if sesion.nombre is not None and self.nombres.get(sesion.nombre) is sesion:
+                del self.nombres[sesion.nombre]
+
+        if sala is not None:
+            self.retransmitir(sesion, sala, f"{nombre} ha salido de la sala.")
 
+        sesion.cola.cerrar()
         try:
-            cliente.close()
+            sesion.conexion.close()
         except:
             pass
 
 if __name__ == "__main__":
-    # Inicia servidor si se ejecuta directamente
-    servidor = ServidorChat()
+    # Inicia servidor si se ejecuta directamente, según el modo configurado
+    servidor = None
+    if config.PROCESOS_SERVIDOR > 1:
+        from multiproceso import Coordinador, disponible
+        if disponible():
+            servidor = Coordinador(config.PROCESOS_SERVIDOR)
+        else:
+            log.warning("[SERVIDOR] SO_REUSEPORT no está disponible; se usa un solo proceso.")
+    if servidor is None and config.MODO_SERVIDOR == "asyncio":
+        from nucleo_servidor_async import ServidorChatAsync
+        servidor = ServidorChatAsync()
+    elif servidor is None:
+        servidor = ServidorChat()
     servidor.iniciar()
@@ -0,0 +1,427 @@
+"""
+nucleo_servidor_async.py — Núcleo del servidor de chat basado en asyncio
+
+Alternativa a `ServidorChat` (un hilo por cliente) para muchas conexiones
+simultáneas: todas las conexiones se atienden en un único bucle de eventos,
+sin un hilo ni una pila por cliente. Se elige con `config.MODO_SERVIDOR`.
+
+Implementa el mismo conjunto de comandos (HELLO, JOIN_SALA, HISTORY, MSG,
+USER_LIST, USER_LIST_ALL, ROOM_LIST, LEAVE_SALA, SALIR) y usa el mismo
+almacenamiento de historial; las llamadas al almacenamiento se ejecutan en
+el pool de hilos por defecto para no bloquear el bucle de eventos.
+
+Las retransmisiones escriben en el buffer de cada transporte sin esperar; si
+los bytes pendientes de un cliente superan LIMITE_COLA_SALIDA se aplica
+POLITICA_CLIENTE_LENTO (descartar la trama o cortar la conexión).
+
+Publica las mismas métricas que ServidorChat (salvo la espera de locks, que
+aquí no existen).
+"""
+
+import asyncio
+import time
+from protocolo import ProtocoloServidor, DecodificadorTramas, CAPACIDAD_BINARIA, CAPACIDAD_COMPRESION
+from identificadores import SALAS, USUARIOS
+from compresion import Compresion
+from almacenamiento import crear_almacenamiento, marca_tiempo
+from cache_historial import CacheHistorial, INTENTOS_UNION
+from cola_salida import MetricasColas, DESCARTAR
+from difusion import Difusion
+from sesion import Sesion, texto_lista_usuarios
+from metricas import MetricasServidor, iniciar_servidor_metricas
+from cluster import Cluster, codificar_usuarios
+import registro
+from registro import log
+import config
+
+
+class ServidorChatAsync:
+    """
+    Servidor de chat sobre asyncio.
+
+    Atributos:
+        host, puerto        → Configuración de red
+        sesiones            → Diccionario {writer: Sesion} de todas las conexiones
+        nombres             → Diccionario {nombre: Sesion} de los usuarios registrados
+        salas               → Diccionario {nombre_sala: set(Sesion)}
+        historial           → Caché de historial delante del backend de almacenamiento
+        metricas_colas      → Contadores de descartes y clientes lentos
+        difusion            → Codifica una vez cada trama retransmitida a una sala
+        ids_salas           → Id entero de cada sala (registro SALAS del proceso)
+        compresion          → Compresores zlib por conexión y sus contadores
+        metricas            → Contadores e histogramas (ver metricas.py)
+        cluster             → Reparto de salas entre nodos (ver cluster.py)
+
+    No necesita locks: todo el estado se modifica desde el hilo del bucle de eventos.
+    """
+
+    def __init__(self):
+        registro.configurar(config.NIVEL_REGISTRO, config.REGISTRO_COLA_MAX)
+        self.metricas = MetricasServidor()
+        self.host = config.SERVIDOR_HOST
+        self.puerto = config.SERVIDOR_PUERTO
+
+        self.sesiones = {}       # {writer: Sesion}
+        self.nombres = {}        # {nombre: Sesion}
+        self.salas = {}          # {nombre_sala: set(Sesion)}
+        for s in ("Juegos", "Series"):  # Salas por defecto
+            self.salas[s] = set()
+        self.metricas_colas = MetricasColas()
+        self.difusion = Difusion()
+        self.ids_salas = SALAS
+        self.compresion = Compresion()
+
+        self.historial = CacheHistorial(
+            crear_almacenamiento(),
+            mensajes_por_sala=config.CACHE_MENSAJES_POR_SALA,
+            presupuesto_bytes=config.CACHE_PRESUPUESTO_BYTES,
+        )
+        self.cluster = Cluster()
+        self.metricas.observar_servidor(self)
+
+    def iniciar(self):
+        """Ejecuta el bucle de eventos hasta recibir Ctrl+C."""
+        _ampliar_limite_descriptores()
+        servidor_metricas = iniciar_servidor_metricas(
+            self.metricas, config.METRICAS_HOST, config.METRICAS_PUERTO
+        )
+        try:
+            asyncio.run(self._servir())
+        except KeyboardInterrupt:
+            log.info("[SERVIDOR] Cerrando servidor...")
+        finally:
+            if servidor_metricas is not None:
+                servidor_metricas.cerrar()
+            self.historial.cerrar()
+            registro.detener()
+
+    async def _servir(self):
+        """Abre el socket de escucha y atiende conexiones indefinidamente."""
+        servidor = await asyncio.start_server(
+            self.manejar_cliente, self.host, self.puerto,
+            backlog=config.BACKLOG_CONEXIONES,
+        )
+        log.info("[SERVIDOR] En ejecución en %s:%s (asyncio)", self.host, self.puerto)
+        log.info("[SERVIDOR] Esperando conexiones...")
+        async with servidor:
+            await servidor.serve_forever()
+
+    async def manejar_cliente(self, reader, writer):
+        """
+        Corrutina de manejo de cliente (equivalente a ServidorChat.manejar_cliente):
+        - Recepción de mensajes
+        - Procesamiento según protocolo
+        - Gestión de salas y desconexión
+        """
+        direccion = writer.get_extra_info("peername")
+        log.debug("[NUEVA CONEXIÓN] Desde %s", direccion)
+        self.metricas.conexiones.inc()
+        sesion = Sesion(writer, direccion)
+        self.sesiones[writer] = sesion
+        decodificador = DecodificadorTramas(tamaño_maximo=config.TAMAÑO_MAXIMO_TRAMA)
+        salir = False
+
+        try:
+            while not salir:
+                datos_crudos = await reader.read(config.BUFFER)
+                if not datos_crudos:
+                    break
+
+                for trama in decodificador.alimentar(datos_crudos):
+                    comando, datos = ProtocoloServidor.decodificar_trama(trama)
+
+                    # ------------------ COMANDOS ------------------
+                    if comando == "HELLO":
+                        nombre, capacidades = ProtocoloServidor.procesar_hello(datos)
+                        if not self.registrar_nombre(sesion, nombre):
+                            self.enviar(sesion, "ERROR", "Nombre ya en uso.")
+                            await writer.drain()
+                            return
+
+                        self.negociar(sesion, capacidades)
+                        self.enviar(sesion, "OK", f"Conexión establecida. Bienvenido, {nombre}.")
+                        log.info("[+] Usuario conectado: %s", nombre)
+
+                    elif comando == "JOIN_SALA":
+                        sala, ultimo_seq = ProtocoloServidor.procesar_union(datos)
+                        destino = self.cluster.redireccion(sala)
+                        if destino:
+                            self.enviar(sesion, "REDIRECT", f"{destino}|{sala}")
+                        elif self.ids_salas.id(sala) is None:
+                            self.enviar(sesion, "ERROR", "Se alcanzó el máximo de salas.")
+                        else:
+                            await self.unirse_sala(sesion, sala, ultimo_seq)
+
+                    elif comando == "HISTORY" and sesion.sala:
+                        try:
+                            antes_de = int(datos)
+                        except ValueError:
+                            antes_de = None
+                        await self.enviar_historial(sesion, sesion.sala, antes_de)
+
+                    elif comando == "MSG" and sesion.sala:
+                        sala = sesion.sala
+                        ts = marca_tiempo()
+                        inicio = time.perf_counter()
+                        try:
+                            seq = await asyncio.to_thread(
+                                self.historial.guardar, sala, sesion.nombre_o(), datos, ts
+                            )
+                        except Exception as e:
+                            log.error("[ERROR registro historial] %s", e)
+                            seq = None
+                        self.metricas.guardar.observar(time.perf_counter() - inicio)
+                        self.metricas.mensajes.inc(sala)
+                        self.retransmitir(sesion, sala, datos, seq, ts)
+
+                    elif comando == "USER_LIST":
+                        self.enviar(sesion, "USER_LIST",
+                                    await self.listar_usuarios("No se encuentra en una sala"))
+
+                    elif comando == "USER_LIST_ALL":
+                        self.enviar(sesion, "USER_LIST_ALL", await self.listar_usuarios("Sin sala"))
+
+                    elif comando == "ROOM_LIST":
+                        salas = self.salas_propias()
+                        if self.cluster.activo:
+                            salas = list(dict.fromkeys(salas + await asyncio.to_thread(self.cluster.salas_remotas)))
+                        self.enviar(sesion, "ROOM_LIST", ", ".join(salas) if salas else "No hay salas activas.")
+
+                    elif comando == "NODO_USUARIOS":
+                        # Consulta de otro nodo del clúster: solo los usuarios de este
+                        self.enviar(sesion, comando, codificar_usuarios(self.filas_usuarios()))
+
+                    elif comando == "NODO_SALAS":
+                        self.enviar(sesion, comando, "\n".join(self.salas_propias()))
+
+                    elif comando == "LEAVE_SALA":
+                        sala = datos
+                        if sala is not None and sesion.sala == sala:
+                            self.salas[sala].discard(sesion)
+                            sesion.sala = None
+                            self.retransmitir_evento(
+                                sesion, sala, f"{sesion.nombre_o()} ha salido de la sala {sala}."
+                            )
+                        self.enviar(sesion, "OK", f"Has salido de la sala {sala}.")
+
+                    elif comando == "SALIR":
+                        salir = True
+                        break
+
+                    else:
+                        self.enviar(sesion, "ERROR", f"Comando no reconocido: {comando}")
+
+                # Contrapresión solo sobre el propio cliente
+                await writer.drain()
+
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        except Exception as e:
+            log.error("[ERROR corrutina cliente] %s", e)
+        finally:
+            self.desconectar(sesion)
+
+    # ------------------ MÉTODOS AUXILIARES ------------------
+
+    def enviar(self, sesion, comando, datos=""):
+        """Encola una respuesta COMANDO#DATOS (o binaria, o comprimida) para el cliente (sin esperar)."""
+        sesion.conexion.write(self.compresion.comprimir(
+            sesion.compresor, ProtocoloServidor.trama(comando, datos, sesion.binario)
+        ))
+
+    def negociar(self, sesion, capacidades):
+        """Acepta las capacidades del HELLO (ver ServidorChat.negociar)."""
+        aceptadas = ProtocoloServidor.capacidades_aceptadas(capacidades)
+        if not aceptadas or sesion.binario or sesion.compresor is not None:
+            return
+        self.enviar(sesion, "CAPACIDADES", ",".join(aceptadas))
+        sesion.binario = CAPACIDAD_BINARIA in aceptadas
+        if CAPACIDAD_COMPRESION in aceptadas:
+            sesion.compresor = self.compresion.compresor()
+
+    def registrar_nombre(self, sesion, nombre):
+        """Asigna el nombre (copia registrada en USUARIOS) a la sesión; devuelve False si ya está en uso."""
+        nombre = USUARIOS.interno(nombre)
+        if nombre in self.nombres:
+            return False
+        if sesion.nombre is not None:
+            self.nombres.pop(sesion.nombre, None)
+        self.nombres[nombre] = sesion
+        sesion.nombre = nombre
+        return True
+
+    def escribir(self, sesion, trama):
+        """
+        Escribe una trama retransmitida aplicando la política de cliente lento.
+
+        Se comprime (si corresponde) después de decidir si se descarta: una
+        trama descartada nunca entra en el flujo zlib del cliente.
+
+        Returns:
+            bool: False si la trama se descartó o la conexión se cortó.
+        """
+        writer = sesion.conexion
+        if writer.is_closing():
+            return False
+        pendientes = writer.transport.get_write_buffer_size()
+        if pendientes and pendientes + len(trama) > config.LIMITE_COLA_SALIDA:
+            if config.POLITICA_CLIENTE_LENTO == DESCARTAR:
+                self.metricas_colas.registrar_descarte()
+                return False
+            # Cliente lento: abort() descarta el buffer y cierra de inmediato
+            self.metricas_colas.registrar_desconexion()
+            log.warning("[COLA] Cliente lento desconectado (cola de salida llena).")
+            writer.transport.abort()
+            return False
+        trama = self.compresion.comprimir(sesion.compresor, trama)
+        writer.write(trama)
+        self.metricas_colas.registrar_profundidad(pendientes + len(trama))
+        return True
+
+    async def unirse_sala(self, sesion, sala, despues_de=None):
+        """
+        Agrega un cliente a una sala (saliendo de la anterior), le envía la
+        confirmación y el historial, y notifica a los demás.
+
+        El historial se lee fuera del bucle; después, sin ceder el control,
+        se agrega lo guardado mientras tanto (solo de la caché en memoria, sin
+        ir al backend), se da el alta y se escriben la confirmación y el
+        historial. Así ninguna difusión de la sala llega al cliente antes del
+        historial (ver ServidorChat.unirse_sala). Si la caché ya descartó
+        parte de lo guardado mientras tanto, se vuelve a leer.
+        """
+        sala = self.ids_salas.interno(sala)
+        limite = config.REPLAY_MAX_MENSAJES
+        for _ in range(INTENTOS_UNION):
+            mensajes = await asyncio.to_thread(
+                self.historial.obtener_historial_sala, sala, ultimos=limite, despues_de=despues_de
+            )
+            desde = mensajes[-1].seq if mensajes else despues_de
+            recientes = self.historial.en_memoria(sala, despues_de=desde, ultimos=limite)
+            if recientes is not None:
+                break
+        else:
+            log.warning("[%s] La caché no alcanzó a cubrir lo guardado durante el alta; puede faltar historial.", sala)
+            recientes = []
+        mensajes = (mensajes + recientes)[-limite:]
+
+        anterior = sesion.sala
+        nombre = sesion.nombre_o()
+        if anterior is not None and anterior != sala:
+            self.salas[anterior].discard(sesion)
+            self.retransmitir_evento(sesion, anterior, f"{nombre} ha salido de la sala {anterior}.")
+        self.salas.setdefault(sala, set()).add(sesion)
+        sesion.sala = sala
+        if sesion.binario:
+            sesion.conexion.write(ProtocoloServidor.trama_sala(self.ids_salas.id(sala), sala))
+        self.enviar(sesion, "OK", f"Te has unido a la sala '{sala}'.")
+        self.escribir_historial(sesion, mensajes, primera_pagina=True)
+
+        log.info("[%s] ➤ %s se ha unido.", sala, nombre)
+        self.retransmitir_evento(sesion, sala, f"{nombre} se ha unido a la sala.")
+
+    async def enviar_historial(self, sesion, sala, antes_de):
+        """Envía la página de historial anterior a `antes_de` (ver ServidorChat.enviar_historial)."""
+        limite = config.REPLAY_MAX_MENSAJES if antes_de is None else config.REPLAY_PAGINA
+        mensajes = await asyncio.to_thread(
+            self.historial.obtener_historial_sala, sala, ultimos=limite, antes_de=antes_de
+        )
+        self.escribir_historial(sesion, mensajes, primera_pagina=antes_de is None)
+
+    def escribir_historial(self, sesion, mensajes, primera_pagina):
+        """Escribe un bloque de historial en una trama HISTORY (nada si la primera página está vacía)."""
+        if not mensajes and primera_pagina:
+            return
+        hay_mas = bool(mensajes) and mensajes[0].seq > 1
+        sesion.conexion.write(self.compresion.comprimir(sesion.compresor, ProtocoloServidor.trama_historial(
+            mensajes, hay_mas, sesion.binario, self.ids_salas.id(sesion.sala) if sesion.binario else 0
+        )))
+
+    def retransmitir(self, sesion, sala, mensaje, seq=None, ts=None):
+        """Envía un mensaje (con su secuencia y marca de tiempo) a todos los clientes de la sala."""
+        inicio = time.perf_counter()
+        trama = self.difusion.chat(self.ids_salas.id(sala), seq or 0, ts or 0, sesion.nombre_o(), mensaje)
+        entregas = 0
+        for s in list(self.salas.get(sala, ())):
+            entregas += self.escribir(s, trama.para(s))
+        self.difusion.registrar(trama, entregas)
+        self.metricas.difusion.observar(time.perf_counter() - inicio)
+
+    def retransmitir_evento(self, sesion, sala, mensaje):
+        """Envía notificación a todos los clientes de la sala, excepto al remitente."""
+        trama = self.difusion.trama("NOTIFY", mensaje)
+        entregas = 0
+        for s in list(self.salas.get(sala, ())):
+            if s is not sesion:
+                entregas += self.escribir(s, trama.para(s))
+        self.difusion.registrar(trama, entregas)
+
+    async def listar_usuarios(self, sin_sala):
+        """
+        Devuelve el texto 'nombre (sala), ...' de todos los usuarios conectados
+        (en un clúster, también los de los demás nodos).
+        """
+        filas = self.filas_usuarios()
+        if self.cluster.activo:
+            filas += await asyncio.to_thread(self.cluster.usuarios_remotos)
+        return texto_lista_usuarios(filas, sin_sala)
+
+    def filas_usuarios(self):
+        """Pares (nombre, sala) de los usuarios registrados en este nodo."""
+        return [(s.nombre, s.sala) for s in self.nombres.values()]
+
+    def salas_propias(self):
+        """Salas existentes que pertenecen a este nodo del clúster."""
+        return [s for s in self.salas if self.cluster.es_propia(s)]
+
+    def estadisticas_colas(self):
+        """Devuelve el estado de los buffers de salida (ver ServidorChat.estadisticas_colas)."""
+        # Copia de las claves: el puerto de métricas lo llama desde otro hilo
+        pendientes = [w.transport.get_write_buffer_size() for w in list(self.sesiones)]
+        return {
+            "conexiones": len(pendientes),
+            "pendientes_total": sum(pendientes),
+            "pendientes_max": max(pendientes, default=0),
+            "maxima_historica": self.metricas_colas.maxima,
+            "descartadas": self.metricas_colas.descartadas,
+            "desconexiones_lentos": self.metricas_colas.desconexiones,
+        }
+
+    def estadisticas_persistencia(self):
+        """Devuelve las métricas de la escritura diferida (ver ServidorChat.estadisticas_persistencia)."""
+        backend = self.historial.backend
+        return backend.estadisticas() if hasattr(backend, "estadisticas") else {}
+
+    def desconectar(self, sesion):
+        """Elimina el cliente de las estructuras, notifica a la sala y cierra la conexión."""
+        nombre = sesion.nombre_o("Usuario")
+        log.info("[-] %s se ha desconectado.", nombre)
+
+        sala = sesion.sala
+        if sala is not None:
+            self.salas[sala].discard(sesion)
+            sesion.sala = None
+            self.retransmitir(sesion, sala, f"{nombre} ha salido de la sala.")
+
+        self.sesiones.pop(sesion.conexion, None)
+        if sesion.nombre is not None and self.nombres.get(sesion.nombre) is sesion:
+            del self.nombres[sesion.nombre]
+
+        try:
+            sesion.conexion.close()
+        except Exception:
+            pass
+
+
+def _ampliar_limite_descriptores():
+    """
+    Sube el límite blando de descriptores abiertos al máximo permitido, ya que
+    cada conexión ocupa uno. No disponible en Windows.
+    """
+    try:
+        import resource
+        blando, duro = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if duro == resource.RLIM_INFINITY or duro > blando:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (duro, duro))
+    except (ImportError, ValueError, OSError):
+        pass
@@ -0,0 +1,327 @@
+"""
+persistencia_diferida.py — Escritura diferida (write-behind) del historial
+
+Envuelve un backend de almacenamiento con la misma interfaz. `guardar` asigna
+la secuencia del mensaje en memoria y lo deja en una cola acotada; un hilo de
+fondo toma los mensajes en grupos (por tamaño o por ventana de tiempo) y los
+escribe con `guardar_lote` del backend, pasándole las secuencias ya
+asignadas para que en disco queden las mismas que vieron los clientes (un
+grupo que no se pudo escribir deja un hueco, no un corrimiento). Así la
+latencia del disco no se suma a la del remitente.
+
+Durabilidad configurable:
+- "mensaje": `guardar` espera a que su grupo esté escrito y sincronizado
+  (commit en grupo: varios remitentes comparten un mismo fsync/commit), y
+  devuelve None si la escritura o la sincronización fallaron.
+- "intervalo": se sincroniza como máximo cada `intervalo` segundos.
+- "cierre": sin sincronizaciones extra; todo se vacía y sincroniza al cerrar
+  (el backend sigue aplicando su propio fsync/commit por lotes).
+"""
+
+import threading
+import time
+from collections import deque
+from almacenamiento import marca_tiempo
+from registro import log
+
+MENSAJE = "mensaje"
+INTERVALO = "intervalo"
+CIERRE = "cierre"
+
+
+class PersistenciaDiferida:
+    """
+    Cola de escritura diferida delante de un backend de historial.
+
+    Atributos:
+        backend: Almacenamiento real (guardar_lote / leer_historial_sala /
+            obtener_historial_sala / ultimo_seq / sincronizar / cerrar).
+        capacidad (int): Mensajes máximos en cola; si se llena, `guardar` espera.
+        lote_max (int): Mensajes máximos por grupo de escritura.
+        ventana (float): Segundos que el hilo espera para juntar un grupo.
+        durabilidad (str): MENSAJE, INTERVALO o CIERRE.
+        intervalo (float): Segundos entre sincronizaciones en modo INTERVALO.
+    """
+
+    def __init__(self, backend, capacidad=10000, lote_max=256, ventana=0.005,
+                 durabilidad=INTERVALO, intervalo=1.0):
+        self.backend = backend
+        self.capacidad = max(1, capacidad)
+        self.lote_max = max(1, lote_max)
+        self.ventana = ventana
+        self.durabilidad = durabilidad
+        self.intervalo = intervalo
+
+        self._cola = deque()
+        self._ultimos = {}              # {sala: última secuencia asignada}
+        self._cargas = {}               # {sala: Lock} de las salas cuya última secuencia se lee del backend
+        self._en_cola_por_sala = {}     # {sala: mensajes aún no escritos}
+        self._encolados = 0             # Total de mensajes aceptados
+        self._escritos = 0              # Total escrito en el backend
+        self._confirmados = 0           # Total escrito y sincronizado
+        self._fallidos = set()          # Turnos cuya escritura falló (durabilidad MENSAJE)
+        self._sin_sincronizar = False
+        self._forzar_sincronizacion = False
+        self._cerrado = False
+        self._condicion = threading.Condition()
+
+        # Métricas
+        self.lotes = 0
+        self.sincronizaciones = 0
+        self.esperas_cola_llena = 0
+        self.max_en_cola = 0
+        self.errores = 0
+
+        self._hilo = threading.Thread(target=self._escritor, daemon=True)
+        self._hilo.start()
+
+    # ------------------ INTERFAZ DE ALMACENAMIENTO ------------------
+
+    def guardar(self, sala, usuario, texto, ts=None):
+        """
+        Encola un mensaje y devuelve su secuencia sin esperar al disco (salvo
+        en durabilidad MENSAJE, donde espera a su commit en grupo). Sin `ts`,
+        la marca de tiempo se toma al encolar, no al escribir.
+
+        Returns:
+            int | None: Secuencia asignada al mensaje, o None si ya está cerrado
+            (o, en durabilidad MENSAJE, si no se pudo escribir).
+
+        Raises:
+            Exception: Si es el primer mensaje de la sala y no se puede leer su
+                última secuencia del backend.
+        """
+        self._cargar_ultimo(sala)
+        with self._condicion:
+            if self._cerrado:
+                return None
+            if len(self._cola) >= self.capacidad:
+                self.esperas_cola_llena += 1
+                while len(self._cola) >= self.capacidad and not self._cerrado:
+                    self._condicion.wait()
+                if self._cerrado:
+                    return None
+            seq = self._ultimos[sala] + 1
+            self._ultimos[sala] = seq
+            self._cola.append((sala, seq, usuario, texto, marca_tiempo() if ts is None else ts))
+            self._en_cola_por_sala[sala] = self._en_cola_por_sala.get(sala, 0) + 1
+            self._encolados += 1
+            turno = self._encolados
+            self.max_en_cola = max(self.max_en_cola, len(self._cola))
+            self._condicion.notify_all()
+
+            if self.durabilidad == MENSAJE:
+                while self._confirmados < turno and self._hilo.is_alive():
+                    self._condicion.wait()
+                if self._confirmados < turno or turno in self._fallidos:
+                    self._fallidos.discard(turno)
+                    return None
+        return seq
+
+    def leer_historial_sala(self, sala, ultimos=None, despues_de=None, antes_de=None):
+        """
+        Lee del backend (ver `obtener_historial_sala`); un error de lectura
+        se propaga.
+        """
+        self._esperar_sala(sala)
+        return self.backend.leer_historial_sala(
+            sala, ultimos=ultimos, despues_de=despues_de, antes_de=antes_de
+        )
+
+    def obtener_historial_sala(self, sala, ultimos=None, despues_de=None, antes_de=None):
+        """
+        Lee del backend; si la sala tiene mensajes en cola, primero espera a
+        que se escriban para que la lectura los incluya.
+        """
+        self._esperar_sala(sala)
+        return self.backend.obtener_historial_sala(
+            sala, ultimos=ultimos, despues_de=despues_de, antes_de=antes_de
+        )
+
+    def ultimo_seq(self, sala):
+        """Devuelve la última secuencia asignada en la sala (incluye mensajes en cola)."""
+        self._cargar_ultimo(sala)
+        with self._condicion:
+            return self._ultimos[sala]
+
+    def vaciar(self):
+        """Espera a que todo lo encolado hasta ahora esté escrito y sincronizado."""
+        with self._condicion:
+            turno = self._encolados
+            if self._escritos >= turno and not self._sin_sincronizar:
+                return
+            self._forzar_sincronizacion = True
+            self._condicion.notify_all()
+            while self._confirmados < turno and self._hilo.is_alive():
+                self._condicion.wait()
+
+    def estadisticas(self):
+        """
+        Devuelve las métricas de la cola de persistencia.
+
+        Returns:
+            dict: mensajes en cola, máximo observado, escritos, lotes, tamaño
+            medio de lote, sincronizaciones, esperas por cola llena y errores.
+        """
+        with self._condicion:
+            return {
+                "en_cola": len(self._cola),
+                "max_en_cola": self.max_en_cola,
+                "escritos": self._escritos,
+                "sin_confirmar": self._escritos - self._confirmados,
+                "lotes": self.lotes,
+                "lote_medio": self._escritos / self.lotes if self.lotes else 0.0,
+                "sincronizaciones": self.sincronizaciones,
+                "esperas_cola_llena": self.esperas_cola_llena,
+                "errores": self.errores,
+            }
+
+    def cerrar(self):
+        """Deja de aceptar mensajes, escribe y sincroniza lo pendiente y cierra el backend."""
+        with self._condicion:
+            pendientes = len(self._cola)
+            self._cerrado = True
+            self._condicion.notify_all()
+        if pendientes:
+            log.info("[HISTORIAL] Guardando %s mensajes pendientes...", pendientes)
+        self._hilo.join()
+        self.backend.cerrar()
+
+    # ------------------ HILO DE ESCRITURA ------------------
+
+    def _escritor(self):
+        """Toma grupos de la cola, los escribe y sincroniza según la durabilidad."""
+        ultima_sincronizacion = time.monotonic()
+        while True:
+            with self._condicion:
+                while not self._cola and not self._cerrado and not self._forzar_sincronizacion:
+                    espera = None
+                    if self.durabilidad == INTERVALO and self._sin_sincronizar:
+                        espera = max(0.0, ultima_sincronizacion + self.intervalo - time.monotonic())
+                        if espera == 0.0:
+                            break
+                    self._condicion.wait(espera)
+                if self._cola and self.ventana > 0:
+                    # Ventana de agrupación: dejar que lleguen más mensajes
+                    limite = time.monotonic() + self.ventana
+                    while len(self._cola) < self.lote_max and not self._cerrado:
+                        restante = limite - time.monotonic()
+                        if restante <= 0:
+                            break
+                        self._condicion.wait(restante)
+                lote = [self._cola.popleft() for _ in range(min(self.lote_max, len(self._cola)))]
+                terminar = self._cerrado and not self._cola
+                # Una sincronización pedida cubre todo lo encolado: se hace
+                # con el grupo que vacía la cola, no con uno intermedio
+                forzar = self._forzar_sincronizacion and not self._cola
+                if forzar:
+                    self._forzar_sincronizacion = False
+                self._condicion.notify_all()  # Hay espacio en la cola
+
+            if lote:
+                self._escribir(lote)
+
+            sincronizar = self._sin_sincronizar and (
+                terminar or forzar
+                or self.durabilidad == MENSAJE
+                or (self.durabilidad == INTERVALO
+                    and time.monotonic() - ultima_sincronizacion >= self.intervalo)
+            )
+            if sincronizar:
+                fallo = False
+                try:
+                    self.backend.sincronizar()
+                except Exception as e:
+                    fallo = True
+                    log.error("[ERROR SINCRONIZACIÓN HISTORIAL] %s", e)
+                ultima_sincronizacion = time.monotonic()
+                with self._condicion:
+                    if fallo:
+                        self.errores += 1
+                        self._marcar_fallidos(self._confirmados + 1, self._escritos + 1)
+                    self.sincronizaciones += 1
+                    self._sin_sincronizar = False
+                    self._confirmados = self._escritos
+                    self._condicion.notify_all()
+
+            if terminar:
+                return
+
+    def _escribir(self, lote):
+        """
+        Escribe un grupo en el backend con sus secuencias y actualiza contadores.
+
+        Si falla, o el backend guardó alguno con otra secuencia, la última
+        secuencia en memoria de esas salas se pone al día con la del backend
+        (nunca hacia atrás: los clientes ya vieron las asignadas).
+        """
+        desajustadas = set()
+        fallo = False
+        try:
+            seqs = self.backend.guardar_lote(
+                [(sala, usuario, texto, ts) for sala, _, usuario, texto, ts in lote],
+                seqs=[seq for _, seq, _, _, _ in lote],
+            )
+            for (sala, seq, _, _, _), asignada in zip(lote, seqs):
+                if asignada != seq:
+                    desajustadas.add(sala)
+                    log.error("[ERROR HISTORIAL] Secuencia %s en disco para el mensaje %s de '%s'", asignada, seq, sala)
+        except Exception as e:
+            fallo = True
+            desajustadas.update(sala for sala, _, _, _, _ in lote)
+            log.error("[ERROR AL GUARDAR HISTORIAL] %s mensajes: %s", len(lote), e)
+        en_disco = {}
+        for sala in desajustadas:
+            try:
+                en_disco[sala] = self.backend.ultimo_seq(sala)
+            except Exception as e:
+                log.error("[ERROR HISTORIAL] No se pudo leer la última secuencia de '%s': %s", sala, e)
+        with self._condicion:
+            for sala, ultimo in en_disco.items():
+                self._ultimos[sala] = max(self._ultimos.get(sala, 0), ultimo)
+            if fallo:
+                self.errores += 1
+                self._marcar_fallidos(self._escritos + 1, self._escritos + 1 + len(lote))
+            for sala, _, _, _, _ in lote:
+                restantes = self._en_cola_por_sala[sala] - 1
+                if restantes:
+                    self._en_cola_por_sala[sala] = restantes
+                else:
+                    del self._en_cola_por_sala[sala]
+            self._escritos += len(lote)
+            self.lotes += 1
+            self._sin_sincronizar = True
+            self._condicion.notify_all()
+
+    def _esperar_sala(self, sala):
+        """Si la sala tiene mensajes en cola, espera a que estén escritos."""
+        with self._condicion:
+            if self._en_cola_por_sala.get(sala):
+                turno = self._encolados
+                while self._escritos < turno and self._hilo.is_alive():
+                    self._condicion.wait()
+
+    def _marcar_fallidos(self, desde, hasta):
+        """Anota los turnos [desde, hasta) como fallidos para quienes esperan en durabilidad MENSAJE (con el lock tomado)."""
+        if self.durabilidad == MENSAJE:
+            self._fallidos.update(range(desde, hasta))
+
+    def _cargar_ultimo(self, sala):
+        """
+        La primera vez que se usa una sala, lee su última secuencia del
+        backend (en json, leer todo el archivo) sin el lock general, para no
+        frenar los guardados de las demás salas. Un lock por sala evita
+        lecturas repetidas; un error se propaga y la sala se vuelve a leer
+        en el próximo intento.
+        """
+        if sala in self._ultimos:
+            return
+        with self._condicion:
+            carga = self._cargas.setdefault(sala, threading.Lock())
+        with carga:
+            if sala in self._ultimos:
+                return
+            ultimo = self.backend.ultimo_seq(sala)
+            with self._condicion:
+                self._ultimos.setdefault(sala, ultimo)
+                self._cargas.pop(sala, None)
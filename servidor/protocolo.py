@@ -6,8 +6,195 @@ Proporciona:
 - Construcción de respuestas para clientes
 - Validación de comandos
 - Diccionario de comandos disponibles y su descripción
+- Entramado de mensajes sobre TCP (prefijo de longitud) y decodificador incremental
+
+Cada mensaje viaja como una trama: 4 bytes con la longitud en big-endian
+seguidos del texto COMANDO#DATOS codificado. TCP no conserva los límites de
+los envíos, así que varias tramas pueden llegar en un mismo recv() o una
+trama grande en varios; el decodificador las separa correctamente.
+
+Protocolo binario (capacidad "bin", negociada en el HELLO):
+    El cliente la ofrece con `HELLO#nombre|+bin`. Si el servidor la acepta
+    responde `CAPACIDADES#bin` en texto y desde ahí le envía tramas binarias:
+    longitud en varint (LEB128) seguida de un byte de código de comando
+    (OPCODES) y el cuerpo. CHAT e HISTORY llevan la secuencia, la marca de
+    tiempo y los largos como enteros de ancho fijo (se leen con una sola
+    llamada a struct), y la sala como un entero: tras JOIN_SALA el servidor
+    envía `SALA` (id + nombre) antes de la confirmación. Los demás comandos
+    llevan su texto en UTF-8.
+
+    El primer byte de una cabecera de texto es 0 (tramas de menos de 16 MiB)
+    y el de una binaria nunca lo es, así que el decodificador acepta ambas
+    en cualquier momento; los clientes antiguos siguen usando solo texto.
+
+Compresión (capacidad "zlib", negociada en el HELLO, con o sin "bin"):
+    Las tramas grandes del servidor al cliente van dentro de una trama
+    binaria COMPRIMIDA: su contenido comprimido en un flujo zlib por
+    conexión que empieza con DICCIONARIO_COMPRESION (ver compresion.py).
 """
 
+import struct
+import config
+
+# Cabecera de cada trama: longitud del contenido (uint32 big-endian)
+CABECERA = struct.Struct(">I")
+
+# Capacidades del HELLO: protocolo binario y compresión zlib
+CAPACIDAD_BINARIA = "bin"
+CAPACIDAD_COMPRESION = "zlib"
+
+# Código de un byte de cada comando en las tramas binarias. Todos son menores
+# que 0x20, así que no se confunden con la primera letra de una trama de texto.
+OPCODES = {
+    "HELLO": 1, "JOIN_SALA": 2, "MSG": 3, "USER_LIST": 4, "USER_LIST_ALL": 5,
+    "ROOM_LIST": 6, "HISTORY": 7, "LEAVE_SALA": 8, "SALIR": 9, "OK": 10,
+    "ERROR": 11, "NOTIFY": 12, "CHAT": 13, "REDIRECT": 14, "SALA": 15,
+    "CAPACIDADES": 16, "NODO_USUARIOS": 17, "NODO_SALAS": 18, "COMPRIMIDA": 19,
+}
+COMANDOS_OPCODE = {codigo: comando for comando, codigo in OPCODES.items()}
+
+# Cuerpos binarios de CHAT, HISTORY, SALA, JOIN_SALA y HISTORY (petición)
+CHAT_BINARIO = struct.Struct(">IIQH")       # sala_id, seq, ts, largo del usuario
+HISTORIAL_BINARIO = struct.Struct(">IIBI")  # sala_id, primer_seq, hay_mas, cantidad
+MENSAJE_BINARIO = struct.Struct(">IQHI")    # seq, ts, largo del usuario, largo del texto
+ENTERO_BINARIO = struct.Struct(">I")        # id de sala o secuencia
+
+# Diccionario inicial del flujo zlib de cada conexión (igual en el cliente):
+# textos frecuentes de las respuestas, los más comunes al final
+DICCIONARIO_COMPRESION = (
+    "CAPACIDADES#REDIRECT#ERROR#Comando no reconocido: No hay salas activas. "
+    "No hay usuarios conectados. ha salido de la sala  se ha unido a la sala. "
+    "OK#Te has unido a la sala 'ROOM_LIST#USER_LIST#USER_LIST_ALL#HISTORY#"
+    " (No se encuentra en una sala),  (Sin sala), "
+).encode("utf-8")
+
+# bytes de un solo byte ya creados (códigos y varints cortos)
+_BYTES = [bytes((i,)) for i in range(256)]
+
+
+def codificar_varint(valor):
+    """Codifica un entero no negativo en varint (LEB128: 7 bits por byte)."""
+    if valor < 0x80:
+        return _BYTES[valor]
+    salida = bytearray()
+    while valor > 0x7F:
+        salida.append((valor & 0x7F) | 0x80)
+        valor >>= 7
+    salida.append(valor)
+    return bytes(salida)
+
+
+def leer_varint(datos, posicion=0):
+    """
+    Lee un varint de `datos` desde `posicion`.
+
+    Returns:
+        tuple: (valor, posición siguiente)
+
+    Raises:
+        ValueError: Si el varint está incompleto o es demasiado largo.
+    """
+    if posicion < len(datos) and datos[posicion] < 0x80:
+        return datos[posicion], posicion + 1
+    valor = 0
+    desplazamiento = 0
+    while True:
+        if posicion >= len(datos) or desplazamiento > 63:
+            raise ValueError("Varint incompleto")
+        byte = datos[posicion]
+        posicion += 1
+        valor |= (byte & 0x7F) << desplazamiento
+        if byte < 0x80:
+            return valor, posicion
+        desplazamiento += 7
+
+
+class DecodificadorTramas:
+    """
+    Decodificador incremental de tramas con prefijo de longitud.
+
+    Mantiene un buffer de recepción reutilizable (para recv_into) y un buffer
+    acumulado con los bytes de tramas incompletas. Los bytes consumidos se
+    descartan una sola vez por lectura, no una vez por trama.
+
+    Acepta tramas de texto (cabecera de 4 bytes) y binarias (longitud en
+    varint) mezcladas; se distinguen por el primer byte (ver el docstring del
+    módulo). El contenido de una trama binaria empieza con su código de comando.
+
+    Atributos:
+        tamaño_maximo (int): Longitud máxima aceptada para una trama.
+    """
+
+    def __init__(self, tamaño_recepcion=4096, tamaño_maximo=1024 * 1024):
+        self.tamaño_maximo = tamaño_maximo
+        self.tamaño_recepcion = tamaño_recepcion
+        # El buffer de recepción se crea solo si se usa recibir() (no en asyncio)
+        self._recepcion = None
+        self._pendiente = bytearray()
+
+    def recibir(self, sock):
+        """
+        Lee del socket en el buffer reutilizable y devuelve las tramas completas.
+
+        Args:
+            sock (socket): Socket conectado en modo bloqueante.
+
+        Returns:
+            list | None: Lista de tramas (bytes) completas, posiblemente vacía,
+                         o None si el otro extremo cerró la conexión.
+        """
+        if self._recepcion is None:
+            self._recepcion = memoryview(bytearray(self.tamaño_recepcion))
+        n = sock.recv_into(self._recepcion)
+        if n == 0:
+            return None
+        return self.alimentar(self._recepcion[:n])
+
+    def alimentar(self, datos):
+        """
+        Añade bytes recibidos y extrae todas las tramas completas.
+
+        Args:
+            datos (bytes | memoryview): Bytes leídos de la conexión.
+
+        Returns:
+            list: Contenido (bytes) de cada trama completa, en orden.
+
+        Raises:
+            ValueError: Si una trama anuncia una longitud mayor que `tamaño_maximo`.
+        """
+        buffer = self._pendiente
+        buffer += datos
+        tramas = []
+        posicion = 0
+        disponible = len(buffer)
+        with memoryview(buffer) as vista:
+            while posicion < disponible:
+                if vista[posicion]:
+                    # Trama binaria: longitud en varint
+                    try:
+                        largo, inicio = leer_varint(vista, posicion)
+                    except ValueError:
+                        if disponible - posicion >= 10:
+                            raise
+                        break
+                else:
+                    if disponible - posicion < CABECERA.size:
+                        break
+                    (largo,) = CABECERA.unpack_from(vista, posicion)
+                    inicio = posicion + CABECERA.size
+                if largo > self.tamaño_maximo:
+                    raise ValueError(f"Trama demasiado grande ({largo} bytes)")
+                fin = inicio + largo
+                if fin > disponible:
+                    break
+                tramas.append(bytes(vista[inicio:fin]))
+                posicion = fin
+        if posicion:
+            del buffer[:posicion]
+        return tramas
+
+
 class ProtocoloServidor:
     """
     Clase estática que define el protocolo de mensajes entre cliente y servidor.
@@ -47,14 +234,270 @@ class ProtocoloServidor:
         """
         return f"{comando}#{datos}"
 
+    @staticmethod
+    def codificar_trama(mensaje):
+        """
+        Codifica un mensaje de texto como trama lista para enviar por el socket.
+
+        Args:
+            mensaje (str): Mensaje con formato COMANDO#DATOS
+
+        Returns:
+            bytes: Cabecera de longitud seguida del mensaje codificado
+        """
+        datos = mensaje.encode(config.CODIFICACION)
+        return CABECERA.pack(len(datos)) + datos
+
+    @staticmethod
+    def trama(comando, datos="", binario=False):
+        """
+        Atajo para construir_respuesta + codificar_trama.
+
+        Args:
+            binario (bool): Codificar como trama binaria (cliente que negoció "bin").
+
+        Returns:
+            bytes: Trama COMANDO#DATOS (o binaria) lista para enviar
+        """
+        if binario:
+            return ProtocoloServidor.trama_binaria(OPCODES[comando], datos.encode(config.CODIFICACION))
+        return ProtocoloServidor.codificar_trama(
+            ProtocoloServidor.construir_respuesta(comando, datos)
+        )
+
+    @staticmethod
+    def trama_binaria(opcode, cuerpo=b""):
+        """
+        Codifica una trama binaria: longitud en varint, código de comando y cuerpo.
+
+        Args:
+            opcode (int): Código del comando (ver OPCODES).
+            cuerpo (bytes): Cuerpo ya codificado.
+
+        Returns:
+            bytes: Trama lista para enviar
+        """
+        return codificar_varint(len(cuerpo) + 1) + _BYTES[opcode] + cuerpo
+
+    @staticmethod
+    def contenido(trama):
+        """
+        Contenido de una trama ya codificada, sin su cabecera (texto) o su
+        longitud en varint (binaria).
+
+        Returns:
+            memoryview: Vista del contenido (sin copiarlo).
+        """
+        vista = memoryview(trama)
+        if trama[0]:
+            return vista[leer_varint(trama)[1]:]
+        return vista[CABECERA.size:]
+
+    @staticmethod
+    def decodificar_trama(trama):
+        """
+        Convierte el contenido de una trama recibida en (comando, datos).
+
+        Las tramas binarias de JOIN_SALA y HISTORY se devuelven con los mismos
+        datos que su forma de texto ('sala|ultimo_seq' y la secuencia).
+
+        Args:
+            trama (bytes): Contenido de la trama (sin cabecera)
+
+        Returns:
+            tuple: (comando, datos) como en procesar_mensaje
+        """
+        if trama and trama[0] < 0x20:
+            return ProtocoloServidor.decodificar_binaria(trama)
+        return ProtocoloServidor.procesar_mensaje(
+            trama.decode(config.CODIFICACION, errors="replace")
+        )
+
+    @staticmethod
+    def decodificar_binaria(trama):
+        """
+        Convierte una trama binaria de un cliente en (comando, datos).
+
+        Un código desconocido o un cuerpo mal formado se devuelve como comando
+        'OPCODE_<n>' (no reconocido) o con datos vacíos.
+        """
+        comando = COMANDOS_OPCODE.get(trama[0])
+        if comando is None:
+            return f"OPCODE_{trama[0]}", ""
+        try:
+            if comando == "JOIN_SALA":
+                (ultimo_seq,) = ENTERO_BINARIO.unpack_from(trama, 1)
+                sala = trama[1 + ENTERO_BINARIO.size:].decode(config.CODIFICACION, errors="replace").strip()
+                return comando, f"{sala}|{ultimo_seq}"
+            if comando == "HISTORY":
+                return comando, str(ENTERO_BINARIO.unpack_from(trama, 1)[0])
+        except struct.error:
+            return comando, ""
+        return comando, trama[1:].decode(config.CODIFICACION, errors="replace").strip()
+
+    @staticmethod
+    def procesar_hello(datos):
+        """
+        Separa los datos de HELLO en nombre y capacidades ofrecidas.
+
+        Formato: <nombre>|+<capacidad>,<capacidad>...; el sufijo es opcional
+        (clientes antiguos).
+
+        Returns:
+            tuple: (nombre, frozenset de capacidades)
+        """
+        nombre, separador, capacidades = datos.rpartition("|")
+        if not separador or not capacidades.startswith("+"):
+            return datos, frozenset()
+        return nombre.strip(), frozenset(c.strip() for c in capacidades[1:].split(",") if c.strip())
+
+    @staticmethod
+    def capacidades_aceptadas(ofrecidas):
+        """
+        Capacidades del HELLO que este servidor acepta según la configuración.
+
+        Returns:
+            list: Capacidades aceptadas, en orden fijo (vacía si ninguna).
+        """
+        aceptadas = []
+        if config.PROTOCOLO_BINARIO and CAPACIDAD_BINARIA in ofrecidas:
+            aceptadas.append(CAPACIDAD_BINARIA)
+        if config.COMPRESION and CAPACIDAD_COMPRESION in ofrecidas:
+            aceptadas.append(CAPACIDAD_COMPRESION)
+        return aceptadas
+
+    @staticmethod
+    def construir_chat(seq, ts, usuario, texto):
+        """
+        Construye los datos de un mensaje de chat con su secuencia y marca de tiempo.
+
+        Formato: <seq>|<ts>|usuario: texto
+
+        Args:
+            seq (int): Secuencia del mensaje en su sala (0 si no se guardó).
+            ts (int): Marca de tiempo del servidor en milisegundos (0 si no se conoce).
+            usuario (str): Nombre del remitente.
+            texto (str): Contenido del mensaje.
+
+        Returns:
+            str: Datos de la trama CHAT (o de una línea de HISTORY)
+        """
+        return f"{seq}|{ts}|{usuario}: {texto}"
+
+    @staticmethod
+    def trama_chat(seq, ts, usuario, texto, binario=False, sala_id=0):
+        """
+        Codifica una trama CHAT de texto o binaria.
+
+        Cuerpo binario: CHAT_BINARIO (sala_id, seq, ts, largo del usuario),
+        el usuario y el texto (hasta el final de la trama), en UTF-8.
+
+        Returns:
+            bytes: Trama lista para enviar
+        """
+        if not binario:
+            return ProtocoloServidor.trama("CHAT", ProtocoloServidor.construir_chat(seq, ts, usuario, texto))
+        usuario = usuario.encode(config.CODIFICACION)
+        return ProtocoloServidor.trama_binaria(OPCODES["CHAT"], b"".join((
+            CHAT_BINARIO.pack(sala_id, seq, ts, len(usuario)), usuario, texto.encode(config.CODIFICACION),
+        )))
+
+    @staticmethod
+    def trama_sala(sala_id, sala):
+        """Trama binaria SALA que anuncia el id de una sala (se envía antes de confirmar JOIN_SALA)."""
+        return ProtocoloServidor.trama_binaria(
+            OPCODES["SALA"], ENTERO_BINARIO.pack(sala_id) + sala.encode(config.CODIFICACION)
+        )
+
+    @staticmethod
+    def procesar_union(datos):
+        """
+        Separa los datos de JOIN_SALA en nombre de sala y última secuencia vista.
+
+        Formato: <sala>|<ultimo_seq>; el sufijo es opcional (clientes antiguos).
+
+        Args:
+            datos (str): Datos del comando JOIN_SALA
+
+        Returns:
+            tuple: (sala, ultimo_seq) con ultimo_seq None si no se indicó o es 0
+        """
+        sala, separador, seq = datos.rpartition("|")
+        if not separador or not seq.strip().isdigit():
+            return datos, None
+        return sala.strip(), int(seq) or None
+
+    @staticmethod
+    def construir_historial(mensajes, hay_mas):
+        """
+        Construye una única trama HISTORY con un bloque de mensajes del historial.
+
+        Formato:
+            HISTORY#<primer_seq>|<hay_mas>
+            <seq>|<ts>|usuario: texto
+            <seq>|<ts>|usuario: texto
+            ...
+
+        Args:
+            mensajes (list): Registros Mensaje (mensaje.py) en orden de secuencia.
+            hay_mas (bool): True si existen mensajes anteriores al primero enviado.
+
+        Returns:
+            str: Trama lista para enviar al cliente
+        """
+        primer_seq = mensajes[0].seq if mensajes else 0
+        lineas = [f"{primer_seq}|{1 if hay_mas else 0}"]
+        lineas.extend(
+            ProtocoloServidor.construir_chat(msg.seq, msg.ts, msg.usuario, msg.texto)
+            for msg in mensajes
+        )
+        return ProtocoloServidor.construir_respuesta("HISTORY", "\n".join(lineas))
+
+    @staticmethod
+    def trama_historial(mensajes, hay_mas, binario=False, sala_id=0):
+        """
+        Codifica un bloque de historial como trama HISTORY de texto o binaria.
+
+        Cuerpo binario: HISTORIAL_BINARIO (sala_id, primer_seq, hay_mas,
+        cantidad) y, por mensaje, MENSAJE_BINARIO (seq, ts, largo del usuario,
+        largo del texto) seguido del usuario y el texto. Cada nombre de usuario
+        se codifica una vez por trama (por su id).
+
+        Args:
+            mensajes (list): Registros Mensaje (mensaje.py) en orden de secuencia.
+
+        Returns:
+            bytes: Trama lista para enviar
+        """
+        if not binario:
+            return ProtocoloServidor.codificar_trama(ProtocoloServidor.construir_historial(mensajes, hay_mas))
+        codificacion = config.CODIFICACION
+        empaquetar = MENSAJE_BINARIO.pack
+        partes = [HISTORIAL_BINARIO.pack(
+            sala_id, mensajes[0].seq if mensajes else 0, 1 if hay_mas else 0, len(mensajes)
+        )]
+        usuarios = {}
+        for msg in mensajes:
+            usuario = usuarios.get(msg.usuario_id)
+            if usuario is None:
+                usuario = usuarios[msg.usuario_id] = msg.usuario.encode(codificacion)
+            texto = msg.texto.encode(codificacion)
+            partes.append(empaquetar(msg.seq, msg.ts, len(usuario), len(texto)))
+            partes.append(usuario)
+            partes.append(texto)
+        return ProtocoloServidor.trama_binaria(OPCODES["HISTORY"], b"".join(partes))
+
     # Diccionario de comandos válidos y su descripción
     COMANDOS = {
-        "HELLO": "Registrar usuario nuevo.",
-        "JOIN_SALA": "Unirse o crear una sala.",
+        "HELLO": "Registrar usuario nuevo (nombre|+capacidades opcionales, p. ej. +bin,zlib).",
+        "JOIN_SALA": "Unirse o crear una sala (sala|última secuencia vista para recibir solo lo nuevo).",
         "MSG": "Enviar mensaje a los usuarios de la sala actual.",
         "USER_LIST": "Solicitar la lista de usuarios en la sala.",
         "ROOM_LIST": "Solicitar la lista de salas disponibles.",
+        "HISTORY": "Solicitar mensajes anteriores a una secuencia de la sala actual.",
         "SALIR": "Salir del chat.",
+        "NODO_USUARIOS": "Interno del clúster: usuarios de este nodo (nombre<TAB>sala por línea).",
+        "NODO_SALAS": "Interno del clúster: salas de este nodo (una por línea).",
     }
 
     @staticmethod
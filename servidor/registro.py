@@ -0,0 +1,81 @@
+"""
+registro.py — Registro (log) del servidor sin bloquear el camino caliente
+
+Los módulos del servidor escriben con `log.debug / info / warning / error`.
+`configurar()` deja en el logger un QueueHandler: cada llamada solo encola el
+registro y un hilo (QueueListener) lo formatea y lo escribe en stdout. Si la
+cola se llena, los mensajes nuevos se descartan y se cuentan, en lugar de
+frenar a los hilos que atienden clientes.
+
+Niveles (`config.NIVEL_REGISTRO`): "debug", "info", "aviso" o "error".
+"""
+
+import logging
+import logging.handlers
+import queue
+import sys
+
+NIVELES = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "aviso": logging.WARNING,
+    "error": logging.ERROR,
+}
+
+log = logging.getLogger("chat")
+
+_oyente = None
+
+
+class _ManejadorCola(logging.handlers.QueueHandler):
+    """QueueHandler que descarta (y cuenta) los registros si la cola está llena."""
+
+    def __init__(self, cola):
+        super().__init__(cola)
+        self.descartados = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+def configurar(nivel="info", capacidad=10000, salida=None):
+    """
+    Activa el registro asíncrono (una sola vez; las llamadas siguientes solo
+    cambian el nivel).
+
+    Args:
+        nivel (str): "debug", "info", "aviso" o "error".
+        capacidad (int): Registros máximos en espera de escribirse.
+        salida (file, opcional): Destino (por defecto, sys.stdout).
+    """
+    global _oyente
+    log.setLevel(NIVELES.get(nivel, logging.INFO))
+    if _oyente is not None:
+        return
+    cola = queue.Queue(max(1, capacidad))
+    escritor = logging.StreamHandler(salida or sys.stdout)
+    escritor.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(_ManejadorCola(cola))
+    log.propagate = False
+    _oyente = logging.handlers.QueueListener(cola, escritor)
+    _oyente.start()
+
+
+def descartados():
+    """Registros descartados porque la cola estaba llena."""
+    return sum(getattr(h, "descartados", 0) for h in log.handlers)
+
+
+def detener():
+    """Escribe los registros pendientes y detiene el hilo escritor."""
+    global _oyente
+    if _oyente is not None:
+        _oyente.stop()
+        for manejador in list(log.handlers):
+            if isinstance(manejador, _ManejadorCola):
+                log.removeHandler(manejador)
+        log.propagate = True
+        _oyente = None
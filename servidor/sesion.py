@@ -0,0 +1,84 @@
+"""
+sesion.py — Estado de cada conexión de cliente en el servidor
+
+Una `Sesion` agrupa todo lo que el servidor sabe de una conexión: el socket
+(o StreamWriter en asyncio), el nombre registrado, la sala actual y la cola
+de salida. Las salas guardan conjuntos de sesiones y cada sesión conoce su
+sala (índice inverso), así que saber en qué sala está un usuario, listar
+usuarios o limpiar una desconexión no requiere recorrer todas las salas.
+
+`Sala` agrega un lock propio a los miembros de cada sala del servidor con
+hilos, para que la actividad en una sala no compita con las demás.
+
+Ambas usan __slots__ (sin diccionario por instancia) y guardan el nombre
+y la sala como la copia registrada en identificadores.py, compartida por
+todas las sesiones.
+"""
+
+import threading
+
+
+class Sesion:
+    """
+    Conexión de un cliente.
+
+    Atributos:
+        conexion: Socket del cliente (servidor con hilos) o StreamWriter (asyncio).
+        direccion (tuple): Dirección remota.
+        nombre (str | None): Nombre registrado con HELLO.
+        sala (str | None): Sala actual (un cliente está en una sala a la vez).
+        cola (ColaSalida | None): Cola de salida (solo servidor con hilos).
+        id (int | None): Identificador en el bus de salas (solo servidor multiproceso).
+        binario (bool): El cliente negoció el protocolo binario en el HELLO.
+        compresor (CompresorConexion | None): Flujo zlib si negoció la compresión.
+    """
+
+    __slots__ = ("conexion", "direccion", "nombre", "sala", "cola", "id", "binario", "compresor")
+
+    def __init__(self, conexion, direccion=None, cola=None):
+        self.conexion = conexion
+        self.direccion = direccion
+        self.nombre = None
+        self.sala = None
+        self.cola = cola
+        self.id = None
+        self.binario = False
+        self.compresor = None
+
+    def nombre_o(self, defecto="Desconocido"):
+        """Devuelve el nombre registrado o `defecto` si aún no envió HELLO."""
+        return self.nombre if self.nombre else defecto
+
+
+class Sala:
+    """
+    Sala del servidor con hilos.
+
+    Atributos:
+        nombre (str): Nombre de la sala.
+        miembros (set): Sesiones que están en la sala.
+        lock (threading.Lock | LockMedido): Protege `miembros`.
+    """
+
+    __slots__ = ("nombre", "miembros", "lock")
+
+    def __init__(self, nombre, lock=None):
+        self.nombre = nombre
+        self.miembros = set()
+        self.lock = lock or threading.Lock()
+
+
+def texto_lista_usuarios(filas, sin_sala):
+    """
+    Construye el texto 'nombre (sala), ...' de USER_LIST / USER_LIST_ALL.
+
+    Args:
+        filas (list): Pares (nombre, sala) tomados de las sesiones registradas.
+        sin_sala (str): Texto para los usuarios que no están en ninguna sala.
+
+    Returns:
+        str: Lista lista para enviar al cliente.
+    """
+    if not filas:
+        return "No hay usuarios conectados."
+    return ", ".join(f"{nombre} ({sala if sala else sin_sala})" for nombre, sala in filas)
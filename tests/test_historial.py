@@ -0,0 +1,325 @@
+"""
+test_historial.py — Pruebas del historial y de la cola de salida del servidor
+
+Cubren los casos delicados de las capas que hay entre el núcleo del servidor
+y el disco, con backends y sockets falsos en lugar de archivos reales (salvo
+el índice, que trabaja sobre una carpeta temporal):
+- `IndiceHistorial`: reconstrucción con huecos de secuencia y líneas corruptas.
+- `CacheHistorial`: mensajes guardados mientras la sala se carga y cargas
+  fallidas que no deben quedar en caché.
+- `PersistenciaDiferida`: grupos fallidos en durabilidad "mensaje" y espera
+  a la sincronización antes de devolver la secuencia.
+- `ColaSalida`: el lote que se está enviando sigue contando para el límite.
+
+Ejecutar desde la raíz del proyecto:
+    python -m pytest -q tests
+"""
+
+import json
+import threading
+import time
+
+import pytest
+
+from test_protocolo import _cargar
+
+indice_historial, cache_historial, persistencia_diferida, cola_salida = _cargar(
+    "servidor", "indice_historial", "cache_historial", "persistencia_diferida", "cola_salida"
+)
+
+VACIO = indice_historial.VACIO
+
+
+def _esperar(condicion, espera=2.0):
+    """Espera (como máximo `espera` segundos) a que `condicion()` sea verdadera."""
+    limite = time.monotonic() + espera
+    while not condicion():
+        assert time.monotonic() < limite, "tiempo de espera agotado"
+        time.sleep(0.005)
+
+
+class BackendFalso:
+    """
+    Backend de historial en memoria con la interfaz de `Almacenamiento`.
+
+    Atributos:
+        mensajes (dict): {sala: [dict de mensaje]} guardados.
+        fallos_lectura (int): Lecturas que todavía deben fallar.
+        fallos_escritura (int): Llamadas a `guardar_lote` que todavía deben fallar.
+        fallos_sincronizacion (int): Llamadas a `sincronizar` que todavía deben fallar.
+        pausa (threading.Event | None): Si existe, `leer_historial_sala` avisa
+            en `leyendo` y espera a que se active antes de responder.
+    """
+
+    def __init__(self):
+        self.mensajes = {}
+        self.fallos_lectura = 0
+        self.fallos_escritura = 0
+        self.fallos_sincronizacion = 0
+        self.sincronizaciones = 0
+        self.pausa = None
+        self.leyendo = threading.Event()
+
+    def guardar(self, sala, usuario, texto, ts=None):
+        return self.guardar_lote([(sala, usuario, texto, ts)])[0]
+
+    def guardar_lote(self, mensajes, seqs=None):
+        if self.fallos_escritura:
+            self.fallos_escritura -= 1
+            raise OSError("disco lleno")
+        asignadas = []
+        for i, (sala, usuario, texto, ts) in enumerate(mensajes):
+            seq = seqs[i] if seqs else self.ultimo_seq(sala) + 1
+            self.mensajes.setdefault(sala, []).append(
+                {"sala": sala, "seq": seq, "usuario": usuario, "texto": texto, "ts": ts}
+            )
+            asignadas.append(seq)
+        return asignadas
+
+    def leer_historial_sala(self, sala, ultimos=None, despues_de=None, antes_de=None):
+        instantanea = list(self.mensajes.get(sala, []))
+        if self.pausa is not None:
+            self.leyendo.set()
+            self.pausa.wait(2.0)
+        if self.fallos_lectura:
+            self.fallos_lectura -= 1
+            raise OSError("lectura fallida")
+        seleccion = [
+            m for m in instantanea
+            if (despues_de is None or m["seq"] > despues_de)
+            and (antes_de is None or m["seq"] < antes_de)
+        ]
+        return seleccion[-ultimos:] if ultimos else seleccion
+
+    def obtener_historial_sala(self, sala, ultimos=None, despues_de=None, antes_de=None):
+        try:
+            return self.leer_historial_sala(sala, ultimos, despues_de, antes_de)
+        except OSError:
+            return []
+
+    def ultimo_seq(self, sala):
+        mensajes = self.mensajes.get(sala)
+        return mensajes[-1]["seq"] if mensajes else 0
+
+    def sincronizar(self):
+        if self.fallos_sincronizacion:
+            self.fallos_sincronizacion -= 1
+            raise OSError("fsync fallido")
+        self.sincronizaciones += 1
+
+    def cerrar(self):
+        pass
+
+
+# ------------------ ÍNDICE ------------------
+
+def _escribir_registro(ruta, lineas):
+    """Escribe un registro JSON Lines y devuelve el desplazamiento de cada línea."""
+    desplazamientos = []
+    with open(ruta, "wb") as f:
+        for linea in lineas:
+            desplazamientos.append(f.tell())
+            f.write(linea if isinstance(linea, bytes) else json.dumps(linea).encode("utf-8") + b"\n")
+    return desplazamientos
+
+
+def test_indice_reconstruye_con_huecos(tmp_path):
+    registro = tmp_path / "historial.jsonl"
+    d = _escribir_registro(registro, [
+        {"sala": "a", "seq": 1, "usuario": "u", "texto": "1"},
+        {"sala": "b", "seq": 7, "usuario": "u", "texto": "x"},
+        b"{corrupta\n",
+        {"sala": "a", "seq": 2, "usuario": "u", "texto": "2"},
+        {"sala": "a", "seq": 5, "usuario": "u", "texto": "5"},
+    ])
+    indice = indice_historial.IndiceHistorial(str(tmp_path / "indice"))
+
+    assert indice.reconstruir(str(registro)) == 1
+    assert indice.rango("a") == (1, [d[0], d[3], VACIO, VACIO, d[4]])
+    assert indice.rango("a", despues_de=2) == (3, [VACIO, VACIO, d[4]])
+    assert indice.rango("a", ultimos=1) == (5, [d[4]])
+    assert indice.rango("b") == (7, [d[1]])
+
+    # Repetir la indexación del mismo tramo no duplica entradas, y lo
+    # persistido se relee igual desde otra instancia
+    indice.reconstruir(str(registro))
+    releido = indice_historial.IndiceHistorial(str(tmp_path / "indice"))
+    assert releido.cubierto == registro.stat().st_size
+    assert releido.rango("a") == (1, [d[0], d[3], VACIO, VACIO, d[4]])
+
+
+def test_indice_registrar_con_secuencia(tmp_path):
+    indice = indice_historial.IndiceHistorial(str(tmp_path))
+    assert indice.registrar("a", 0, seq=3) == 3
+    assert indice.registrar("a", 10) == 4
+    assert indice.registrar("a", 20, seq=7) == 7
+    # Una secuencia ya usada no retrocede: se asigna la siguiente
+    assert indice.registrar("a", 30, seq=2) == 8
+    assert indice.rango("a") == (3, [0, 10, VACIO, VACIO, 20, 30])
+
+
+# ------------------ CACHÉ ------------------
+
+def test_cache_conserva_mensajes_guardados_durante_la_carga():
+    backend = BackendFalso()
+    for i in range(3):
+        backend.guardar("a", "u", str(i + 1))
+    backend.pausa = threading.Event()
+    cache = cache_historial.CacheHistorial(backend, mensajes_por_sala=10)
+
+    resultado = []
+    lector = threading.Thread(target=lambda: resultado.extend(cache.obtener_historial_sala("a")))
+    lector.start()
+    assert backend.leyendo.wait(2.0)
+    # La lectura ya tomó su instantánea (1..3); este mensaje solo llega por `_cargando`
+    assert cache.guardar("a", "u", "4") == 4
+    assert [m.seq for m in cache.en_memoria("a")] == [4]
+    backend.pausa.set()
+    lector.join(2.0)
+
+    assert [m.seq for m in resultado] == [1, 2, 3, 4]
+    assert [m.texto for m in cache.en_memoria("a", despues_de=2)] == ["3", "4"]
+    assert cache.ultimo_seq("a") == 4
+
+
+def test_cache_no_guarda_una_carga_fallida():
+    backend = BackendFalso()
+    backend.guardar("a", "u", "1")
+    backend.fallos_lectura = 2  # La carga y la lectura de respaldo
+    cache = cache_historial.CacheHistorial(backend, mensajes_por_sala=10)
+
+    assert cache.obtener_historial_sala("a") == []
+    assert cache.estadisticas()["salas"] == 0
+    assert cache.en_memoria("a") == []
+
+    # El siguiente acceso vuelve a cargar la sala
+    assert [m.texto for m in cache.obtener_historial_sala("a")] == ["1"]
+    assert cache.estadisticas()["salas"] == 1
+
+
+def test_cache_en_memoria_detecta_mensajes_descartados():
+    backend = BackendFalso()
+    cache = cache_historial.CacheHistorial(backend, mensajes_por_sala=3)
+    cache.obtener_historial_sala("a")
+    for i in range(5):
+        cache.guardar("a", "u", str(i + 1))
+
+    assert [m.seq for m in cache.en_memoria("a", despues_de=2)] == [3, 4, 5]
+    # El 2 ya salió del buffer: quien leyó hasta el 1 tiene que releer
+    assert cache.en_memoria("a", despues_de=1) is None
+    assert [m.seq for m in cache.en_memoria("a", despues_de=1, ultimos=2)] == [4, 5]
+
+
+# ------------------ PERSISTENCIA DIFERIDA ------------------
+
+@pytest.fixture
+def diferida():
+    """Cola de escritura diferida en durabilidad "mensaje" sobre un BackendFalso."""
+    backend = BackendFalso()
+    persistencia = persistencia_diferida.PersistenciaDiferida(
+        backend, ventana=0, durabilidad=persistencia_diferida.MENSAJE
+    )
+    yield persistencia, backend
+    persistencia.cerrar()
+
+
+def test_mensaje_espera_escritura_y_sincronizacion(diferida):
+    persistencia, backend = diferida
+    assert persistencia.guardar("a", "u", "1") == 1
+    # Al volver, el mensaje ya está escrito y sincronizado
+    assert [m["seq"] for m in backend.mensajes["a"]] == [1]
+    assert backend.sincronizaciones >= 1
+    assert persistencia.estadisticas()["sin_confirmar"] == 0
+
+
+def test_mensaje_devuelve_none_si_falla_la_escritura(diferida):
+    persistencia, backend = diferida
+    backend.fallos_escritura = 1
+    assert persistencia.guardar("a", "u", "1") is None
+    assert persistencia._fallidos == set()
+    # La secuencia 1 ya se asignó: el siguiente deja el hueco, no la repite
+    assert persistencia.guardar("a", "u", "2") == 2
+    assert [m["seq"] for m in backend.mensajes["a"]] == [2]
+    assert persistencia.estadisticas()["errores"] == 1
+
+
+def test_mensaje_devuelve_none_si_falla_la_sincronizacion(diferida):
+    persistencia, backend = diferida
+    backend.fallos_sincronizacion = 1
+    assert persistencia.guardar("a", "u", "1") is None
+    assert persistencia._fallidos == set()
+    assert persistencia.guardar("a", "u", "2") == 2
+
+
+def test_ultimo_seq_del_backend_no_se_supone_cero():
+    backend = BackendFalso()
+    backend.guardar("a", "u", "1")
+    persistencia = persistencia_diferida.PersistenciaDiferida(backend, ventana=0)
+    try:
+        backend.ultimo_seq = lambda sala: 1 / 0
+        with pytest.raises(ZeroDivisionError):
+            persistencia.guardar("a", "u", "2")
+        del backend.ultimo_seq
+        assert persistencia.guardar("a", "u", "2") == 2
+    finally:
+        persistencia.cerrar()
+
+
+def test_vaciar_sincroniza_todo_lo_encolado():
+    backend = BackendFalso()
+    persistencia = persistencia_diferida.PersistenciaDiferida(
+        backend, capacidad=2, lote_max=1, ventana=0, durabilidad=persistencia_diferida.CIERRE
+    )
+    try:
+        for i in range(50):
+            persistencia.guardar("a", "u", str(i))
+        # Con grupos de un mensaje, la sincronización pedida no debe quedarse
+        # en un grupo intermedio y dejar a `vaciar` esperando
+        hilo = threading.Thread(target=persistencia.vaciar, daemon=True)
+        hilo.start()
+        hilo.join(2.0)
+        assert not hilo.is_alive()
+        assert persistencia.estadisticas()["sin_confirmar"] == 0
+        assert len(backend.mensajes["a"]) == 50
+    finally:
+        persistencia.cerrar()
+
+
+# ------------------ COLA DE SALIDA ------------------
+
+class SocketLento:
+    """Socket falso cuyo `sendall` espera a `liberar` antes de aceptar los datos."""
+
+    def __init__(self):
+        self.liberar = threading.Event()
+        self.enviando = threading.Event()
+        self.enviados = []
+
+    def sendall(self, datos):
+        self.enviando.set()
+        self.liberar.wait(2.0)
+        self.enviados.append(bytes(datos))
+
+    def shutdown(self, como):
+        pass
+
+
+def test_cola_cuenta_el_lote_en_envio():
+    sock = SocketLento()
+    cola = cola_salida.ColaSalida(sock, limite=100, politica=cola_salida.DESCARTAR)
+    try:
+        assert cola.encolar(b"x" * 60)
+        assert sock.enviando.wait(2.0)
+        # El escritor ya sacó la trama de la cola pero sigue enviándola
+        assert cola.pendientes == 60
+        assert not cola.encolar(b"y" * 60)
+        assert cola.metricas.descartadas == 1
+
+        sock.liberar.set()
+        _esperar(lambda: cola.pendientes == 0)
+        assert cola.encolar(b"z" * 60)
+        _esperar(lambda: cola.pendientes == 0)
+        assert sock.enviados == [b"x" * 60, b"z" * 60]
+    finally:
+        sock.liberar.set()
+        cola.cerrar()
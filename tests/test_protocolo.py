@@ -0,0 +1,340 @@
+"""
+test_protocolo.py — Pruebas del protocolo entre cliente y servidor
+
+El cliente (cliente/protocolo_cliente.py) y el servidor (servidor/protocolo.py)
+se distribuyen por separado y cada uno lleva su copia de la tabla de códigos,
+los structs de los cuerpos binarios y el diccionario de compresión. Estas
+pruebas comprueban que las copias coinciden y que lo que codifica un extremo
+lo decodifica el otro: tramas de texto, binarias (varint), mezcladas y
+partidas entre lecturas, la negociación de capacidades del HELLO y el flujo
+zlib de las tramas COMPRIMIDA.
+
+Cada lado importa su propio módulo `config`, así que se cargan por separado
+(ver `_cargar`).
+
+Ejecutar desde la raíz del proyecto:
+    python -m pytest -q tests
+"""
+
+import importlib
+import socket
+import sys
+from pathlib import Path
+
+import pytest
+
+RAIZ = Path(__file__).resolve().parent.parent
+
+
+def _cargar(carpeta, *modulos):
+    """
+    Importa módulos de `carpeta` (servidor o cliente) con el config de esa carpeta.
+
+    Los módulos conservan la referencia al config con el que se importaron,
+    así que después se puede cargar el otro lado sin que se mezclen.
+
+    Returns:
+        list: Los módulos importados, en el orden pedido.
+    """
+    ruta = str(RAIZ / carpeta)
+    sys.modules.pop("config", None)
+    sys.path.insert(0, ruta)
+    try:
+        return [importlib.import_module(nombre) for nombre in modulos]
+    finally:
+        sys.path.remove(ruta)
+        sys.modules.pop("config", None)
+
+
+protocolo, compresion, mensaje = _cargar("servidor", "protocolo", "compresion", "mensaje")
+protocolo_cliente, nucleo_cliente = _cargar("cliente", "protocolo_cliente", "nucleo_cliente")
+
+ProtocoloServidor = protocolo.ProtocoloServidor
+ProtocoloCliente = protocolo_cliente.ProtocoloCliente
+
+
+def _mensajes(*datos):
+    """Registros Mensaje del servidor a partir de tuplas (seq, ts, usuario, texto)."""
+    return [mensaje.Mensaje(*d) for d in datos]
+
+
+def _servidor_a_cliente(*tramas, trozo=None, descompresor=None):
+    """
+    Pasa tramas del servidor por el decodificador del cliente.
+
+    Args:
+        trozo (int | None): Alimentar de `trozo` en `trozo` bytes (None = todo junto).
+
+    Returns:
+        list: (comando, datos, sala) de cada trama, como `decodificar_trama`.
+    """
+    datos = b"".join(tramas)
+    trozo = trozo or len(datos)
+    decodificador = protocolo_cliente.DecodificadorTramas(binario=True)
+    recibidas = []
+    for inicio in range(0, len(datos), trozo):
+        recibidas.extend(decodificador.alimentar(datos[inicio:inicio + trozo]))
+    salas = {}
+    return [ProtocoloCliente.decodificar_trama(t, salas, descompresor) for t in recibidas]
+
+
+def _cliente_a_servidor(*tramas, trozo=None):
+    """Pasa tramas del cliente por el decodificador del servidor; devuelve (comando, datos) de cada una."""
+    datos = b"".join(tramas)
+    trozo = trozo or len(datos)
+    decodificador = protocolo.DecodificadorTramas()
+    recibidas = []
+    for inicio in range(0, len(datos), trozo):
+        recibidas.extend(decodificador.alimentar(datos[inicio:inicio + trozo]))
+    return [ProtocoloServidor.decodificar_trama(t) for t in recibidas]
+
+
+# --- Tablas compartidas ----------------------------------------------------
+
+@pytest.mark.parametrize("nombre", [
+    "OPCODES", "COMANDOS_OPCODE", "CAPACIDAD_BINARIA", "CAPACIDAD_COMPRESION", "DICCIONARIO_COMPRESION",
+])
+def test_constantes_iguales(nombre):
+    assert getattr(protocolo, nombre) == getattr(protocolo_cliente, nombre)
+
+
+@pytest.mark.parametrize("nombre", [
+    "CABECERA", "CHAT_BINARIO", "HISTORIAL_BINARIO", "MENSAJE_BINARIO", "ENTERO_BINARIO",
+])
+def test_structs_iguales(nombre):
+    assert getattr(protocolo, nombre).format == getattr(protocolo_cliente, nombre).format
+
+
+def test_codificacion_igual():
+    assert protocolo.config.CODIFICACION == protocolo_cliente.config.CODIFICACION
+
+
+def test_opcodes_no_chocan_con_texto():
+    # Un código debe ser distinto de 0 (primer byte de una cabecera de texto)
+    # y menor que 0x20 (primer byte de un comando de texto)
+    assert all(0 < codigo < 0x20 for codigo in protocolo.OPCODES.values())
+    assert len(set(protocolo.OPCODES.values())) == len(protocolo.OPCODES)
+
+
+# --- Varint ----------------------------------------------------------------
+
+@pytest.mark.parametrize("valor", [0, 1, 0x7F, 0x80, 300, 0x3FFF, 0x4000, 2 ** 32 - 1, 2 ** 63 - 1])
+def test_varint_ida_y_vuelta(valor):
+    for codificar, leer in (
+        (protocolo.codificar_varint, protocolo_cliente.leer_varint),
+        (protocolo_cliente.codificar_varint, protocolo.leer_varint),
+    ):
+        datos = codificar(valor)
+        assert leer(b"x" + datos, 1) == (valor, 1 + len(datos))
+
+
+def test_varint_incompleto():
+    datos = protocolo.codificar_varint(300)
+    for leer in (protocolo.leer_varint, protocolo_cliente.leer_varint):
+        with pytest.raises(ValueError):
+            leer(datos[:-1])
+
+
+# --- Servidor -> cliente ---------------------------------------------------
+
+def test_texto_ida_y_vuelta():
+    tramas = [
+        ProtocoloServidor.trama("OK", "Te has unido a la sala 'café'"),
+        ProtocoloServidor.trama("ERROR", ""),
+        ProtocoloServidor.trama("USER_LIST", "ana, luis"),
+    ]
+    assert _servidor_a_cliente(*tramas) == [
+        ("OK", "Te has unido a la sala 'café'", None),
+        ("ERROR", "", None),
+        ("USER_LIST", "ana, luis", None),
+    ]
+
+
+def test_trama_binaria_de_texto():
+    assert _servidor_a_cliente(ProtocoloServidor.trama("NOTIFY", "ana se ha unido", binario=True)) == [
+        ("NOTIFY", "ana se ha unido", None),
+    ]
+
+
+@pytest.mark.parametrize("binario", [False, True])
+def test_chat_ida_y_vuelta(binario):
+    tramas = [ProtocoloServidor.trama_chat(41, 1700000000123, "ñandú", "hola | mundo: sí", binario, sala_id=3)]
+    if binario:
+        tramas.insert(0, ProtocoloServidor.trama_sala(3, "general"))
+    recibidas = _servidor_a_cliente(*tramas)
+    comando, datos, sala = recibidas[-1]
+    assert comando == "CHAT"
+    assert ProtocoloCliente.procesar_chat(datos) == (41, 1700000000123, "ñandú: hola | mundo: sí")
+    assert sala == ("general" if binario else None)
+
+
+@pytest.mark.parametrize("binario", [False, True])
+@pytest.mark.parametrize("hay_mas", [False, True])
+def test_historial_ida_y_vuelta(binario, hay_mas):
+    mensajes = _mensajes((10, 1000, "ana", "uno"), (11, 0, "luis", "dos"), (12, 2000, "ana", "tres: ñ"))
+    tramas = [ProtocoloServidor.trama_historial(mensajes, hay_mas, binario, sala_id=9)]
+    if binario:
+        tramas.insert(0, ProtocoloServidor.trama_sala(9, "sala b"))
+    comando, datos, sala = _servidor_a_cliente(*tramas)[-1]
+    assert comando == "HISTORY"
+    assert ProtocoloCliente.procesar_historial(datos) == (10, hay_mas, [
+        (10, 1000, "ana: uno"), (11, 0, "luis: dos"), (12, 2000, "ana: tres: ñ"),
+    ])
+    assert sala == ("sala b" if binario else None)
+
+
+@pytest.mark.parametrize("binario", [False, True])
+def test_historial_vacio(binario):
+    comando, datos, _ = _servidor_a_cliente(ProtocoloServidor.trama_historial([], False, binario))[-1]
+    assert comando == "HISTORY"
+    assert ProtocoloCliente.procesar_historial(datos) == (0, False, [])
+
+
+# --- Cliente -> servidor ---------------------------------------------------
+
+@pytest.mark.parametrize("binario", [False, True])
+@pytest.mark.parametrize("comando, datos", [
+    ("JOIN_SALA", "sala con espacios|42"),
+    ("JOIN_SALA", "general|0"),
+    ("HISTORY", "17"),
+    ("MSG", "hola # ñ"),
+    ("USER_LIST", ""),
+    ("SALIR", ""),
+])
+def test_comandos_del_cliente(binario, comando, datos):
+    trama = ProtocoloCliente.codificar(comando, datos, binario)
+    assert _cliente_a_servidor(trama) == [(comando, datos)]
+
+
+# --- Tramas mezcladas y partidas entre lecturas ----------------------------
+
+def _mezcla_del_servidor():
+    """Tramas de texto y binarias seguidas, con una binaria de varint de varios bytes."""
+    largos = _mensajes(*((seq, seq, f"u{seq}", "x" * 50) for seq in range(1, 40)))
+    return [
+        ProtocoloServidor.trama("CAPACIDADES", "bin,zlib"),
+        ProtocoloServidor.trama_sala(1, "general"),
+        ProtocoloServidor.trama("OK", "Te has unido a la sala 'general'", binario=True),
+        ProtocoloServidor.trama_historial(largos, True, binario=True, sala_id=1),
+        ProtocoloServidor.trama("NOTIFY", "texto otra vez"),
+        ProtocoloServidor.trama_chat(40, 0, "ana", "fin", binario=True, sala_id=1),
+    ]
+
+
+@pytest.mark.parametrize("trozo", [1, 2, 3, 5, 64, 1000])
+def test_mezcla_partida_servidor_a_cliente(trozo):
+    tramas = _mezcla_del_servidor()
+    assert tramas[3][0] & 0x80  # longitud en varint de varios bytes
+    assert _servidor_a_cliente(*tramas, trozo=trozo) == _servidor_a_cliente(*tramas)
+    assert [c for c, _, _ in _servidor_a_cliente(*tramas, trozo=trozo)] == [
+        "CAPACIDADES", "SALA", "OK", "HISTORY", "NOTIFY", "CHAT",
+    ]
+
+
+@pytest.mark.parametrize("trozo", [1, 2, 3, 5, 64])
+def test_mezcla_partida_cliente_a_servidor(trozo):
+    tramas = [
+        ProtocoloCliente.codificar("HELLO", "ana|+bin,zlib"),
+        ProtocoloCliente.codificar("JOIN_SALA", "general|7", binario=True),
+        ProtocoloCliente.codificar("MSG", "m" * 300, binario=True),
+        ProtocoloCliente.codificar("ROOM_LIST", ""),
+        ProtocoloCliente.codificar("HISTORY", "5", binario=True),
+    ]
+    assert _cliente_a_servidor(*tramas, trozo=trozo) == [
+        ("HELLO", "ana|+bin,zlib"), ("JOIN_SALA", "general|7"), ("MSG", "m" * 300),
+        ("ROOM_LIST", ""), ("HISTORY", "5"),
+    ]
+
+
+def test_recibir_con_buffer_pequeño():
+    # recv() de pocos bytes: cada trama llega repartida en varias lecturas
+    tramas = _mezcla_del_servidor()
+    cliente, servidor = socket.socketpair()
+    try:
+        servidor.sendall(b"".join(tramas))
+        servidor.close()
+        decodificador = protocolo_cliente.DecodificadorTramas(
+            tamaño_recepcion=3, recepcion_maxima=3, binario=True)
+        recibidas = []
+        while (leidas := decodificador.recibir(cliente)) is not None:
+            recibidas.extend(leidas)
+    finally:
+        cliente.close()
+    assert recibidas == [bytes(ProtocoloServidor.contenido(t)) for t in tramas]
+
+
+def test_trama_demasiado_grande():
+    for decodificador in (protocolo.DecodificadorTramas(tamaño_maximo=100),
+                          protocolo_cliente.DecodificadorTramas(tamaño_maximo=100, binario=True)):
+        with pytest.raises(ValueError):
+            decodificador.alimentar(protocolo.codificar_varint(101) + b"\x03")
+        with pytest.raises(ValueError):
+            decodificador.alimentar(protocolo.CABECERA.pack(101))
+
+
+# --- Negociación del HELLO y compresión ------------------------------------
+
+@pytest.mark.parametrize("datos, esperado", [
+    ("ana|+bin,zlib", ("ana", frozenset({"bin", "zlib"}))),
+    ("ana|+zlib", ("ana", frozenset({"zlib"}))),
+    ("ana|+", ("ana", frozenset())),
+    ("ana", ("ana", frozenset())),
+    ("a|b", ("a|b", frozenset())),
+])
+def test_procesar_hello(datos, esperado):
+    assert ProtocoloServidor.procesar_hello(datos) == esperado
+
+
+@pytest.mark.parametrize("binario_servidor, compresion_servidor", [
+    (True, True), (True, False), (False, True), (False, False),
+])
+def test_negociacion(monkeypatch, binario_servidor, compresion_servidor):
+    monkeypatch.setattr(protocolo.config, "PROTOCOLO_BINARIO", binario_servidor)
+    monkeypatch.setattr(protocolo.config, "COMPRESION", compresion_servidor)
+    monkeypatch.setattr(protocolo_cliente.config, "PROTOCOLO_BINARIO", True)
+    monkeypatch.setattr(protocolo_cliente.config, "COMPRESION", True)
+
+    cliente = nucleo_cliente.BackendCliente()
+    cliente.nombre = "ana"
+    ((comando, datos),) = _cliente_a_servidor(ProtocoloCliente.codificar("HELLO", cliente._datos_hello()))
+    assert comando == "HELLO"
+    nombre, ofrecidas = ProtocoloServidor.procesar_hello(datos)
+    assert nombre == "ana"
+    aceptadas = ProtocoloServidor.capacidades_aceptadas(ofrecidas)
+
+    respuesta = protocolo_cliente.DecodificadorTramas(binario=True).alimentar(
+        ProtocoloServidor.trama("CAPACIDADES", ",".join(aceptadas)))
+    assert cliente._decodificar(respuesta[0]) is None
+    assert cliente.binario is binario_servidor
+    assert (cliente._descompresor is not None) is compresion_servidor
+
+
+def test_hello_sin_capacidades(monkeypatch):
+    monkeypatch.setattr(protocolo_cliente.config, "PROTOCOLO_BINARIO", False)
+    monkeypatch.setattr(protocolo_cliente.config, "COMPRESION", False)
+    cliente = nucleo_cliente.BackendCliente()
+    cliente.nombre = "ana"
+    nombre, ofrecidas = ProtocoloServidor.procesar_hello(cliente._datos_hello())
+    assert (nombre, ProtocoloServidor.capacidades_aceptadas(ofrecidas)) == ("ana", [])
+
+
+def test_compresion_ida_y_vuelta():
+    # Varias tramas en el mismo flujo zlib, alternando comprimidas y no comprimidas
+    comprimir = compresion.Compresion(umbral=200, nivel=6)
+    flujo = comprimir.compresor()
+    mensajes = _mensajes(*((seq, seq * 10, "ana", "mensaje largo " * 5) for seq in range(1, 20)))
+    tramas = [
+        ProtocoloServidor.trama_sala(2, "general"),
+        ProtocoloServidor.trama_historial(mensajes, False, binario=True, sala_id=2),
+        ProtocoloServidor.trama("OK", "corta", binario=True),
+        ProtocoloServidor.trama("ROOM_LIST", ", ".join(f"sala{i}" for i in range(100))),
+        ProtocoloServidor.trama_chat(20, 200, "ana", "z" * 300, binario=True, sala_id=2),
+    ]
+    enviadas = [comprimir.comprimir(flujo, t) for t in tramas]
+    comprimidas = [t for t in enviadas if ProtocoloServidor.contenido(t)[0] == protocolo.OPCODES["COMPRIMIDA"]]
+    assert len(comprimidas) == 3
+
+    for trozo in (None, 1, 7):
+        recibidas = _servidor_a_cliente(*enviadas, trozo=trozo, descompresor=ProtocoloCliente.descompresor())
+        assert recibidas == _servidor_a_cliente(*tramas)
+    assert comprimir.estadisticas()["tramas"] == 3